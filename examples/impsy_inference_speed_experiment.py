@@ -1,6 +1,9 @@
 """
 Experiment to compare inference speeds between keras and tflite models.
 24 Aug 2024.
+
+See also the `bench` command (`./start_impsy.py bench --help`) which sweeps
+model sizes and backends and writes latency percentiles to a JSON file.
 """
 
 import numpy as np
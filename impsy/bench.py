@@ -0,0 +1,596 @@
+"""impsy.bench: Functions and commands for benchmarking the latency and throughput of IMPSY models and IO."""
+
+import time
+import asyncio
+import bisect
+import datetime
+import importlib.metadata
+import itertools
+import json
+import platform
+import socket
+import tempfile
+from pathlib import Path
+from threading import Thread
+import click
+import numpy as np
+from pythonosc import udp_client
+from .train import PRECISIONS
+from .utils import get_config_data
+
+
+LATENCY_WARMUP_STEPS = 10  # first predictions are slower due to setup, so they are not measured.
+
+
+def generate_latencies(model, steps: int = 200, warmup: int = LATENCY_WARMUP_STEPS) -> np.ndarray:
+    """Times a number of model.generate() calls, feeding each prediction back in as the next input.
+    Returns the latency of each measured call in nanoseconds."""
+    import impsy.mdrnn as mdrnn
+
+    value = mdrnn.random_sample(out_dim=model.dimension)
+    for _ in range(warmup):
+        value = mdrnn.proc_generated_touch(model.generate(value), model.dimension)
+    latencies = np.zeros(steps, dtype=np.int64)
+    for i in range(steps):
+        start = time.perf_counter_ns()
+        value = model.generate(value)
+        latencies[i] = time.perf_counter_ns() - start
+        value = mdrnn.proc_generated_touch(value, model.dimension)
+    model.reset_lstm_states()  # don't leave benchmark state in a model that might be used.
+    return latencies
+
+
+def latency_summary(latencies_ns: np.ndarray) -> dict:
+    """Summarises a list of latencies in nanoseconds as mean, percentiles and maximum in milliseconds."""
+    latencies_ms = np.asarray(latencies_ns, dtype=np.float64) / 1e6
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(latencies_ms.max()),
+    }
+
+
+def build_benchmark_model_files(dimension: int, units: int, mixes: int, layers: int, location: Path) -> dict:
+    """Builds an untrained inference MDRNN and saves it in each backend's file format.
+    Returns a dict mapping backend name to model file."""
+    import impsy.mdrnn as mdrnn
+    from .tflite_converter import model_to_tflite
+
+    model = mdrnn.build_mdrnn_model(dimension, units, mixes, layers, inference=True, seq_length=1)
+    keras_file = location / f"{mdrnn.mdrnn_model_name(dimension, layers, units, mixes)}.keras"
+    model.save(keras_file)
+    tflite_file = model_to_tflite(model, keras_file)
+    return {"keras": keras_file, "tflite": tflite_file}
+
+
+def benchmark_model(model_file: Path, backend: str, dimension: int, units: int, mixes: int, layers: int, steps: int) -> dict:
+    """Loads a model file and measures startup time, memory use and generate() latency."""
+    import psutil
+    from .interaction import load_inference_model
+
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    start_load = time.perf_counter_ns()
+    model = load_inference_model(model_file, dimension, units, mixes, layers)
+    model.generate(np.random.rand(dimension))  # startup includes the first prediction.
+    startup_ns = time.perf_counter_ns() - start_load
+    latencies = generate_latencies(model, steps=steps)
+    rss_after = process.memory_info().rss
+    result = {
+        "backend": backend,
+        "dimension": dimension,
+        "units": units,
+        "mixes": mixes,
+        "layers": layers,
+        "steps": steps,
+        "startup_ms": startup_ns / 1e6,
+        "throughput_per_s": steps / (latencies.sum() / 1e9),
+        "rss_mb": rss_after / (1024**2),
+        "rss_delta_mb": (rss_after - rss_before) / (1024**2),
+        "file_size_kb": model_file.stat().st_size / 1024,
+    }
+    result.update(latency_summary(latencies))
+    return result
+
+
+def benchmark_sweep(dimensions, units_list, layers_list, mixes_list, backends, steps: int, location: Path) -> list:
+    """Runs benchmark_model for every combination of model parameters and backends."""
+    results = []
+    for dimension, units, layers, mixes in itertools.product(dimensions, units_list, layers_list, mixes_list):
+        model_files = build_benchmark_model_files(dimension, units, mixes, layers, location)
+        for backend in backends:
+            result = benchmark_model(model_files[backend], backend, dimension, units, mixes, layers, steps)
+            click.secho(
+                f"{backend} dim{dimension} layers{layers} units{units} mixtures{mixes}: "
+                f"p50 {result['p50_ms']:.3f}ms p99 {result['p99_ms']:.3f}ms "
+                f"{result['throughput_per_s']:.0f}/s startup {result['startup_ms']:.0f}ms",
+                fg="blue",
+            )
+            results.append(result)
+    return results
+
+
+def result_key(result: dict) -> tuple:
+    return (result["backend"], result["dimension"], result["units"], result["layers"], result["mixes"])
+
+
+def compare_results(results: list, previous: list) -> list:
+    """Pairs up results with the same configuration in a previous run and returns the relative change in latency."""
+    previous_by_key = {result_key(r): r for r in previous}
+    comparisons = []
+    for result in results:
+        old = previous_by_key.get(result_key(result))
+        if old is None:
+            continue
+        comparisons.append(
+            {
+                "key": result_key(result),
+                "p50_change": result["p50_ms"] / old["p50_ms"] - 1,
+                "p99_change": result["p99_ms"] / old["p99_ms"] - 1,
+                "throughput_change": result["throughput_per_s"] / old["throughput_per_s"] - 1,
+            }
+        )
+    return comparisons
+
+
+def impsy_version() -> str:
+    try:
+        return importlib.metadata.version("impsy")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+@click.command(name="bench")
+@click.option("-D", "--dimension", type=int, multiple=True, default=[4], help="Model dimension(s) to benchmark.")
+@click.option("-U", "--units", type=int, multiple=True, default=[64], help="LSTM units per layer.")
+@click.option("-L", "--layers", type=int, multiple=True, default=[2], help="Number of LSTM layers.")
+@click.option("-X", "--mixtures", type=int, multiple=True, default=[5], help="Number of mixture components.")
+@click.option(
+    "-b", "--backend", type=click.Choice(["keras", "tflite"]), multiple=True, default=["keras", "tflite"], help="Inference backend(s)."
+)
+@click.option("-n", "--steps", type=int, default=500, help="Number of timed predictions for each model.")
+@click.option("-o", "--output", type=str, default="bench-results.json", help="JSON file to write results to.")
+@click.option("--compare", type=str, default=None, help="A previous results file to compare against.")
+def bench(dimension, units, layers, mixtures, backend, steps, output, compare):
+    """Benchmarks inference latency, throughput and memory across model sizes and backends."""
+    click.secho(f"IMPSY: Benchmarking inference with {steps} steps per model.", fg="green")
+    with tempfile.TemporaryDirectory() as location:
+        results = benchmark_sweep(dimension, units, layers, mixtures, backend, steps, Path(location))
+    report = {
+        "impsy_version": impsy_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    click.secho(f"Results written to {output}", fg="green")
+
+    if compare is not None:
+        with open(compare) as f:
+            previous = json.load(f)
+        click.secho(f"Comparing with {compare} (impsy {previous.get('impsy_version')}):", fg="yellow")
+        for c in compare_results(results, previous["results"]):
+            colour = "red" if c["p99_change"] > 0.1 else "green"
+            click.secho(
+                f"{c['key']}: p50 {c['p50_change']:+.1%} p99 {c['p99_change']:+.1%} throughput {c['throughput_change']:+.1%}",
+                fg=colour,
+            )
+
+
+# Training throughput.
+
+
+def measure_training_throughput(
+    dataset_file: Path, dimension: int, model_size: str, batch_size: int, batches: int,
+    intra_op_threads: int = 0, inter_op_threads: int = 0, precision: str = "float32", jit_compile: bool = False, steps_per_execution: int = 1,
+) -> dict:
+    """Trains a model on the start of a dataset for an epoch of a number of batches and measures examples trained per second.
+    A first epoch (which traces and compiles the training function) isn't measured.
+    TensorFlow's threads and precision are set for the whole process, so this should run in a new process for each configuration."""
+    import impsy.mdrnn as mdrnn
+    from .train import SEQ_LEN, configure_training, seq_to_overlapping_format, slice_sequence_examples
+    from .utils import mdrnn_config
+
+    configure_training(intra_op_threads, inter_op_threads, precision)
+    with np.load(dataset_file, allow_pickle=True) as loaded:
+        corpus = loaded["perfs"]
+    examples = batch_size * batches
+    slices = []
+    for seq in corpus:
+        slices += slice_sequence_examples(seq, SEQ_LEN + 1, step_size=SEQ_LEN)
+        if len(slices) >= examples:
+            break
+    assert len(slices) >= examples, f"{dataset_file} only has {len(slices)} examples, not enough for {batches} batches."
+    X, y = seq_to_overlapping_format(slices[:examples])
+    X = np.array(X, dtype=np.float32) * mdrnn.SCALE_FACTOR
+    y = np.array(y, dtype=np.float32) * mdrnn.SCALE_FACTOR
+    model_config = mdrnn_config(model_size)
+    model = mdrnn.build_mdrnn_model(
+        dimension, model_config["units"], model_config["mixes"], model_config["layers"],
+        inference=False, seq_length=SEQ_LEN, jit_compile=jit_compile, steps_per_execution=steps_per_execution,
+    )
+    model.fit(X, y, batch_size=batch_size, epochs=1, verbose=0)
+    start = time.perf_counter_ns()
+    history = model.fit(X, y, batch_size=batch_size, epochs=1, verbose=0)
+    seconds = (time.perf_counter_ns() - start) / 1e9
+    return {
+        "dimension": dimension,
+        "model_size": model_size,
+        "batch_size": batch_size,
+        "batches": batches,
+        "intra_op_threads": intra_op_threads,
+        "inter_op_threads": inter_op_threads,
+        "precision": precision,
+        "jit_compile": jit_compile,
+        "steps_per_execution": steps_per_execution,
+        "epoch_s": seconds,
+        "samples_per_s": examples / seconds,
+        "loss": float(history.history["loss"][-1]),
+    }
+
+
+@click.command(name="bench-train")
+@click.option("-D", "--dimension", type=int, default=9, help="Dimension of the model and dataset.")
+@click.option("--dataset", type=str, default=None, help="A .npz dataset to train on (default: datasets/training-dataset-<dimension>d.npz).")
+@click.option("-M", "--modelsize", default="s", help="The model size: xxs, xs, s, m, l, xl.")
+@click.option("-B", "--batchsize", type=int, default=64, help="Batch size for training.")
+@click.option("-n", "--batches", type=int, default=50, help="Number of batches in the timed epoch.")
+@click.option("--intra-threads", type=int, multiple=True, default=[0], help="Intra-op thread count(s) to try, 0 is TensorFlow's default.")
+@click.option("--inter-threads", type=int, multiple=True, default=[0], help="Inter-op thread count(s) to try, 0 is TensorFlow's default.")
+@click.option("--precision", type=click.Choice(PRECISIONS), multiple=True, default=["float32"], help="Precision(s) to try.")
+@click.option("--jit", type=bool, multiple=True, default=[False], help="Whether to compile with XLA, give both true and false to compare.")
+@click.option("--steps-per-execution", type=int, multiple=True, default=[1], help="Steps per execution value(s) to try.")
+@click.option("-o", "--output", type=str, default="bench-train-results.json", help="JSON file to write results to.")
+def bench_train(dimension, dataset, modelsize, batchsize, batches, intra_threads, inter_threads, precision, jit, steps_per_execution, output):
+    """Benchmarks training throughput (examples per second) for combinations of training options."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    dataset = Path(dataset or f"datasets/training-dataset-{dimension}d.npz")
+    click.secho(f"IMPSY: Benchmarking training on {dataset} with {batches} batches of {batchsize}.", fg="green")
+    results = []
+    for options in itertools.product(intra_threads, inter_threads, precision, jit, steps_per_execution):
+        # each configuration gets a fresh process, as TensorFlow's threads can only be set once.
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            result = pool.submit(measure_training_throughput, dataset, dimension, modelsize, batchsize, batches, *options).result()
+        click.secho(
+            f"threads {result['intra_op_threads'] or 'default'}/{result['inter_op_threads'] or 'default'} {result['precision']} "
+            f"XLA {result['jit_compile']} steps/execution {result['steps_per_execution']}: {result['samples_per_s']:.0f} examples/s",
+            fg="blue",
+        )
+        results.append(result)
+    best = max(results, key=lambda r: r["samples_per_s"])
+    click.secho(
+        f"Fastest: --intra-threads {best['intra_op_threads']} --inter-threads {best['inter_op_threads']} --precision {best['precision']} "
+        f"{'--jit' if best['jit_compile'] else '--no-jit'} --steps-per-execution {best['steps_per_execution']}",
+        fg="green",
+    )
+    report = {
+        "impsy_version": impsy_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    click.secho(f"Results written to {output}", fg="green")
+
+
+# End-to-end latency through a running InteractionServer.
+
+
+E2E_MODE_SETTINGS = {
+    # useronly and callresponse (while the user is playing) only output the input thru, polyphony outputs predictions.
+    # OSC stimuli are dense inputs, which are only sent thru with dense_input_thru.
+    "useronly": {"input_thru": True, "dense_input_thru": True},
+    "callresponse": {"input_thru": True, "dense_input_thru": True},
+    "polyphony": {"input_thru": False, "dense_input_thru": False},
+}
+E2E_STARTUP_TIMEOUT = 60.0  # seconds to wait for the interaction server to load its model and start.
+E2E_MIDI_IN_PORT = "IMPSY e2e stimulus"
+E2E_MIDI_OUT_PORT = "IMPSY e2e response"
+
+
+def free_udp_port() -> int:
+    """Finds a free local UDP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def e2e_config(config: dict, mode: str, transport: str, timescale: float, reactor: str = "threads") -> dict:
+    """Makes a copy of a config that connects only the loopback OSC or virtual MIDI IO used by the harness."""
+    e2e = {key: value for key, value in config.items() if key not in ["midi", "osc", "websocket", "serial", "serialmidi"]}
+    e2e["verbose"] = False
+    e2e["log_predictions"] = False
+    e2e["interaction"] = {**config["interaction"], "mode": mode, "reactor": reactor, **E2E_MODE_SETTINGS.get(mode, {})}
+    e2e["model"] = {**config["model"], "timescale": timescale}
+    if transport == "osc":
+        e2e["osc"] = {
+            "server_ip": "127.0.0.1",
+            "server_port": free_udp_port(),
+            "client_ip": "127.0.0.1",
+            "client_port": free_udp_port(),
+        }
+    else:
+        e2e["midi"] = {
+            **config["midi"],
+            "in_device": E2E_MIDI_IN_PORT,
+            "out_device": E2E_MIDI_OUT_PORT,
+        }
+    return e2e
+
+
+class ResponseRecorder:
+    """Records the arrival time of every output from IMPSY."""
+
+    def __init__(self) -> None:
+        self.arrivals = []
+
+    def record(self, *args) -> None:
+        self.arrivals.append(time.perf_counter_ns())
+
+
+def osc_stimulus(config: dict, recorder: ResponseRecorder):
+    """Opens a UDP receiver on IMPSY's OSC client port and returns (send, close) functions for /interface stimuli."""
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind((config["osc"]["client_ip"], config["osc"]["client_port"]))
+    receiver.settimeout(0.1)
+    receiving = True
+
+    def receive_loop():
+        while receiving:
+            try:
+                receiver.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            recorder.record()
+
+    receiver_thread = Thread(target=receive_loop, name="e2e_osc_receiver", daemon=True)
+    receiver_thread.start()
+    client = udp_client.SimpleUDPClient(config["osc"]["server_ip"], config["osc"]["server_port"])
+    dimension = config["model"]["dimension"]
+
+    def send():
+        values = np.random.rand(dimension - 1).tolist()
+        sent = time.perf_counter_ns()
+        client.send_message("/interface", values)
+        return sent
+
+    def close():
+        nonlocal receiving
+        receiving = False
+        receiver_thread.join(timeout=1.0)
+        receiver.close()
+
+    return send, close
+
+
+def midi_stimulus(config: dict, recorder: ResponseRecorder):
+    """Opens virtual MIDI ports for IMPSY to connect to and returns (send, close) functions for MIDI stimuli."""
+    import mido
+
+    stimulus_port = mido.open_output(E2E_MIDI_IN_PORT, virtual=True)
+    response_port = mido.open_input(E2E_MIDI_OUT_PORT, virtual=True, callback=recorder.record)
+    mapping = config["midi"]["input"][0]
+
+    def send():
+        value = int(np.random.randint(0, 128))
+        if mapping[0] == "note_on":
+            msg = mido.Message("note_on", channel=mapping[1] - 1, note=value, velocity=127)
+        else:
+            msg = mido.Message("control_change", channel=mapping[1] - 1, control=mapping[2], value=value)
+        sent = time.perf_counter_ns()
+        stimulus_port.send(msg)
+        return sent
+
+    def close():
+        stimulus_port.close()
+        response_port.close()
+
+    return send, close
+
+
+def match_responses(sent: list, arrivals: list) -> np.ndarray:
+    """Pairs each stimulus with the first response that arrives before the next stimulus.
+    Returns latencies in nanoseconds for the stimuli that got a response."""
+    arrivals = sorted(arrivals)
+    latencies = []
+    for i, sent_time in enumerate(sent):
+        next_sent = sent[i + 1] if i + 1 < len(sent) else None
+        j = bisect.bisect_left(arrivals, sent_time)
+        if j < len(arrivals) and (next_sent is None or arrivals[j] < next_sent):
+            latencies.append(arrivals[j] - sent_time)
+    return np.array(latencies, dtype=np.int64)
+
+
+def measure_e2e_latency(config: dict, mode: str, transport: str = "osc", stimuli: int = 200, interval: float = 0.02, timescale: float = 0.0, reactor: str = "threads") -> np.ndarray:
+    """Runs an InteractionServer in the given mode, drives it with stimuli over loopback OSC or virtual MIDI
+    and returns the input-to-output latency of each answered stimulus in nanoseconds."""
+    from .interaction import InteractionServer
+
+    server_config = e2e_config(config, mode, transport, timescale, reactor)
+    recorder = ResponseRecorder()
+    with tempfile.TemporaryDirectory() as log_location:
+        if transport == "osc":
+            send, close = osc_stimulus(server_config, recorder)
+        else:
+            send, close = midi_stimulus(server_config, recorder)
+        server = InteractionServer(server_config, log_location=log_location, update_config_files=False)
+        server_thread = Thread(target=server.serve_forever, name="e2e_interaction_server", daemon=True)
+        server_thread.start()
+        deadline = time.monotonic() + E2E_STARTUP_TIMEOUT
+        while not server.running:  # wait for the model to load.
+            if not server_thread.is_alive() or time.monotonic() > deadline:
+                server.stop()
+                close()
+                raise click.ClickException("The interaction server didn't start, see its output above.")
+            time.sleep(0.01)
+        time.sleep(0.5)
+        recorder.arrivals.clear()
+        sent = []
+        try:
+            for _ in range(stimuli):
+                sent.append(send())
+                time.sleep(interval)
+            time.sleep(0.2)  # let the last responses arrive.
+        finally:
+            server.stop()
+            server_thread.join(timeout=5.0)
+            close()
+    return match_responses(sent, recorder.arrivals)
+
+
+def latency_histogram(latencies_ns: np.ndarray, bins: int = 12) -> list:
+    """Log-spaced histogram of latencies, as a list of (lower_ms, upper_ms, count)."""
+    latencies_ms = np.asarray(latencies_ns, dtype=np.float64) / 1e6
+    lower = max(latencies_ms.min(), 1e-3)
+    edges = np.geomspace(lower, max(latencies_ms.max(), lower * 1.01), bins + 1)
+    counts, edges = np.histogram(np.clip(latencies_ms, edges[0], edges[-1]), bins=edges)
+    return [(float(edges[i]), float(edges[i + 1]), int(counts[i])) for i in range(bins)]
+
+
+@click.command(name="bench-e2e")
+@click.option("-c", "--config", default="config.toml", help="Path to a .toml configuration file (its model and mappings are used).")
+@click.option(
+    "-m", "--mode", type=click.Choice(list(E2E_MODE_SETTINGS)), multiple=True, default=list(E2E_MODE_SETTINGS), help="Interaction mode(s) to measure."
+)
+@click.option("-t", "--transport", type=click.Choice(["osc", "midi"]), default="osc", help="Drive IMPSY over loopback OSC or virtual MIDI ports.")
+@click.option("-n", "--stimuli", type=int, default=200, help="Number of stimuli sent in each mode.")
+@click.option("-i", "--interval", type=float, default=0.02, help="Seconds between stimuli.")
+@click.option("--timescale", type=float, default=0.0, help="Timescale for predictions, 0 removes the predicted wait so only processing is measured.")
+@click.option("-r", "--reactor", type=click.Choice(["threads", "asyncio"]), default="threads", help="IO model for the interaction server.")
+@click.option("-o", "--output", type=str, default="bench-e2e-results.json", help="JSON file to write results to.")
+def bench_e2e(config, mode, transport, stimuli, interval, timescale, reactor, output):
+    """Measures input-to-output latency through the whole interaction loop without any hardware."""
+    config_data = get_config_data(config)
+    results = []
+    for m in mode:
+        click.secho(f"IMPSY: Measuring {m} mode over {transport} ({reactor} reactor).", fg="green")
+        latencies = measure_e2e_latency(config_data, m, transport, stimuli, interval, timescale, reactor)
+        if len(latencies) == 0:
+            click.secho(f"{m}: no responses received.", fg="red")
+            continue
+        result = {"mode": m, "transport": transport, "reactor": reactor, "stimuli": stimuli, "responses": len(latencies)}
+        result.update(latency_summary(latencies))
+        result["histogram"] = latency_histogram(latencies)
+        click.secho(
+            f"{m}: {len(latencies)}/{stimuli} answered, p50 {result['p50_ms']:.3f}ms p99 {result['p99_ms']:.3f}ms max {result['max_ms']:.3f}ms",
+            fg="blue",
+        )
+        peak = max(count for _, _, count in result["histogram"])
+        for lower, upper, count in result["histogram"]:
+            bar = "#" * int(40 * count / peak) if peak > 0 else ""
+            click.secho(f"  {lower:8.3f}-{upper:8.3f}ms {count:5d} {bar}")
+        results.append(result)
+    report = {
+        "impsy_version": impsy_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    click.secho(f"Results written to {output}", fg="green")
+
+
+OSC_SERVER_MODES = ["threading", "blocking", "asyncio"]
+OSC_QUIET_TIME = 0.2  # seconds without a new message before the receiver is taken to be finished.
+
+
+def measure_osc_throughput(server_mode: str, packets: int = 5000, dimension: int = 9) -> dict:
+    """Sends numbered /interface messages to an OSCServer as fast as possible over loopback and measures how many
+    are handled per second, how many are lost and how many reach IMPSY out of order."""
+    from . import impsio
+
+    config = {
+        "verbose": False,
+        "model": {"dimension": dimension},
+        "osc": {
+            "server_ip": "127.0.0.1",
+            "server_port": free_udp_port(),
+            "client_ip": "127.0.0.1",
+            "client_port": free_udp_port(),
+            "threading": server_mode == "threading",
+        },
+    }
+    arrivals = []
+    server = impsio.OSCServer(config, None, lambda values, timestamp: arrivals.append((timestamp, values[0])))
+    loop = None
+    if server_mode == "asyncio":
+        loop = asyncio.new_event_loop()
+        loop_thread = Thread(target=loop.run_forever, name="bench_osc_loop", daemon=True)
+        loop_thread.start()
+        asyncio.run_coroutine_threadsafe(server.connect_async(loop), loop).result()
+    else:
+        server.connect()
+    client = udp_client.SimpleUDPClient(config["osc"]["server_ip"], config["osc"]["server_port"])
+    padding = [0.5] * (dimension - 2)
+    try:
+        start = time.perf_counter_ns()
+        for i in range(packets):
+            client.send_message("/interface", [float(i), *padding])
+        sent_ns = time.perf_counter_ns() - start
+        received = -1
+        while received != len(arrivals):
+            received = len(arrivals)
+            time.sleep(OSC_QUIET_TIME)
+    finally:
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(server.disconnect_async(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join(timeout=1.0)
+            loop.close()
+        else:
+            server.disconnect()
+    order = [index for _, index in arrivals]
+    out_of_order = sum(1 for previous, index in zip(order, order[1:]) if index < previous)
+    duration_ns = (arrivals[-1][0] - start) if arrivals else 0
+    return {
+        "server": server_mode,
+        "packets": packets,
+        "received": len(arrivals),
+        "lost": packets - len(arrivals),
+        "out_of_order": out_of_order,
+        "send_rate_per_s": packets / (sent_ns / 1e9) if sent_ns else 0.0,
+        "packets_per_s": len(arrivals) / (duration_ns / 1e9) if duration_ns else 0.0,
+    }
+
+
+@click.command(name="bench-osc")
+@click.option(
+    "-s", "--server", type=click.Choice(OSC_SERVER_MODES), multiple=True, default=OSC_SERVER_MODES, help="OSC server type(s) to measure."
+)
+@click.option("-n", "--packets", type=int, default=5000, help="Number of OSC messages sent to each server.")
+@click.option("-d", "--dimension", type=int, default=9, help="Dimension of the /interface messages (number of values + 1).")
+@click.option("-o", "--output", type=str, default="bench-osc-results.json", help="JSON file to write results to.")
+def bench_osc(server, packets, dimension, output):
+    """Measures how many OSC messages per second IMPSY's OSC server types can handle."""
+    results = []
+    for server_mode in server:
+        click.secho(f"IMPSY: Sending {packets} OSC messages to a {server_mode} server.", fg="green")
+        result = measure_osc_throughput(server_mode, packets, dimension)
+        click.secho(
+            f"{server_mode}: {result['packets_per_s']:.0f} packets/s, {result['lost']} lost, {result['out_of_order']} out of order",
+            fg="blue",
+        )
+        results.append(result)
+    report = {
+        "impsy_version": impsy_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    click.secho(f"Results written to {output}", fg="green")
@@ -0,0 +1,27 @@
+"""impsy.clock: One monotonic, high resolution clock for timestamping IMPSY's events.
+Timestamps are integer nanoseconds from time.perf_counter_ns(), so differences between them are exact and aren't
+affected by changes to the system clock. They are turned into wall clock times (e.g., for logs) from one anchor."""
+
+import datetime
+import time
+
+
+now_ns = time.perf_counter_ns  # the current time in nanoseconds on IMPSY's clock.
+
+# wall clock time and IMPSY clock time at the same moment, read once so every conversion uses the same offset.
+WALL_ANCHOR_NS = time.time_ns()
+CLOCK_ANCHOR_NS = now_ns()
+
+
+def wall_time(timestamp_ns: int) -> float:
+    """Converts a timestamp to seconds since the epoch (like time.time())."""
+    return (WALL_ANCHOR_NS + timestamp_ns - CLOCK_ANCHOR_NS) / 1e9
+
+
+def wall_datetime(timestamp_ns: int) -> datetime.datetime:
+    """Converts a timestamp to a local datetime."""
+    return datetime.datetime.fromtimestamp(wall_time(timestamp_ns))
+
+
+def seconds_between(start_ns: int, end_ns: int) -> float:
+    return (end_ns - start_ns) / 1e9
@@ -15,6 +15,8 @@ def transform_log_to_sequence_example(logfile: str, dimension: int):
     )
     #  Filter out RNN lines, just keep 'interface'
     perf_df = perf_df[perf_df.source == "interface"]
+    #  Inputs are timestamped when they arrive, so lines written by different IO threads can be slightly out of order.
+    perf_df = perf_df.sort_index(kind="stable")
     #  Process times.
     perf_df["t"] = perf_df.index
     perf_df.t = perf_df.t.diff()
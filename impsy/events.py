@@ -0,0 +1,44 @@
+"""impsy.events: Preallocated event slots for passing interactions between IMPSY's threads without allocating."""
+
+from collections import deque
+import numpy as np
+
+
+SOURCE_INTERFACE = 0
+SOURCE_RNN = 1
+SOURCES = ["interface", "rnn"]  # names for the source codes, as used in the logs.
+
+
+class EventRing:
+    """A fixed number of event slots, each holding a float32 (dt, x_1, ..., x_n) row,
+    a clock.now_ns() timestamp, a source and a voice id.
+    Slots are claimed, filled in, and passed through queues by index. The consumer releases a slot when it is done with it,
+    so a slot is never reused while an index to it is still queued. Claiming and releasing are single deque operations,
+    so they are safe to use from any thread."""
+
+    __slots__ = ["values", "timestamps", "sources", "voices", "free"]
+
+    def __init__(self, size: int, dimension: int) -> None:
+        self.values = np.zeros((size, dimension), dtype=np.float32)
+        self.timestamps = np.zeros(size, dtype=np.int64)
+        self.sources = np.zeros(size, dtype=np.int8)
+        self.voices = np.zeros(size, dtype=np.int16)
+        self.free = deque(range(size))
+
+    def claim(self, timestamp: int, source: int, voice: int = 0) -> int:
+        """Claims a free slot and sets its details, returns None if every slot is in use."""
+        try:
+            index = self.free.popleft()
+        except IndexError:
+            return None
+        self.timestamps[index] = timestamp
+        self.sources[index] = source
+        self.voices[index] = voice
+        return index
+
+    def release(self, index: int) -> None:
+        """Returns a slot so it can be claimed again."""
+        self.free.append(index)
+
+    def available(self) -> int:
+        return len(self.free)
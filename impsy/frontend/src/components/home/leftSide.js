@@ -332,7 +332,15 @@ const LeftSide = ({ onTrainingStart }) => {
         earlyStoppingEnabled: true,
         patience: 10,
         numEpochs: 100,
-        batchSize: 64
+        batchSize: 64,
+        intraOpThreads: 0,
+        interOpThreads: 0,
+        precision: 'float32',
+        jitCompile: false,
+        stepsPerExecution: 1,
+        sequenceLength: 50,
+        sequenceStep: 1,
+        resume: false
     });
 
     useEffect(() => {
@@ -534,6 +542,14 @@ const LeftSide = ({ onTrainingStart }) => {
                 patience: trainingConfig.patience,
                 numEpochs: trainingConfig.numEpochs,
                 batchSize: trainingConfig.batchSize,
+                intraOpThreads: trainingConfig.intraOpThreads,
+                interOpThreads: trainingConfig.interOpThreads,
+                precision: trainingConfig.precision,
+                jitCompile: trainingConfig.jitCompile,
+                stepsPerExecution: trainingConfig.stepsPerExecution,
+                sequenceLength: trainingConfig.sequenceLength,
+                sequenceStep: trainingConfig.sequenceStep,
+                resume: trainingConfig.resume,
                 logFiles: selectedLogs
             });
         } catch (error) {
@@ -1065,6 +1081,111 @@ const LeftSide = ({ onTrainingStart }) => {
                                 batchSize: parseInt(e.target.value) 
                             }))}
                         />
+
+                        <Box sx={{ display: 'flex', gap: 1.5 }}>
+                            <TextField
+                                size="small"
+                                type="number"
+                                label="Sequence Length"
+                                value={trainingConfig.sequenceLength}
+                                onChange={(e) => setTrainingConfig(prev => ({ 
+                                    ...prev, 
+                                    sequenceLength: parseInt(e.target.value) 
+                                }))}
+                                helperText="Steps in each training example"
+                            />
+                            <TextField
+                                size="small"
+                                type="number"
+                                label="Sequence Step"
+                                value={trainingConfig.sequenceStep}
+                                onChange={(e) => setTrainingConfig(prev => ({ 
+                                    ...prev, 
+                                    sequenceStep: parseInt(e.target.value) 
+                                }))}
+                                helperText="Over 1 trains on different windows each epoch"
+                            />
+                        </Box>
+
+                        <Typography sx={{ fontSize: '0.9rem', mt: 1 }}>Training Speed</Typography>
+
+                        <Box sx={{ display: 'flex', gap: 1.5 }}>
+                            <TextField
+                                size="small"
+                                type="number"
+                                label="Intra-op Threads"
+                                value={trainingConfig.intraOpThreads}
+                                onChange={(e) => setTrainingConfig(prev => ({ 
+                                    ...prev, 
+                                    intraOpThreads: parseInt(e.target.value) 
+                                }))}
+                                helperText="0 = TensorFlow default"
+                            />
+                            <TextField
+                                size="small"
+                                type="number"
+                                label="Inter-op Threads"
+                                value={trainingConfig.interOpThreads}
+                                onChange={(e) => setTrainingConfig(prev => ({ 
+                                    ...prev, 
+                                    interOpThreads: parseInt(e.target.value) 
+                                }))}
+                                helperText="0 = TensorFlow default"
+                            />
+                        </Box>
+
+                        <FormControl size="small" fullWidth>
+                            <InputLabel>Precision</InputLabel>
+                            <Select
+                                value={trainingConfig.precision}
+                                onChange={(e) => setTrainingConfig(prev => ({ ...prev, precision: e.target.value }))}
+                                label="Precision"
+                            >
+                                <MenuItem value="float32">float32 (Default)</MenuItem>
+                                <MenuItem value="mixed_bfloat16">Mixed bfloat16 (faster on recent CPUs)</MenuItem>
+                                <MenuItem value="mixed_float16">Mixed float16 (GPUs)</MenuItem>
+                            </Select>
+                        </FormControl>
+
+                        <TextField
+                            size="small"
+                            type="number"
+                            label="Steps per Execution"
+                            value={trainingConfig.stepsPerExecution}
+                            onChange={(e) => setTrainingConfig(prev => ({ 
+                                ...prev, 
+                                stepsPerExecution: parseInt(e.target.value) 
+                            }))}
+                            helperText="Batches run in each TensorFlow call"
+                        />
+
+                        <FormControlLabel
+                            control={
+                                <Switch
+                                    checked={trainingConfig.jitCompile}
+                                    onChange={(e) => setTrainingConfig(prev => ({ 
+                                        ...prev, 
+                                        jitCompile: e.target.checked 
+                                    }))}
+                                    size="small"
+                                />
+                            }
+                            label={<Typography sx={{ fontSize: '0.9rem' }}>XLA Compilation</Typography>}
+                        />
+
+                        <FormControlLabel
+                            control={
+                                <Switch
+                                    checked={trainingConfig.resume}
+                                    onChange={(e) => setTrainingConfig(prev => ({ 
+                                        ...prev, 
+                                        resume: e.target.checked 
+                                    }))}
+                                    size="small"
+                                />
+                            }
+                            label={<Typography sx={{ fontSize: '0.9rem' }}>Resume Interrupted Training</Typography>}
+                        />
                     </Box>
 
                     <Button 
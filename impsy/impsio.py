@@ -1,6 +1,7 @@
 """impsy.impsio: IO classes for interactions over OSC, Websockets, MIDI and Serial"""
 
 import abc
+import asyncio
 from collections.abc import Callable
 import click
 from typing import List
@@ -9,9 +10,40 @@ import numpy as np
 import serial
 import mido
 from websockets.sync.server import serve
-from pythonosc import dispatcher, osc_server, udp_client
+import websockets.server
+from pythonosc import dispatcher, osc_server, udp_client, osc_message_builder
 from threading import Thread
-from impsy.utils import get_midi_note_offs, output_values_to_midi_messages, match_midi_port_to_list, midi_message_to_index_value
+import json
+import queue
+import socket
+import struct
+from threading import Lock
+from impsy.metrics import Metrics
+from impsy import clock
+from impsy.utils import get_midi_note_offs, output_values_to_midi_messages, match_midi_port_to_list, midi_message_to_index_value, RunningStatusParser
+
+
+ASYNC_POLL_INTERVAL = 0.001  # seconds between handle() calls for IO that can't register a reader on the event loop.
+WEBSOCKET_QUEUE_SIZE = 64  # frames waiting for a websocket client before it is treated as too slow and dropped.
+WEBSOCKET_TEXT_SUBPROTOCOL = "impsy.text"  # "/channel/{c}/noteon/{n}/{v}" text messages, also used when a client doesn't ask for a subprotocol.
+WEBSOCKET_MIDI_SUBPROTOCOL = "impsy.midi"  # binary frames of raw MIDI bytes.
+WEBSOCKET_FLOAT32_SUBPROTOCOL = "impsy.float32"  # binary frames of little-endian float32 values, one frame per output or input.
+WEBSOCKET_SUBPROTOCOLS = [WEBSOCKET_TEXT_SUBPROTOCOL, WEBSOCKET_MIDI_SUBPROTOCOL, WEBSOCKET_FLOAT32_SUBPROTOCOL]
+SERIAL_FRAME_HEADER = b"\xa5\x5a"  # starts each binary serial frame, followed by the values as little-endian float32.
+NTP_EPOCH_OFFSET = 2208988800  # seconds from 1900 (OSC time tags) to 1970 (clock.wall_time()).
+
+
+def osc_string(value: str) -> bytes:
+    """Encodes a string as an OSC string: null terminated and padded to a multiple of four bytes."""
+    encoded = value.encode() + b"\0"
+    return encoded + b"\0" * (-len(encoded) % 4)
+
+
+def osc_time_tag(timestamp: float) -> tuple:
+    """Converts a wall clock timestamp in seconds to the (seconds, fraction) parts of an OSC time tag."""
+    ntp_time = timestamp + NTP_EPOCH_OFFSET
+    seconds = int(ntp_time)
+    return seconds, int((ntp_time - seconds) * 4294967296) & 0xFFFFFFFF
 
 
 class IOServer(abc.ABC):
@@ -25,14 +57,19 @@ class IOServer(abc.ABC):
         config: dict,
         callback: Callable[[int, float], None],
         dense_callback: Callable[[List[int]], None],
+        metrics: Metrics = None,
+        control_callback: Callable[[str, list], None] = None,
     ) -> None:
         self.config = config  # the IMPSY config
-        self.callback = callback  # a callback method to report incoming sparse data.(e.g., MIDI notes)
-        self.dense_callback = dense_callback  # a callback for dense input data (e.g., lists of OSC arguments)
+        self.callback = callback  # a callback method to report incoming sparse data.(e.g., MIDI notes), can take a timestamp keyword argument (a clock.now_ns() time).
+        self.dense_callback = dense_callback  # a callback for dense input data (e.g., lists of OSC arguments), can take a timestamp keyword argument (a clock.now_ns() time).
+        self.metrics = metrics  # the interaction server's timing measurements, if available.
+        self.control_callback = control_callback  # a callback for commands that control the interaction server (e.g., model swaps)
 
     @abc.abstractmethod
-    def send(self, output_values) -> None:
-        """Sends output values to relevant outputs."""
+    def send(self, output_values, timestamp: int = None) -> None:
+        """Sends output values to relevant outputs.
+        timestamp is the clock.now_ns() time that the values are meant to sound at, if known."""
         pass
 
     @abc.abstractmethod
@@ -50,54 +87,135 @@ class IOServer(abc.ABC):
         """Disconnect from inputs and outputs."""
         pass
 
+    async def connect_async(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Connect to inputs and outputs with input handled on an asyncio event loop.
+        By default this connects as usual and polls handle(), subclasses register readers on the loop instead."""
+        self.connect()
+        self.poll_task = loop.create_task(self.poll_async())
+
+    async def poll_async(self) -> None:
+        while True:
+            self.handle()
+            await asyncio.sleep(ASYNC_POLL_INTERVAL)
+
+    async def disconnect_async(self) -> None:
+        """Disconnect from inputs and outputs connected with connect_async."""
+        if getattr(self, "poll_task", None) is not None:
+            self.poll_task.cancel()
+        self.disconnect()
+
 
 class SerialServer(IOServer):
     """Handles standard serial communication for IMPSY. 
-    Messages are encoded in CSV format with new lines at the end of each message."""
+    Messages are encoded in CSV format with new lines at the end of each message.
+    In binary mode each message is SERIAL_FRAME_HEADER followed by the values as little-endian float32."""
 
+    # [serial]
+    # port = "/dev/ttyAMA0" # The serial port to use
+    # baudrate = 115200
+    # binary = false # Use binary frames instead of CSV lines.
 
-    def __init__(self, config: dict, callback: Callable[[int, float], None], dense_callback: Callable[[List[int]], None]) -> None:
-        super().__init__(config, callback, dense_callback)
+
+    def __init__(self, config: dict, callback: Callable[[int, float], None], dense_callback: Callable[[List[int]], None], metrics: Metrics = None, control_callback: Callable[[str, list], None] = None) -> None:
+        super().__init__(config, callback, dense_callback, metrics, control_callback)
         self.serial_port = config["serial"]["port"]
         self.baudrate = config["serial"]["baudrate"] # 31250 midi, 
+        self.binary = config["serial"].get("binary", False)
+        self.size = config["model"]["dimension"] - 1  # number of values in each message.
+        self.frame_length = len(SERIAL_FRAME_HEADER) + 4 * self.size
         self.serial = None
-        self.buffer = ""
+        self.buffer = bytearray()
 
     
-    def send(self, output_values) -> None:
-        """Send values as a CSV line."""
-        output_message = ','.join(f"{num:.4f}" for num in output_values) + '\n'
+    def send(self, output_values, timestamp: int = None) -> None:
+        """Send values as a CSV line (or a binary frame)."""
+        if self.binary:
+            output_message = SERIAL_FRAME_HEADER + np.asarray(output_values, dtype="<f4").tobytes()
+        else:
+            output_message = (','.join(f"{num:.4f}" for num in output_values) + '\n').encode()
         # click.secho(f"Serial out: {output_message}")
         if self.serial is not None:
-            self.serial.write(output_message.encode())
+            self.serial.write(output_message)
         else: 
             # try to reconnect -- may as well, alternative is just never working.
             self.connect()
 
 
     def handle(self) -> None:
-        """read in the serial bytes and process lines into value lists for IMPSY"""
+        """read in the serial bytes and process every complete message into value lists for IMPSY"""
         # exist quickly if there is no serial connection.
         if self.serial is None:
             return
         
-        # first read in the serial bytes in waiting
-        while self.serial.in_waiting:
+        # first read in all the serial bytes in waiting
+        timestamp = clock.now_ns()
+        try:
+            waiting = self.serial.in_waiting
+            while waiting:
+                self.buffer += self.serial.read(waiting)
+                waiting = self.serial.in_waiting
+        except Exception as e:
+            click.secho(f"Serial: error reading input {e}", fg="red")
+            return
+
+        if self.binary:
+            frames = self.extract_binary_frames()
+        else:
+            frames = self.extract_csv_frames()
+        for values in frames:
+            self.dense_callback(values, timestamp=timestamp) # callback with the value list.
+
+
+    def extract_csv_frames(self) -> list:
+        """Removes all complete lines from the buffer and parses them, all at once if every line has the expected number of values.
+        Lines with the wrong number of values are dropped."""
+        end = self.buffer.rfind(b'\n')
+        if end < 0:
+            return []
+        lines = [line.strip() for line in bytes(self.buffer[:end]).split(b'\n')]
+        del self.buffer[:end + 1]
+        lines = [line for line in lines if line]
+        if not lines:
+            return []
+        if all(line.count(b',') + 1 == self.size for line in lines):
             try:
-                self.buffer += self.serial.read(self.serial.in_waiting).decode()
-            except Exception as e:
-                click.secho(f"Serial: error decoding input {e}")
-        
-        # process lines into values.
-        while '\n' in self.buffer:
-            line, self.buffer = self.buffer.split('\n', 1)
-            if line:
-                try:
-                    value_list = [float(x) for x in line.split(',')]
-                    self.dense_callback(value_list) # callback with the value list.
-                    # click.secho(f"Serial parsed: {value_list}", fg="green")
-                except ValueError:
-                    click.secho(f"Serial: Could not parse line: {line}", fg="red")
+                values = np.array(b','.join(lines).decode(errors="replace").split(','), dtype=np.float64)
+                return list(values.reshape(len(lines), self.size))
+            except ValueError:
+                pass
+        # fall back to parsing each line so that good lines still get through.
+        frames = []
+        for line in lines:
+            try:
+                values = np.array(line.split(b','), dtype=np.float64)
+            except ValueError:
+                click.secho(f"Serial: Could not parse line: {line}", fg="red")
+                continue
+            if len(values) != self.size:
+                click.secho(f"Serial: Expected {self.size} values, got {len(values)}: {line}", fg="red")
+                continue
+            frames.append(values)
+        return frames
+
+
+    def extract_binary_frames(self) -> list:
+        """Removes all complete binary frames from the buffer, skipping any bytes before a frame header."""
+        frames = []
+        position = 0
+        while True:
+            start = self.buffer.find(SERIAL_FRAME_HEADER, position)
+            if start < 0:
+                # keep a trailing byte in case it is the start of a header.
+                position = max(position, len(self.buffer) - len(SERIAL_FRAME_HEADER) + 1)
+                break
+            if start + self.frame_length > len(self.buffer):
+                position = start
+                break
+            values_start = start + len(SERIAL_FRAME_HEADER)
+            frames.append(np.frombuffer(self.buffer, dtype="<f4", count=self.size, offset=values_start).astype(np.float64))
+            position = start + self.frame_length
+        del self.buffer[:position]
+        return frames
 
 
     def connect(self) -> None:
@@ -115,6 +233,13 @@ class SerialServer(IOServer):
             self.serial.close()
         except:
             pass
+
+    async def connect_async(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Opens the serial port and handles input whenever the port is readable."""
+        await connect_serial_reader(self, loop)
+
+    async def disconnect_async(self) -> None:
+        disconnect_serial_reader(self)
     
 
 class SerialMIDIServer(IOServer):
@@ -125,31 +250,35 @@ class SerialMIDIServer(IOServer):
         config: dict,
         callback: Callable[[int, float], None],
         dense_callback: Callable[[List[int]], None],
+        metrics: Metrics = None,
+        control_callback: Callable[[str, list], None] = None,
     ) -> None:
-        super().__init__(config, callback, dense_callback)
-        self.parser = mido.parser.Parser()
-        self.serial_port = config["serial"]["port"]
+        super().__init__(config, callback, dense_callback, metrics, control_callback)
+        self.parser = RunningStatusParser()
+        # the port can be set in [serialmidi], otherwise the [serial] port is used.
+        self.serial_port = config["serialmidi"]["port"] if "port" in config["serialmidi"] else config["serial"]["port"]
         self.baudrate = 31250 # midi baudrate
         self.serial = None
-        self.buffer = "" # used for storing serial data after reading
         self.last_midi_notes = {}  # dict to store last played notes via midi
         self.midi_output_mapping = self.config["serialmidi"]["output"]
         self.midi_input_mapping = self.config["serialmidi"]["input"]
 
 
-    def send(self, output_values) -> None:
-        """Sends sound commands via MIDI"""
+    def send(self, output_values, timestamp: int = None) -> None:
+        """Sends sound commands via MIDI, all the messages for an output go in one serial write."""
         start_time = datetime.datetime.now()
         
         output_midi_messages = output_values_to_midi_messages(output_values, self.midi_output_mapping)
+        midi_bytes = bytearray()
         for msg in output_midi_messages:
             # send note off if a previous note_on had been sent
             if msg.type == 'note_on' and msg.channel in self.last_midi_notes:
                 note_off_msg = mido.Message("note_off", channel = msg.channel, note=self.last_midi_notes[msg.channel], velocity=0)
-                self.send_midi_message(note_off_msg)
-            self.send_midi_message(msg) # actually send the message.
+                midi_bytes += bytes(note_off_msg.bin())
+            midi_bytes += bytes(msg.bin())
             if msg.type == 'note_on':
                 self.last_midi_notes[msg.channel] = msg.note # store last midi note if it was a note_on.
+        self.send_midi_bytes(midi_bytes) # actually send the messages.
 
         duration_time = (datetime.datetime.now() - start_time).total_seconds()
         if duration_time > 0.02:
@@ -159,19 +288,22 @@ class SerialMIDIServer(IOServer):
             )
 
     def handle(self) -> None:
-        """Read in some bytes from the serial port and try to handle any found MIDI messages."""
+        """Read in all the bytes waiting on the serial port and handle every complete MIDI message."""
         if self.serial is None:
             return
-        if self.serial.in_waiting >= 3:
-            midi_bytes = self.serial.read(3)
-            self.parser.feed(midi_bytes)
-        message = self.parser.get_message()
-        if message is None:
+        timestamp = clock.now_ns()
+        try:
+            waiting = self.serial.in_waiting
+            while waiting:
+                self.parser.feed(self.serial.read(waiting))
+                waiting = self.serial.in_waiting
+        except Exception as e:
+            click.secho(f"Serial: error reading MIDI input {e}", fg="red")
             return
-        else:
+        for message in self.parser:
             try:
                 index, value = midi_message_to_index_value(message, self.midi_input_mapping)
-                self.callback(index, value)
+                self.callback(index, value, timestamp=timestamp)
             except ValueError as e:
                 # error when handling the MIDI message
                 # click.secho(f"MIDISerial Handling failed for a message: {e}", fg="red")
@@ -194,42 +326,159 @@ class SerialMIDIServer(IOServer):
             pass
 
 
+    async def connect_async(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Opens the serial port and handles input whenever the port is readable."""
+        await connect_serial_reader(self, loop)
+
+    async def disconnect_async(self) -> None:
+        disconnect_serial_reader(self)
+
+
     def send_midi_message(self, message):
         """Sends a mido MIDI message via the connected serial port."""
-        if self.serial is not None:
-            self.serial.write(message.bin())
+        self.send_midi_bytes(bytes(message.bin()))
+
+
+    def send_midi_bytes(self, midi_bytes):
+        """Writes MIDI bytes to the connected serial port."""
+        if self.serial is not None and midi_bytes:
+            self.serial.write(midi_bytes)
 
 
     def send_midi_note_offs(self):
         """Sends note offs on any MIDI channels that have been used for notes."""
         note_off_messages = get_midi_note_offs(self.midi_output_mapping, self.last_midi_notes)
-        for msg in note_off_messages:
-            self.send_midi_message(msg)
+        self.send_midi_bytes(b"".join(bytes(msg.bin()) for msg in note_off_messages))
+
+
+
+async def connect_serial_reader(io_server, loop: asyncio.AbstractEventLoop) -> None:
+    """Connects a serial IOServer and calls its handle() when the port has data to read.
+    Ports without a file descriptor (e.g., on Windows) are polled instead."""
+    io_server.connect()
+    io_server.reader_loop = None
+    io_server.poll_task = None
+    if io_server.serial is None:
+        return
+    try:
+        loop.add_reader(io_server.serial.fileno(), io_server.handle)
+        io_server.reader_loop = loop
+    except (AttributeError, NotImplementedError, ValueError):
+        io_server.poll_task = loop.create_task(io_server.poll_async())
+
+
+def disconnect_serial_reader(io_server) -> None:
+    """Removes a serial IOServer's reader from the event loop and disconnects it."""
+    if io_server.reader_loop is not None:
+        io_server.reader_loop.remove_reader(io_server.serial.fileno())
+    if io_server.poll_task is not None:
+        io_server.poll_task.cancel()
+    io_server.disconnect()
+
+
+class WebSocketWriter:
+    """Sends frames to one websocket client from its own thread so that a slow client can't hold up IMPSY or other clients."""
+
+    def __init__(self, websocket, queue_size: int = WEBSOCKET_QUEUE_SIZE) -> None:
+        self.websocket = websocket
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = False
+        self.thread = Thread(target=self.write_loop, name="ws_writer_thread", daemon=True)
+        self.thread.start()
+
+    def put(self, frames: list) -> bool:
+        """Queues frames to send without blocking. Returns False (and drops the client) if its queue is full."""
+        try:
+            for frame in frames:
+                self.queue.put_nowait(frame)
+            return True
+        except queue.Full:
+            self.drop()
+            return False
+
+    def drop(self) -> None:
+        """Disconnects a client that has stopped reading. The connection's socket is shut down rather than closed with a
+        handshake, which would wait for the client, so a send blocked on the client fails and the writer thread finishes."""
+        self.dropped = True
+        try:
+            if getattr(self.websocket, "socket", None) is not None:
+                self.websocket.socket.shutdown(socket.SHUT_RDWR)
+            else:
+                self.websocket.close()
+        except Exception:
+            pass
 
+    def write_loop(self) -> None:
+        while not self.dropped:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            try:
+                self.websocket.send(frame)
+            except Exception:
+                break
+        self.dropped = True
+        try:
+            self.websocket.close()
+        except Exception:
+            pass
 
+    def close(self) -> None:
+        """Stops the writer thread after it sends what is queued."""
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            self.drop()
 
-class WebSocketServer(IOServer):
-    """Handles Websocket Serving for IMPSY"""
 
-    def __init__(self, config, callback, dense_callback) -> None:
-        super().__init__(config, callback, dense_callback)
-        self.ws_clients = set()  # storage for potential ws clients.
+class WebSocketServer(IOServer):
+    """Handles Websocket Serving for IMPSY.
+    Clients choose a wire format with a subprotocol when they connect: text (the default), raw MIDI bytes or float32 vectors."""
+
+    # [websocket]
+    # server_ip = "0.0.0.0" # The address of this server
+    # server_port = 5001 # The port this server should listen on.
+    # queue_size = 64 # Frames that can wait for a client before it is disconnected as too slow.
+    # batch = false # Send each output as one frame with a line per MIDI message.
+
+    def __init__(self, config, callback, dense_callback, metrics=None, control_callback=None) -> None:
+        super().__init__(config, callback, dense_callback, metrics, control_callback)
+        self.ws_clients = {}  # connected ws clients, each with a writer (or an outbound queue on the event loop).
+        self.queue_size = self.config["websocket"].get("queue_size", WEBSOCKET_QUEUE_SIZE)
+        self.batch = self.config["websocket"].get("batch", False)
+        self.verbose = self.config["verbose"]
         self.ws_thread = None
         self.ws_server = None
+        self.loop = None  # set when running on an asyncio event loop.
         self.last_midi_notes = {}  # dict to store last played notes via midi
         self.midi_output_mapping = self.config["websocket"]["output"]
         self.midi_input_mapping = self.config["websocket"]["input"]
 
-    def send(self, output_values) -> None:
+    def send(self, output_values, timestamp: int = None) -> None:
+        """Queues an output to every client in its wire format, this never waits for the network."""
         output_midi_messages = output_values_to_midi_messages(output_values, self.midi_output_mapping)
+        midi_messages = []
         for msg in output_midi_messages:
             # send note off if a previous note_on had been sent
             if msg.type == 'note_on' and msg.channel in self.last_midi_notes:
                 note_off_msg = mido.Message("note_off", channel = msg.channel, note=self.last_midi_notes[msg.channel], velocity=0)
-                self.websocket_send_midi(note_off_msg)
-            self.websocket_send_midi(msg) # actually send the message.
+                midi_messages.append(note_off_msg)
+            midi_messages.append(msg)
             if msg.type == 'note_on':
                 self.last_midi_notes[msg.channel] = msg.note # store last midi note if it was a note_on.
+        # only make the formats that connected clients use.
+        subprotocols = {websocket.subprotocol for websocket in list(self.ws_clients)}
+        if not subprotocols:
+            return
+        frames = {
+            subprotocol: self.output_frames(subprotocol, output_values, midi_messages)
+            for subprotocol in subprotocols
+        }
+        if self.loop is not None:
+            # clients belong to the event loop, so their queues are filled there.
+            self.loop.call_soon_threadsafe(self.queue_frames_async, frames)
+        else:
+            self.queue_frames(frames)
 
     def handle(self) -> None:
         return super().handle()
@@ -252,74 +501,181 @@ class WebSocketServer(IOServer):
         if self.ws_server:
             self.ws_server.socket.close() 
 
-    def websocket_send_midi(self, message):
-        """Sends a mido MIDI message via websockets if available."""
-        if message.type == "note_on":
-            ws_msg = (
-                f"/channel/{message.channel}/noteon/{message.note}/{message.velocity}"
-            )
-        elif message.type == "note_off":
-            ws_msg = (
-                f"/channel/{message.channel}/noteoff/{message.note}/{message.velocity}"
-            )
-        elif message.type == "control_change":
-            ws_msg = f"/channel/{message.channel}/cc/{message.control}/{message.value}"
-        else:
-            return
-        # click.secho(f"WS out: {ws_msg}")
-        # Broadcast the ws_msg to all clients (sync version can't use websockets.broadcast function so doing this naively)
-        for ws_client in self.ws_clients.copy():
+    def output_frames(self, subprotocol: str, output_values, midi_messages: list) -> list:
+        """The websocket frames for an output in a subprotocol's wire format."""
+        if subprotocol == WEBSOCKET_MIDI_SUBPROTOCOL:
+            return [b"".join(bytes(msg.bin()) for msg in midi_messages)]
+        if subprotocol == WEBSOCKET_FLOAT32_SUBPROTOCOL:
+            return [np.asarray(output_values, dtype="<f4").tobytes()]
+        frames = [midi_message_to_websocket(msg) for msg in midi_messages]
+        frames = [f for f in frames if f is not None]
+        if self.batch and frames:
+            frames = ["\n".join(frames)]
+        return frames
+
+    def queue_frames(self, frames: dict) -> None:
+        """Gives frames (keyed by subprotocol) to each client's writer thread, clients that have fallen too far behind are dropped."""
+        for websocket, writer in list(self.ws_clients.items()):
+            if websocket.subprotocol in frames and not writer.put(frames[websocket.subprotocol]):
+                self.drop_client(websocket)
+
+    def queue_frames_async(self, frames: dict) -> None:
+        """Puts frames (keyed by subprotocol) in each client's outbound queue on the event loop, clients that have fallen too far behind are dropped."""
+        for websocket, client_queue in list(self.ws_clients.items()):
             try:
-                ws_client.send(ws_msg)
-            except:
-                self.ws_clients.remove(ws_client)
+                for frame in frames.get(websocket.subprotocol, []):
+                    client_queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                self.drop_client(websocket)
+                self.loop.create_task(websocket.close())
+
+    def drop_client(self, websocket) -> None:
+        if self.ws_clients.pop(websocket, None) is not None:
+            click.secho("WS: client too slow, disconnecting.", fg="red")
+            if self.metrics is not None:
+                self.metrics.increment("websocket_dropped_clients")
 
     def websocket_handler(self, websocket):
         """Handle websocket input messages that might arrive"""
-        self.ws_clients.add(websocket)  # add websocket to the client list.
+        writer = WebSocketWriter(websocket, self.queue_size)
+        self.ws_clients[websocket] = writer  # add websocket to the client list.
         # do the actual handling
-        for message in websocket:
-            click.secho(
-                f"WS: {message}", fg="red"
-            )  # TODO: fine for debug, but should be removed really.
-            m = message.split("/")[1:]
-            msg_type = m[2]
-            chan = int(m[1])  # TODO: should this be chan+1 or -1 or something.
-            note = int(m[3])
-            vel = int(m[4])
-            if msg_type == "noteon":
-                # note_on
-                try:
-                    index = self.config["midi"]["input"].index(["note_on", chan])
-                    value = note / 127.0
-                    self.callback(index, value)
-                except ValueError:
-                    click.secho(f"WS in: exception with message {message}", fg="red")
-                    pass
-            elif msg_type == "cc":
-                # cc
+        try:
+            for message in websocket:
+                self.handle_websocket_message(message, websocket.subprotocol)
+        finally:
+            self.ws_clients.pop(websocket, None)
+            writer.close()
+
+    async def websocket_handler_async(self, websocket):
+        """Handle websocket input messages on the event loop, outputs are sent by a writer task."""
+        client_queue = asyncio.Queue(maxsize=self.queue_size)
+        writer = asyncio.create_task(self.websocket_writer_async(websocket, client_queue))
+        self.ws_clients[websocket] = client_queue
+        try:
+            async for message in websocket:
+                self.handle_websocket_message(message, websocket.subprotocol)
+        finally:
+            self.ws_clients.pop(websocket, None)
+            writer.cancel()
+
+    async def websocket_writer_async(self, websocket, client_queue: asyncio.Queue) -> None:
+        """Sends a client's queued frames."""
+        while True:
+            frame = await client_queue.get()
+            await websocket.send(frame)
+
+    def handle_websocket_message(self, message, subprotocol: str = None, timestamp: int = None):
+        """Parses a websocket message in a subprotocol's wire format and passes it to the callback."""
+        if timestamp is None:
+            timestamp = clock.now_ns()
+        if isinstance(message, bytes):
+            self.handle_websocket_binary(message, subprotocol, timestamp)
+            return
+        if "\n" in message:
+            # a batch with one message per line.
+            for line in message.split("\n"):
+                if line:
+                    self.handle_websocket_message(line, timestamp=timestamp)
+            return
+        if self.verbose:
+            click.secho(f"WS: {message}", fg="red")
+        m = message.split("/")[1:]
+        msg_type = m[2]
+        chan = int(m[1])  # TODO: should this be chan+1 or -1 or something.
+        note = int(m[3])
+        vel = int(m[4])
+        if msg_type == "noteon":
+            # note_on
+            try:
+                index = self.config["midi"]["input"].index(["note_on", chan])
+                value = note / 127.0
+                self.callback(index, value, timestamp=timestamp)
+            except ValueError:
+                click.secho(f"WS in: exception with message {message}", fg="red")
+                pass
+        elif msg_type == "cc":
+            # cc
+            try:
+                index = self.config["midi"]["input"].index(
+                    ["control_change", chan, note]
+                )
+                value = vel / 127.0
+                self.callback(index, value, timestamp=timestamp)
+            except ValueError:
+                click.secho(f"WS in: exception with message {message}", fg="red")
+                pass
+        # global websocket
+        # ws_msg = f"/channel/{message.channel}/noteon/{message.note}/{message.velocity}"
+        # ws_msg = f"/channel/{message.channel}/noteoff/{message.note}/{message.velocity}"
+        # ws_msg = f"/channel/{message.channel}/cc/{message.control}/{message.value}"
+
+    def handle_websocket_binary(self, message: bytes, subprotocol: str, timestamp: int = None) -> None:
+        """Handles binary frames: float32 vectors go to the dense callback, MIDI bytes to the (sparse) callback."""
+        if subprotocol == WEBSOCKET_FLOAT32_SUBPROTOCOL:
+            if len(message) != 4 * (self.config["model"]["dimension"] - 1):
+                click.secho(f"WS in: float32 frame of {len(message)} bytes ignored.", fg="red")
+                return
+            self.dense_callback(np.frombuffer(message, dtype="<f4").tolist(), timestamp=timestamp)
+        elif subprotocol == WEBSOCKET_MIDI_SUBPROTOCOL:
+            for midi_message in mido.parse_all(message):
                 try:
-                    index = self.config["midi"]["input"].index(
-                        ["control_change", chan, note]
-                    )
-                    value = vel / 127.0
-                    self.callback(index, value)
+                    index, value = midi_message_to_index_value(midi_message, self.midi_input_mapping)
+                    self.callback(index, value, timestamp=timestamp)
                 except ValueError:
-                    click.secho(f"WS in: exception with message {message}", fg="red")
-                    pass
-            # global websocket
-            # ws_msg = f"/channel/{message.channel}/noteon/{message.note}/{message.velocity}"
-            # ws_msg = f"/channel/{message.channel}/noteoff/{message.note}/{message.velocity}"
-            # ws_msg = f"/channel/{message.channel}/cc/{message.control}/{message.value}"
+                    pass  # not mapped to an input.
+        else:
+            click.secho(f"WS in: binary frame without a binary subprotocol ignored.", fg="red")
 
     def websocket_serve_loop(self):
         """Threading websockets server following https://websockets.readthedocs.io/en/stable/reference/sync/server.html"""
         hostname = self.config["websocket"]["server_ip"]
         port = self.config["websocket"]["server_port"]
-        with serve(self.websocket_handler, hostname, port) as server:
+        with serve(
+            self.websocket_handler,
+            hostname,
+            port,
+            subprotocols=WEBSOCKET_SUBPROTOCOLS,
+            select_subprotocol=select_websocket_subprotocol,
+        ) as server:
             self.ws_server = server
             server.serve_forever()
 
+    async def connect_async(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Serves websockets on the event loop rather than in a thread."""
+        click.secho("Preparing websocket server.", fg="yellow")
+        self.loop = loop
+        self.async_ws_server = await websockets.server.serve(
+            self.websocket_handler_async,
+            self.config["websocket"]["server_ip"],
+            self.config["websocket"]["server_port"],
+            subprotocols=WEBSOCKET_SUBPROTOCOLS,
+        )
+
+    async def disconnect_async(self) -> None:
+        self.async_ws_server.close()
+        await self.async_ws_server.wait_closed()
+        self.loop = None
+
+
+def select_websocket_subprotocol(connection, subprotocols: list) -> str:
+    """Picks IMPSY's preferred subprotocol of those a client offers. Clients that don't offer one are still accepted and use text."""
+    for subprotocol in WEBSOCKET_SUBPROTOCOLS:
+        if subprotocol in subprotocols:
+            return subprotocol
+    return None
+
+
+def midi_message_to_websocket(message) -> str:
+    """Formats a mido MIDI message as a websocket text message, or returns None if it has no websocket format."""
+    if message.type == "note_on":
+        return f"/channel/{message.channel}/noteon/{message.note}/{message.velocity}"
+    elif message.type == "note_off":
+        return f"/channel/{message.channel}/noteoff/{message.note}/{message.velocity}"
+    elif message.type == "control_change":
+        return f"/channel/{message.channel}/cc/{message.control}/{message.value}"
+    return None
+
 
 class OSCServer(IOServer):
     """Handles OSC IO for IMPSY."""
@@ -329,16 +685,20 @@ class OSCServer(IOServer):
     # server_port = 5000 # Port IMPSY listens on
     # client_ip = "localhost" # Address of the output device
     # client_port = 5002 # Port of the output device
+    # threading = true # Handle each message in a new thread, false handles them in one thread in arrival order.
+    # bundle_latency = 0.01 # Send outputs in OSC bundles time tagged this many seconds after they are meant to sound.
 
     # Details for OSC output
     INPUT_MESSAGE_ADDRESS = "/interface"
     OUTPUT_MESSAGE_ADDRESS = "/impsy"
     TEMPERATURE_MESSAGE_ADDRESS = "/temperature"
     TIMESCALE_MESSAGE_ADDRESS = "/timescale"
+    METRICS_MESSAGE_ADDRESS = "/metrics"
+    MODEL_MESSAGE_ADDRESS = "/model"
 
 
-    def __init__(self, config, callback, dense_callback) -> None:
-        super().__init__(config, callback, dense_callback)
+    def __init__(self, config, callback, dense_callback, metrics=None, control_callback=None) -> None:
+        super().__init__(config, callback, dense_callback, metrics, control_callback)
 
         # Log configuration
         click.secho(f"OSC Configuration:", fg="yellow")
@@ -354,7 +714,10 @@ class OSCServer(IOServer):
         self.verbose = config["verbose"]
         self.osc_client = udp_client.SimpleUDPClient(
             config["osc"]["client_ip"], config["osc"]["client_port"]
-        )
+        )  # used for outputs that don't fit the prepared /impsy message.
+        self.bundle_latency = config["osc"].get("bundle_latency")
+        self.output_socket = None  # opened in prepare_output(), closed on disconnect
+        self.prepare_output()
         self.dispatcher = dispatcher.Dispatcher()
         self.dispatcher.map(
             OSCServer.INPUT_MESSAGE_ADDRESS, self.handle_interface_message
@@ -365,12 +728,48 @@ class OSCServer(IOServer):
         self.dispatcher.map(
             OSCServer.TIMESCALE_MESSAGE_ADDRESS, self.handle_timescale_message
         )
-        self.server = osc_server.ThreadingOSCUDPServer(
-            (config["osc"]["server_ip"], config["osc"]["server_port"]), self.dispatcher
+        self.dispatcher.map(
+            OSCServer.METRICS_MESSAGE_ADDRESS, self.handle_metrics_message, needs_reply_address=True
+        )
+        self.dispatcher.map(
+            OSCServer.MODEL_MESSAGE_ADDRESS, self.handle_model_message
         )
+        self.server = None  # a threaded server, made in connect()
+        self.transport = None  # or a datagram transport, made in connect_async()
+
+    def open_output_socket(self) -> None:
+        """Opens the socket outputs are sent from, if it isn't open."""
+        if self.output_socket is not None:
+            return
+        family, _, _, _, self.client_address = socket.getaddrinfo(
+            self.config["osc"]["client_ip"], self.config["osc"]["client_port"], type=socket.SOCK_DGRAM
+        )[0]
+        self.output_socket = socket.socket(family, socket.SOCK_DGRAM)
+
+    def close_output_socket(self) -> None:
+        if self.output_socket is not None:
+            self.output_socket.close()
+            self.output_socket = None
+
+    def prepare_output(self) -> None:
+        """Builds the output socket and a buffer holding the parts of the /impsy message (or bundle) that don't change,
+        so sending only needs to pack in the values."""
+        self.open_output_socket()
+        self.output_size = self.dimension - 1
+        self.output_format = f">{self.output_size}f"
+        message = osc_string(OSCServer.OUTPUT_MESSAGE_ADDRESS) + osc_string("," + "f" * self.output_size)
+        self.output_values_offset = len(message)
+        message += bytes(4 * self.output_size)
+        if self.bundle_latency is not None:
+            # "#bundle", an 8 byte time tag (filled in when sending) and the size of the single message.
+            bundle_header = osc_string("#bundle") + bytes(8) + struct.pack(">i", len(message))
+            self.output_values_offset += len(bundle_header)
+            message = bundle_header + message
+        self.output_buffer = bytearray(message)
+        self.output_lock = Lock()  # outputs can come from the playback and input threads at the same time.
 
     def handle_interface_message(self, address: str, *osc_arguments) -> None:
-        self.dense_callback([*osc_arguments])
+        self.dense_callback([*osc_arguments], timestamp=clock.now_ns())
 
     def handle_temperature_message(self, address: str, *osc_arguments) -> None:
         """Handler for temperature messages from the interface: format is ff [sigma temp, pi temp]"""
@@ -380,19 +779,47 @@ class OSCServer(IOServer):
             click.secho(
                 f"Temperature -- Sigma: {new_sigma_temp}, Pi: {new_pi_temp}", fg="blue"
             )
-        # TODO, set the network temperature somehow.
-        # net.sigma_temp = new_sigma_temp
-        # net.pi_temp = new_pi_temp
+        if self.control_callback is not None:
+            self.control_callback("temperature", [new_sigma_temp, new_pi_temp])
 
     def handle_timescale_message(self, address: str, *osc_arguments) -> None:
         """Handler for timescale messages: format is f [timescale]"""
         new_timescale = osc_arguments[0]
         if self.verbose:
             click.secho(f"Timescale: {new_timescale}", fg="blue")
-        # TODO: do something with this information...
+        if self.control_callback is not None:
+            self.control_callback("timescale", [new_timescale])
+
+    def handle_metrics_message(self, client_address, address: str, *osc_arguments) -> None:
+        """Handler for metrics queries: replies to the sender with a /metrics message containing a JSON snapshot of the timing measurements."""
+        if self.metrics is None:
+            return
+        reply = osc_message_builder.OscMessageBuilder(address=OSCServer.METRICS_MESSAGE_ADDRESS)
+        reply.add_arg(json.dumps(self.metrics.snapshot()))
+        try:
+            if self.transport is not None:
+                self.transport.sendto(reply.build().dgram, client_address)
+            else:
+                self.server.socket.sendto(reply.build().dgram, client_address)
+        except Exception as e:
+            click.secho(f"OSC metrics reply failed: {e}", fg="red")
+
+    def handle_model_message(self, address: str, *osc_arguments) -> None:
+        """Handler for model swap messages: format is s [model file] or si [model file, keep LSTM state]"""
+        if self.verbose:
+            click.secho(f"Model swap: {osc_arguments}", fg="blue")
+        if self.control_callback is not None and len(osc_arguments) > 0:
+            self.control_callback("model", list(osc_arguments))
 
     def connect(self) -> None:
         click.secho("Preparing OSC server thread.", fg="yellow")
+        self.open_output_socket()
+        server_address = (self.config["osc"]["server_ip"], self.config["osc"]["server_port"])
+        if self.config["osc"].get("threading", True):
+            self.server = osc_server.ThreadingOSCUDPServer(server_address, self.dispatcher)
+        else:
+            # one thread decodes and dispatches every message, so they arrive at IMPSY in order.
+            self.server = osc_server.BlockingOSCUDPServer(server_address, self.dispatcher)
         self.server_thread = Thread(
             target=self.server.serve_forever, name="osc_server_thread", daemon=True
         )
@@ -407,10 +834,39 @@ class OSCServer(IOServer):
             pass
         if self.server:
             self.server.socket.close()
+        self.close_output_socket()
 
-    def send(self, output_values) -> None:
+    async def connect_async(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Receives OSC on the event loop, messages are dispatched in the order they arrive without a thread per packet."""
+        click.secho("Preparing OSC server endpoint.", fg="yellow")
+        server = osc_server.AsyncIOOSCUDPServer(
+            (self.config["osc"]["server_ip"], self.config["osc"]["server_port"]), self.dispatcher, loop
+        )
+        self.open_output_socket()
+        self.transport, _ = await server.create_serve_endpoint()
+
+    async def disconnect_async(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        self.close_output_socket()
+
+    def send(self, output_values, timestamp: int = None) -> None:
+        """Sends values in an /impsy message, or in a time tagged bundle if bundle_latency is set."""
+        if len(output_values) != self.output_size:
+            try:
+                self.osc_client.send_message(OSCServer.OUTPUT_MESSAGE_ADDRESS, list(output_values))
+            except Exception as e:
+                click.secho(f"OSC sending failed: {e}", fg="red")
+            return
         try:
-            self.osc_client.send_message(OSCServer.OUTPUT_MESSAGE_ADDRESS, output_values)
+            with self.output_lock:
+                struct.pack_into(self.output_format, self.output_buffer, self.output_values_offset, *output_values)
+                if self.bundle_latency is not None:
+                    if timestamp is None:
+                        timestamp = clock.now_ns()
+                    struct.pack_into(">II", self.output_buffer, 8, *osc_time_tag(clock.wall_time(timestamp) + self.bundle_latency))
+                self.output_socket.sendto(self.output_buffer, self.client_address)
         except Exception as e:
             click.secho(f"OSC sending failed: {e}", fg="red")
 
@@ -422,8 +878,8 @@ class MIDIServer(IOServer):
     """Handles MIDI IO for IMPSY."""
 
 
-    def __init__(self, config, callback, dense_callback) -> None:
-        super().__init__(config, callback, dense_callback)
+    def __init__(self, config, callback, dense_callback, metrics=None, control_callback=None) -> None:
+        super().__init__(config, callback, dense_callback, metrics, control_callback)
         self.dimension = self.config["model"][
             "dimension"
         ]  # retrieve dimension from the config file.
@@ -431,10 +887,13 @@ class MIDIServer(IOServer):
         self.last_midi_notes = {}  # dict to store last played notes via midi
         self.midi_output_mapping = self.config["midi"]["output"]
         self.midi_input_mapping = self.config["midi"]["input"]
+        self.midi_in_port = None
+        self.midi_out_port = None
+        self.loop = None  # set when running on an asyncio event loop.
         # self.websocket_send_midi = None  # TODO implement some kind generic MIDI callback for other output channels.
 
 
-    def send(self, output_values) -> None:
+    def send(self, output_values, timestamp: int = None) -> None:
         """Sends sound commands via MIDI"""
         assert (
             len(output_values) + 1 == self.dimension
@@ -454,17 +913,39 @@ class MIDIServer(IOServer):
     
 
     def handle(self) -> None:
-        """Handle MIDI input messages that might come from mido"""
-        if self.midi_in_port is None:
-            return  # fail early if MIDI not open.
-        for message in self.midi_in_port.iter_pending():
-            try:
-                index, value = midi_message_to_index_value(message, self.midi_input_mapping)
-                self.callback(index, value)
-            except ValueError as e:
-                # error when handling the MIDI message
-                # click.secho(f"MIDI Handling failed for a message: {e}", fg="red")
-                pass
+        """MIDI input arrives through the input port's callback as soon as it is received, so there is nothing to poll."""
+        pass
+
+
+    def receive_midi_message(self, message) -> None:
+        """Callback for the MIDI input port, runs in the MIDI backend's thread and timestamps each message when it arrives."""
+        timestamp = clock.now_ns()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.handle_midi_message, message, timestamp)
+        else:
+            self.handle_midi_message(message, timestamp)
+
+
+    def handle_midi_message(self, message, timestamp: int = None) -> None:
+        """Passes a mido MIDI message on to the callback if it is mapped to an input."""
+        try:
+            index, value = midi_message_to_index_value(message, self.midi_input_mapping)
+        except ValueError as e:
+            # error when handling the MIDI message
+            # click.secho(f"MIDI Handling failed for a message: {e}", fg="red")
+            return
+        self.callback(index, value, timestamp=timestamp)
+
+
+    async def connect_async(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Opens MIDI ports, incoming messages are passed from the MIDI backend's thread to the event loop."""
+        self.loop = loop
+        self.connect()
+
+
+    async def disconnect_async(self) -> None:
+        self.disconnect()
+        self.loop = None
 
 
     def connect(self) -> None:
@@ -477,7 +958,7 @@ class MIDIServer(IOServer):
             desired_input_port = match_midi_port_to_list(
                 self.config["midi"]["in_device"], potential_midi_inputs
             )
-            self.midi_in_port = mido.open_input(desired_input_port)
+            self.midi_in_port = mido.open_input(desired_input_port, callback=self.receive_midi_message)
             click.secho(f"MIDI: in port is: {self.midi_in_port.name}", fg="green")
         except:
             self.midi_in_port = None
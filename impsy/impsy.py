@@ -3,10 +3,11 @@
 import click
 from .dataset import dataset
 from .train import train
-from .interaction import run
+from .interaction import run, run_multi
 from .tflite_converter import convert_tflite
 from .web_interface import webui
 from .tests import test_mdrnn
+from .bench import bench, bench_e2e, bench_osc, bench_train
 
 
 @click.group()
@@ -19,8 +20,13 @@ def main():
     cli.add_command(dataset)
     cli.add_command(train)
     cli.add_command(run)
+    cli.add_command(run_multi)
     cli.add_command(test_mdrnn)
     cli.add_command(convert_tflite)
     cli.add_command(webui)
+    cli.add_command(bench)
+    cli.add_command(bench_e2e)
+    cli.add_command(bench_osc)
+    cli.add_command(bench_train)
     # runs the command line interface
     cli()
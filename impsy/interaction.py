@@ -1,13 +1,20 @@
 """impsy.interaction_config: Functions for using imps as an interactive music system. This version uses a config file instead of a CLI."""
 
+import asyncio
 import logging
 import time
 import datetime
 import numpy as np
 import queue
-from threading import Thread
+from threading import Thread, Lock, Event
 import click
-from .utils import mdrnn_config, get_config_data, print_io
+from .utils import mdrnn_config, model_file_parameters, get_config_data, print_io
+from .bench import generate_latencies, latency_summary
+from .metrics import Metrics
+from . import clock
+from .events import EventRing, SOURCE_INTERFACE, SOURCE_RNN
+from .registry import ModelRegistry, MODEL_FILE_SUFFIXES
+from .tflite_converter import QUANTISATION_MODES
 import impsy.impsio as impsio
 from pathlib import Path
 import tomllib
@@ -38,10 +45,21 @@ INTERACTION_MODES = {
 }
 
 
-def setup_logging(dimension: int, location="logs", delay_file_open=True):
-    """Setup a log file and logging, requires a dimension parameter"""
+REACTORS = ["threads", "asyncio"]
+REACTOR_MONITOR_INTERVAL = 0.01  # seconds between call-response checks on the asyncio reactor.
+INFERENCE_WAKE_TIMEOUT = 0.1  # longest the inference thread sleeps without checking for work.
+EVENT_QUEUE_SIZE = 256  # most events waiting in each of the interaction queues, more are dropped.
+EVENT_RING_SIZE = 4 * EVENT_QUEUE_SIZE  # enough event slots for every queue to be full with some in use.
+
+
+def setup_logging(dimension: int, location="logs", delay_file_open=True, name: str = None):
+    """Setup a log file and logging, requires a dimension parameter.
+    A name gives the session its own logger and log file, so several sessions can log in one process."""
     log_date = datetime.datetime.now().isoformat().replace(":", "-")[:19]
-    log_name = f"{log_date}-{dimension}d-mdrnn.log"
+    if name is None:
+        log_name = f"{log_date}-{dimension}d-mdrnn.log"
+    else:
+        log_name = f"{log_date}-{name}-{dimension}d-mdrnn.log"
     log_file = Path(location) / log_name
     # make sure logging directory exists.
     log_file.parent.mkdir(parents=True, exist_ok=True)
@@ -52,7 +70,9 @@ def setup_logging(dimension: int, location="logs", delay_file_open=True):
     file_handler.setLevel(logging.INFO)
     formatter = logging.Formatter(log_format)
     file_handler.setFormatter(formatter)
-    logger = logging.getLogger("impsylogger")
+    logger = logging.getLogger("impsylogger" if name is None else f"impsylogger.{name}")
+    if name is not None:
+        logger.propagate = False  # session loggers don't also write to the default logger's file.
     logger.setLevel(logging.INFO)
     logger.addHandler(file_handler)
 
@@ -60,9 +80,11 @@ def setup_logging(dimension: int, location="logs", delay_file_open=True):
     return logger, str(log_name)
 
 
-def log_interaction(source: str, values: np.ndarray, logger: logging.Logger):
+def log_interaction(source: str, values: np.ndarray, logger: logging.Logger, timestamp: int = None):
+    """Logs values with the time they happened (a clock.now_ns() timestamp), or now if no timestamp is given."""
     value_string = ",".join(map(str, values))
-    logger.info(f"{datetime.datetime.now().isoformat()},{source},{value_string}")
+    log_time = clock.wall_datetime(clock.now_ns() if timestamp is None else timestamp)
+    logger.info(f"{log_time.isoformat()},{source},{value_string}")
 
 
 def close_log(logger: logging.Logger):
@@ -71,10 +93,132 @@ def close_log(logger: logging.Logger):
         handler.close()
 
 
-def build_network(config: dict):
-    """Build the MDRNN, uses a high-level size parameter and dimension."""
+LATENCY_BENCHMARK_STEPS = 200  # number of predictions timed for each candidate model.
+MODEL_WARMUP_STEPS = 10  # predictions made with a new model before it is swapped in.
+
+
+def load_inference_model(model_file: Path, dimension: int, units: int, mixtures: int, layers: int, cache=None):
+    """Loads an inference MDRNN of the right type for a model file's suffix.
+    cache can be an mdrnn.ModelCache to share the loaded weights with other sessions."""
     from . import mdrnn
 
+    if model_file.suffix == ".keras" or model_file.suffix == ".h5":
+        click.secho(f"MDRNN Loading from .keras or .h5 file: {model_file}", fg="green")
+        model = mdrnn.KerasMDRNN(model_file, dimension, units, mixtures, layers, cache)
+    elif model_file.suffix == ".tflite":
+        click.secho(f"MDRNN Loading from .tflite file: {model_file}", fg="green")
+        model = mdrnn.TfliteMDRNN(model_file, dimension, units, mixtures, layers, cache)
+    else:
+        click.secho(f"MDRNN Loading dummy model: {model_file}", fg="yellow")
+        model = mdrnn.DummyMDRNN(model_file, dimension, units, mixtures, layers)
+    return model
+
+
+def model_base_name(model_file: Path) -> str:
+    """The name of the trained model a file holds, without the -builtins or quantisation parts added by convert-tflite."""
+    stem = Path(model_file).stem
+    for part in [*(f"-{q}" for q in QUANTISATION_MODES), "-builtins"]:
+        stem = stem.removesuffix(part)
+    return stem
+
+
+def find_candidate_models(config: dict, model_file: Path, model_config: dict) -> list:
+    """Lists (file, parameters) for the models that could be used for this config.
+    Candidates are listed in `[model] candidates`, or are the versions of the configured model next to it (.keras, .h5 and
+    any .tflite conversions). Models trained separately (e.g., other sizes) are only used if they are listed as candidates."""
+    dimension = config["model"]["dimension"]
+    if "candidates" in config["model"]:
+        files = [Path(f) for f in config["model"]["candidates"]]
+    elif model_file.suffix in MODEL_FILE_SUFFIXES:
+        base_name = model_base_name(model_file)
+        files = sorted(
+            f for f in model_file.parent.glob("*") if f.suffix in MODEL_FILE_SUFFIXES and model_base_name(f) == base_name
+        )
+        if model_file not in files:
+            files.append(model_file)
+    else:
+        files = []
+    candidates = []
+    for f in files:
+        parameters = model_file_parameters(f)
+        if parameters is None and f == model_file:
+            parameters = {"dimension": dimension, **model_config}  # the configured file can use the configured size.
+        if parameters is None or parameters["dimension"] != dimension:
+            continue
+        candidates.append((f, parameters))
+    return candidates
+
+
+def select_model_for_latency(config: dict, model_file: Path, model_config: dict, cache=None):
+    """Benchmarks each candidate model and returns the largest one with a p99 generate latency inside `[model] latency_budget_ms`.
+    If no model fits in the budget, the fastest one is used.
+    Only one candidate is loaded at a time, the selected model is loaded again (with the cache) and recorded in `[model] file`."""
+    budget = config["model"]["latency_budget_ms"]
+    dimension = config["model"]["dimension"]
+    candidates = find_candidate_models(config, model_file, model_config)
+    if not candidates:
+        click.secho(f"MDRNN: No candidate models found for latency budget, using {model_file}.", fg="red")
+        return None
+
+    click.secho(f"MDRNN: Benchmarking {len(candidates)} models for a {budget}ms latency budget.", fg="yellow")
+    measured = []
+    for f, parameters in candidates:
+        try:
+            model = load_inference_model(f, dimension, parameters["units"], parameters["mixes"], parameters["layers"])
+        except Exception as e:
+            click.secho(f"MDRNN: Could not load {f}: {e}", fg="red")
+            continue
+        summary = latency_summary(generate_latencies(model, steps=LATENCY_BENCHMARK_STEPS))
+        del model  # release each candidate before loading the next.
+        click.secho(
+            f"MDRNN: {f.name}: p50 {summary['p50_ms']:.3f}ms, p99 {summary['p99_ms']:.3f}ms, max {summary['max_ms']:.3f}ms",
+            fg="blue",
+        )
+        measured.append((f, parameters, summary))
+    if not measured:
+        return None
+
+    within_budget = [m for m in measured if m[2]["p99_ms"] <= budget]
+    if within_budget:
+        # largest model first, then the fastest of the same size.
+        f, parameters, summary = min(
+            within_budget,
+            key=lambda m: (-m[1]["layers"] * m[1]["units"], -m[1]["mixes"], m[2]["p99_ms"]),
+        )
+    else:
+        f, parameters, summary = min(measured, key=lambda m: m[2]["p99_ms"])
+        click.secho(f"MDRNN: No model fits in {budget}ms, using the fastest.", fg="red")
+    click.secho(f"MDRNN: Selected {f} (p99 {summary['p99_ms']:.3f}ms).", fg="green")
+    config["model"]["file"] = str(f)
+    return load_inference_model(f, dimension, parameters["units"], parameters["mixes"], parameters["layers"], cache)
+
+
+class RuntimeParameters(object):
+    """Parameters that performers can change while IMPSY is running.
+    Writers hold the lock, the interaction loop and model just read the attributes:
+    each value is replaced in a single assignment so reads don't need the lock."""
+
+    __slots__ = ["pi_temp", "sigma_temp", "timescale", "lock"]
+
+    def __init__(self, pi_temp: float, sigma_temp: float, timescale: float) -> None:
+        self.pi_temp = pi_temp
+        self.sigma_temp = sigma_temp
+        self.timescale = timescale
+        self.lock = Lock()
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(config["model"]["pitemp"], config["model"]["sigmatemp"], config["model"]["timescale"])
+
+    def apply_temperature(self, model) -> None:
+        """Copies the sampling temperatures to a model."""
+        model.pi_temp = self.pi_temp
+        model.sigma_temp = self.sigma_temp
+
+
+def build_network(config: dict, cache=None):
+    """Build the MDRNN, uses a high-level size parameter and dimension.
+    cache can be an mdrnn.ModelCache to share the loaded weights with other sessions."""
     try:
         dimension = config["model"]["dimension"]
     except Exception as e:
@@ -98,16 +242,12 @@ def build_network(config: dict):
     except Exception as e:
         click.secho(f"MDRNN: Couldn't find a model file in your config. Loading dummy model.", fg="red")
         model_file = Path(".")
-    
-    if model_file.suffix == ".keras" or model_file.suffix == ".h5":
-        click.secho(f"MDRNN Loading from .keras or .h5 file: {model_file}", fg="green")
-        model = mdrnn.KerasMDRNN(model_file, dimension, units, mixtures, layers)
-    elif model_file.suffix == ".tflite":
-        click.secho(f"MDRNN Loading from .tflite file: {model_file}", fg="green")
-        model = mdrnn.TfliteMDRNN(model_file, dimension, units, mixtures, layers)
-    else:
-        click.secho(f"MDRNN Loading dummy model: {model_file}", fg="yellow")
-        model = mdrnn.DummyMDRNN(model_file, dimension, units, mixtures, layers)
+
+    model = None
+    if "latency_budget_ms" in config["model"]:
+        model = select_model_for_latency(config, model_file, model_config, cache)
+    if model is None:
+        model = load_inference_model(model_file, dimension, units, mixtures, layers, cache)
 
     model.pi_temp = config["model"]["pitemp"]
     model.sigma_temp = config["model"]["sigmatemp"]
@@ -118,10 +258,15 @@ def build_network(config: dict):
 class InteractionServer(object):
     """Interaction server class. Contains state and functions for the interaction loop."""
 
-    def __init__(self, config: dict, log_location: str = "logs"):
-        """Initialises the interaction server including loading the config from a config.toml file."""
+    def __init__(self, config: dict, log_location: str = "logs", update_config_files: bool = True, session_name: str = None, model_cache=None):
+        """Initialises the interaction server including loading the config from a config.toml file.
+        update_config_files can be False to avoid recording this session's log file in config.toml (e.g., for benchmarks).
+        session_name and model_cache are used when several servers run in one process (see run-multi):
+        each session gets its own logger, and models loaded from the same file share their weights.
+        Without a model_cache, the server makes its own with a ModelRegistry, so weights are cached between runs."""
         click.secho("Preparing IMPSY interaction server...", fg="yellow")
         self.config = config
+        self.session_name = session_name
 
         ## Load global variables from the config file.
         self.verbose = self.config["verbose"]
@@ -129,10 +274,14 @@ class InteractionServer(object):
             "dimension"
         ]  # retrieve dimension from the config file.
         self.mode = self.config["interaction"]["mode"]
+        self.reactor = self.config["interaction"].get("reactor", "threads")
+        if self.reactor not in REACTORS:
+            click.secho(f"Warning: unknown reactor {self.reactor}, using threads.", fg="yellow")
+            self.reactor = "threads"
 
         ## Set up log
         self.log_location = log_location
-        self.logger, log_name = setup_logging(self.dimension, location=self.log_location)
+        self.logger, log_name = setup_logging(self.dimension, location=self.log_location, name=self.session_name)
         
         # Update config with log file name
         if "log" not in self.config:
@@ -140,38 +289,55 @@ class InteractionServer(object):
         self.config["log"]["current_file"] = log_name
         
         # Update both global and project configs
-        self.update_configs(self.config)
+        if update_config_files:
+            self.update_configs(self.config)
+
+        ## Set up timing measurements, histograms are looked up once here so the hot path just records.
+        self.metrics = Metrics()
+        self.input_timing = self.metrics.histogram("input")
+        self.queue_wait_timing = self.metrics.histogram("queue_wait")
+        self.generate_timing = self.metrics.histogram("generate")
+
+        ## Parameters that can be changed while running.
+        self.params = RuntimeParameters.from_config(self.config)
+
+        ## The model is loaded in serve_forever, and can be swapped while running.
+        self.net = None
+        self.model_swap_thread = None
 
         ## Set up IO.
         self.senders = []
 
         if "midi" in self.config:
             midi_sender = impsio.MIDIServer(
-                self.config, self.construct_input_list, self.dense_callback
+                self.config, self.construct_input_list, self.dense_callback, metrics=self.metrics, control_callback=self.control_callback
             )
             self.senders.append(midi_sender)
         
         if "websocket" in self.config:
             websocket_sender = impsio.WebSocketServer(
-                self.config, self.construct_input_list, self.dense_callback
+                self.config, self.construct_input_list, self.dense_callback, metrics=self.metrics, control_callback=self.control_callback
             )
             self.senders.append(websocket_sender)
         
         if "osc" in self.config:
             osc_sender = impsio.OSCServer(
-                self.config, self.construct_input_list, self.dense_callback
+                self.config, self.construct_input_list, self.dense_callback, metrics=self.metrics, control_callback=self.control_callback
             )
             self.senders.append(osc_sender)
         
         if "serial" in self.config:
-            self.senders.append(impsio.SerialServer(self.config, self.construct_input_list, self.dense_callback))
+            self.senders.append(impsio.SerialServer(self.config, self.construct_input_list, self.dense_callback, metrics=self.metrics, control_callback=self.control_callback))
 
         if "serialmidi" in self.config:
-            self.senders.append(impsio.SerialMIDIServer(self.config, self.construct_input_list, self.dense_callback))
+            self.senders.append(impsio.SerialMIDIServer(self.config, self.construct_input_list, self.dense_callback, metrics=self.metrics, control_callback=self.control_callback))
 
-        # connect all the senders
+        # connect all the senders, the asyncio reactor connects them on its event loop instead.
+        self.send_timings = []
         for sender in self.senders:
-            sender.connect()
+            if self.reactor == "threads":
+                sender.connect()
+            self.send_timings.append((sender, self.metrics.histogram(f"send_{type(sender).__name__}")))
 
         # Import MDRNN
         click.secho("Importing MDRNN.", fg="yellow")
@@ -182,6 +348,8 @@ class InteractionServer(object):
             f"Done in {round(time.time() - start_import, 2)}s.",
             fg="yellow",
         )
+        self.owns_model_cache = model_cache is None
+        self.model_cache = mdrnn.ModelCache(ModelRegistry()) if model_cache is None else model_cache
 
         # Interaction Loop Mapping
         if self.mode in INTERACTION_MODES:
@@ -191,82 +359,123 @@ class InteractionServer(object):
             mode_mapping = INTERACTION_MODES["useronly"]
         click.secho(f"Config: {self.mode} mode.", fg="blue")
         self.user_to_rnn = mode_mapping["user_to_rnn"]
+        self.predict_inputs = mode_mapping["user_to_rnn"]  # only queue inputs in modes that ever predict from them.
         self.rnn_to_rnn = mode_mapping["rnn_to_rnn"]
         self.rnn_to_sound = mode_mapping["rnn_to_sound"]
 
-        # Set up runtime variables.
-        self.interface_input_queue = queue.Queue()
-        self.rnn_prediction_queue = queue.Queue()
-        self.rnn_output_buffer = queue.Queue()
-        self.last_user_interaction_time = time.time()
-        self.last_user_interaction_data = mdrnn.random_sample(out_dim=self.dimension)
-        self.rnn_prediction_queue.put_nowait(
-            mdrnn.random_sample(out_dim=self.dimension)
+        # Set up runtime variables, the queues pass indexes of event slots.
+        self.events = EventRing(EVENT_RING_SIZE, self.dimension)
+        self.interface_input_queue = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.prediction_event = Event()  # set when there may be a new prediction to make.
+        self.rnn_prediction_queue = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.rnn_output_buffer = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.input_lock = Lock()  # inputs can arrive on several IO threads at once.
+        self.last_user_interaction_time = clock.now_ns()
+        self.last_user_interaction_data = mdrnn.random_sample(out_dim=self.dimension).astype(np.float32)
+        self.queue_event(
+            self.rnn_prediction_queue, mdrnn.random_sample(out_dim=self.dimension), clock.now_ns(), SOURCE_RNN
         )
         self.call_response_mode = "call"
-
-    def send_back_values(self, output_values):
-        """sends back sound commands to the MIDI/OSC/WebSockets outputs"""
-        output = np.minimum(np.maximum(output_values, 0), 1)
+        self.running = False
+
+    def queue_event(self, event_queue: queue.Queue, values: np.ndarray, timestamp: int, source: int) -> bool:
+        """Copies values into an event slot and puts its index in a queue, the event is dropped if there's no room."""
+        index = self.events.claim(timestamp, source)
+        if index is None:
+            self.metrics.increment("dropped_events")
+            return False
+        self.events.values[index] = values
+        try:
+            event_queue.put_nowait(index)
+        except queue.Full:
+            self.events.release(index)
+            self.metrics.increment("dropped_events")
+            return False
+        return True
+
+    def clear_event_queue(self, event_queue: queue.Queue) -> None:
+        """Empties a queue and releases its events."""
+        while True:
+            try:
+                index = event_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.events.release(index)
+            event_queue.task_done()
+
+    def send_back_values(self, output_values, timestamp: int = None):
+        """sends back sound commands to the MIDI/OSC/WebSockets outputs.
+        output_values are clipped to [0, 1] in place, so pass an array (e.g., an event slot) that can be changed.
+        timestamp is the clock.now_ns() time the sound is meant to play at, outputs that can schedule sounds (e.g., OSC bundles) use it."""
+        output = np.clip(output_values, 0.0, 1.0, out=output_values)
         if self.verbose:
             print_io("out", output, "green")
-        for sender in self.senders:
-            sender.send(output)
-
-    def dense_callback(self, values) -> None:
-        """insert a dense input list into the interaction stream (e.g., when receiving OSC)."""
-        values_arr = np.array(values)
-        if self.verbose:
-            print_io("in", values_arr, "yellow")
-        log_interaction("interface", values_arr, self.logger)
-        dt = time.time() - self.last_user_interaction_time
-        self.last_user_interaction_time = time.time()
-        self.last_user_interaction_data = np.array([dt, *values_arr])
+        for sender, send_timing in self.send_timings:
+            start = time.perf_counter_ns()
+            sender.send(output, timestamp)
+            send_timing.record_since(start)
+
+    def dense_callback(self, values, timestamp: int = None) -> None:
+        """insert a dense input list into the interaction stream (e.g., when receiving OSC).
+        timestamp is the clock.now_ns() time the input arrived, if the IO knows it, otherwise it is taken to be now.
+        The same timestamp is used for dt, the log, and the input's latency measurements."""
+        if timestamp is None:
+            timestamp = clock.now_ns()
         assert (
-            len(self.last_user_interaction_data) == self.dimension
-        ), "Input is incorrect dimension. set dimension to %r" % len(
-            self.last_user_interaction_data
-        )
-        # These values are accessed by the RNN in the interaction loop function.
-        self.interface_input_queue.put_nowait(self.last_user_interaction_data)
+            len(values) + 1 == self.dimension
+        ), "Input is incorrect dimension. set dimension to %r" % (len(values) + 1)
+        with self.input_lock:
+            self.last_user_interaction_data[1:] = values
+            self.handle_user_input(timestamp, thru=self.config["interaction"].get("dense_input_thru", False))
 
     # Todo this is the "callback" for our IO functions.
-    def construct_input_list(self, index: int, value: float) -> None:
-        """constructs a dense input list from a sparse format (e.g., when receiving MIDI)"""
-        # set up dense interaction list
-        values = self.last_user_interaction_data[1:]
-        values[index] = value
-        # log
+    def construct_input_list(self, index: int, value: float, timestamp: int = None) -> None:
+        """constructs a dense input list from a sparse format (e.g., when receiving MIDI)
+        timestamp is the clock.now_ns() time the input arrived, if the IO knows it, otherwise it is taken to be now."""
+        if timestamp is None:
+            timestamp = clock.now_ns()
+        with self.input_lock:
+            # update the dense interaction list
+            self.last_user_interaction_data[index + 1] = value
+            self.handle_user_input(timestamp, thru=self.config["interaction"]["input_thru"])
+
+    def handle_user_input(self, timestamp: int, thru: bool = False) -> None:
+        """Sets dt for the newly updated user interaction data, logs it, and queues a copy of it for the MDRNN.
+        thru also sends the data straight to the outputs.
+        Called with the input lock held, so the data isn't changed by another input until it has been copied."""
+        data = self.last_user_interaction_data
+        data[0] = max(clock.seconds_between(self.last_user_interaction_time, timestamp), 0.0)
+        # inputs from different IO threads can arrive out of order, so the last interaction time never goes back.
+        self.last_user_interaction_time = max(self.last_user_interaction_time, timestamp)
         if self.verbose:
-            print_io("in", values, "yellow")
-        log_interaction("interface", values, self.logger)
-        # put it in the queue
-        dt = time.time() - self.last_user_interaction_time
-        self.last_user_interaction_time = time.time()
-        self.last_user_interaction_data = np.array([dt, *values])
-        assert (
-            len(self.last_user_interaction_data) == self.dimension
-        ), "Input is incorrect dimension, set dimension to %r" % len(
-            self.last_user_interaction_data
-        )
-        # These values are accessed by the RNN in the interaction loop function.
-        self.interface_input_queue.put_nowait(self.last_user_interaction_data)
+            print_io("in", data[1:], "yellow")
+        log_interaction("interface", data[1:], self.logger, timestamp)
+        if self.predict_inputs:
+            # These values are accessed by the RNN in the interaction loop function.
+            self.queue_event(self.interface_input_queue, data, timestamp, SOURCE_INTERFACE)
+            self.prediction_event.set()
+        self.input_timing.record_since(timestamp)
         # Send values to output if in config
-        if self.config["interaction"]["input_thru"]:
-            # This is where outputs are sent via impsio objects.
-            output_values = np.minimum(
-                np.maximum(self.last_user_interaction_data[1:], 0), 1
-            )
-            self.send_back_values(output_values)
+        if thru:
+            index = self.events.claim(timestamp, SOURCE_INTERFACE)
+            if index is not None:
+                thru_values = self.events.values[index]
+                thru_values[:] = data
+                self.send_back_values(np.clip(thru_values[1:], 0.0, 1.0, out=thru_values[1:]))
+                self.events.release(index)
 
     def make_prediction(self, neural_net):
         """Part of the interaction loop: reads input, makes predictions, outputs results"""
         # First deal with user --> MDRNN prediction
         if self.user_to_rnn and not self.interface_input_queue.empty():
-            item = self.interface_input_queue.get(block=True, timeout=None)
-            rnn_output = neural_net.generate(item)
+            index = self.interface_input_queue.get(block=True, timeout=None)
+            start = time.perf_counter_ns()
+            self.queue_wait_timing.record(start - int(self.events.timestamps[index]))
+            rnn_output = neural_net.generate(self.events.values[index])
+            self.generate_timing.record_since(start)
+            self.events.release(index)
             if self.rnn_to_sound:
-                self.rnn_output_buffer.put_nowait(rnn_output)
+                self.queue_event(self.rnn_output_buffer, rnn_output, clock.now_ns(), SOURCE_RNN)
             self.interface_input_queue.task_done()
 
         # Now deal with MDRNN --> MDRNN prediction.
@@ -275,17 +484,36 @@ class InteractionServer(object):
             and self.rnn_output_buffer.empty()
             and not self.rnn_prediction_queue.empty()
         ):
-            item = self.rnn_prediction_queue.get(block=True, timeout=None)
-            rnn_output = neural_net.generate(item)
-            self.rnn_output_buffer.put_nowait(
-                rnn_output
+            index = self.rnn_prediction_queue.get(block=True, timeout=None)
+            start = time.perf_counter_ns()
+            rnn_output = neural_net.generate(self.events.values[index])
+            self.generate_timing.record_since(start)
+            self.events.release(index)
+            self.queue_event(
+                self.rnn_output_buffer, rnn_output, clock.now_ns(), SOURCE_RNN
             )  # put it in the playback queue.
             self.rnn_prediction_queue.task_done()
 
+    def prediction_pending(self) -> bool:
+        """True if make_prediction has something to do."""
+        return (self.user_to_rnn and not self.interface_input_queue.empty()) or (
+            self.rnn_to_rnn
+            and self.rnn_output_buffer.empty()
+            and not self.rnn_prediction_queue.empty()
+        )
+
+    def inference_loop(self):
+        """Makes predictions whenever there is new input, used with the asyncio reactor. This loop blocks and should run in a separate thread."""
+        while self.running:
+            self.prediction_event.wait(timeout=INFERENCE_WAKE_TIMEOUT)
+            self.prediction_event.clear()
+            while self.running and self.prediction_pending():
+                self.make_prediction(self.net)
+
     def monitor_user_action(self):
         """Handles changing responsibility in Call-Response mode."""
         # Check when the last user interaction was
-        dt = time.time() - self.last_user_interaction_time
+        dt = clock.seconds_between(self.last_user_interaction_time, clock.now_ns())
         if dt > self.config["interaction"]["threshold"]:
             # switch to response modes.
             self.user_to_rnn = False
@@ -294,13 +522,14 @@ class InteractionServer(object):
             if self.call_response_mode == "call":
                 click.secho("switching to response.", bg="red", fg="black")
                 self.call_response_mode = "response"
-                while not self.rnn_prediction_queue.empty():
-                    # Make sure there's no inputs waiting to be predicted.
-                    self.rnn_prediction_queue.get()
-                    self.rnn_prediction_queue.task_done()
-                self.rnn_prediction_queue.put_nowait(
-                    self.last_user_interaction_data
-                )  # prime the RNN queue
+                self.metrics.increment("switch_to_response")
+                # Make sure there's no inputs waiting to be predicted.
+                self.clear_event_queue(self.rnn_prediction_queue)
+                with self.input_lock:
+                    self.queue_event(
+                        self.rnn_prediction_queue, self.last_user_interaction_data, clock.now_ns(), SOURCE_RNN
+                    )  # prime the RNN queue
+                self.prediction_event.set()
         else:
             # switch to call mode.
             self.user_to_rnn = True
@@ -309,51 +538,189 @@ class InteractionServer(object):
             if self.call_response_mode == "response":
                 click.secho("switching to call.", bg="blue", fg="black")
                 self.call_response_mode = "call"
-                # Empty the RNN queues.
-                while not self.rnn_output_buffer.empty():
-                    # Make sure there's no actions waiting to be synthesised.
-                    self.rnn_output_buffer.get()
-                    self.rnn_output_buffer.task_done()
+                self.metrics.increment("switch_to_call")
+                # Empty the RNN queues, make sure there's no actions waiting to be synthesised.
+                self.clear_event_queue(self.rnn_output_buffer)
+                self.prediction_event.set()  # inputs queued while responding can be predicted now.
                 # send MIDI noteoff messages to stop previous sounds
                 # TODO: this could be framed as "control switching"
 
     def playback_rnn_loop(self):
         """Plays back RNN notes from its buffer queue. This loop blocks and should run in a separate thread."""
+        params = self.params
         while True:
-            item = self.rnn_output_buffer.get(
+            index = self.rnn_output_buffer.get(
                 block=True, timeout=None
             )  # Blocks until next item is available.
-            dt = item[0]
+            item = self.events.values[index]
+            dt = float(item[0])
             # click.secho(f"Raw dt: {dt}", fg="blue")
-            x_pred = np.minimum(np.maximum(item[1:], 0), 1)
+            x_pred = np.clip(item[1:], 0.0, 1.0, out=item[1:])
             dt = max(dt, 0.001)  # stop accidental minus and zero dt.
-            dt = dt * self.config["model"]["timescale"]  # timescale modification!
+            dt = dt * params.timescale  # timescale modification!
             # click.secho(f"Sleeping for dt: {dt}", fg="blue")
+            play_time = clock.now_ns() + int(dt * 1e9)
+            item[0] = dt
+            self.events.timestamps[index] = play_time
 
             time.sleep(dt)  # wait until time to play the sound
-            # put last played in queue for prediction.
-            self.rnn_prediction_queue.put_nowait(
-                np.concatenate([np.array([dt]), x_pred])
-            )
             if self.rnn_to_sound:
                 # Send predictions to outputs via impsio objects
-                self.send_back_values(x_pred)
+                self.send_back_values(x_pred, timestamp=play_time)
                 if self.config["log_predictions"]:
-                    log_interaction("rnn", x_pred, self.logger)
+                    log_interaction("rnn", x_pred, self.logger, play_time)
+            # put last played in queue for prediction, after sending as the slot is released once it is predicted from.
+            if self.rnn_to_rnn:
+                try:
+                    self.rnn_prediction_queue.put_nowait(index)
+                except queue.Full:
+                    self.events.release(index)
+                    self.metrics.increment("dropped_events")
+            else:
+                self.events.release(index)
+            self.prediction_event.set()
             self.rnn_output_buffer.task_done()
 
 
+    def control_callback(self, command: str, arguments: list) -> None:
+        """Handles control commands from IO (e.g., OSC messages that change the running system)."""
+        if command == "model":
+            keep_state = len(arguments) > 1 and bool(arguments[1])
+            self.swap_model(Path(arguments[0]), keep_state=keep_state)
+        elif command == "temperature":
+            self.set_temperature(float(arguments[0]), float(arguments[1]))
+        elif command == "timescale":
+            self.set_timescale(float(arguments[0]))
+        else:
+            click.secho(f"Unknown control command: {command}", fg="red")
+
+    def set_temperature(self, sigma_temp: float, pi_temp: float) -> bool:
+        """Changes the sampling temperatures of the running model. Returns False if they are out of range."""
+        if sigma_temp <= 0 or pi_temp <= 0:
+            click.secho(f"MDRNN: Temperatures must be positive, ignoring sigma {sigma_temp}, pi {pi_temp}.", fg="red")
+            return False
+        with self.params.lock:
+            self.params.sigma_temp = sigma_temp
+            self.params.pi_temp = pi_temp
+            if self.net is not None:
+                self.params.apply_temperature(self.net)
+        self.config["model"]["sigmatemp"] = sigma_temp
+        self.config["model"]["pitemp"] = pi_temp
+        return True
+
+    def set_timescale(self, timescale: float) -> bool:
+        """Changes the timescale applied to predicted times. Returns False if it is negative."""
+        if timescale < 0:
+            click.secho(f"MDRNN: Timescale can't be negative, ignoring {timescale}.", fg="red")
+            return False
+        with self.params.lock:
+            self.params.timescale = timescale
+        self.config["model"]["timescale"] = timescale
+        return True
+
+    def swap_model(self, model_file: Path, keep_state: bool = False) -> bool:
+        """Loads a new model in the background and swaps it in when it is ready.
+        Returns False if the swap could not be started."""
+        if self.model_swap_thread is not None and self.model_swap_thread.is_alive():
+            click.secho("MDRNN: Already loading a model, ignoring swap.", fg="red")
+            return False
+        parameters = model_file_parameters(model_file)
+        if parameters is None:
+            parameters = {"dimension": self.dimension, **mdrnn_config(self.config["model"].get("size", "s"))}
+        if parameters["dimension"] != self.dimension:
+            click.secho(f"MDRNN: Can't swap in a {parameters['dimension']}d model, running {self.dimension}d.", fg="red")
+            return False
+        self.model_swap_thread = Thread(
+            target=self.load_and_swap_model,
+            args=(model_file, parameters, keep_state),
+            name="model_swap_thread",
+            daemon=True,
+        )
+        self.model_swap_thread.start()
+        return True
+
+    def load_and_swap_model(self, model_file: Path, parameters: dict, keep_state: bool) -> None:
+        """Loads and warms up a model, then replaces the running model with it."""
+        import impsy.mdrnn as mdrnn
+
+        start_load = time.time()
+        try:
+            new_net = load_inference_model(
+                model_file, self.dimension, parameters["units"], parameters["mixes"], parameters["layers"], self.model_cache
+            )
+        except Exception as e:
+            click.secho(f"MDRNN: Could not load {model_file}: {e}", fg="red")
+            return
+        # warm up so the first real prediction isn't slow.
+        value = mdrnn.random_sample(out_dim=self.dimension)
+        for _ in range(MODEL_WARMUP_STEPS):
+            value = mdrnn.proc_generated_touch(new_net.generate(value), self.dimension)
+        new_net.reset_lstm_states()
+        new_net.sampling_timing = self.metrics.histogram("sampling")
+        old_net = self.net
+        same_shape = (
+            old_net is not None
+            and old_net.n_layers == new_net.n_layers
+            and old_net.n_hidden_units == new_net.n_hidden_units
+        )
+        if keep_state and same_shape:
+            new_net.lstm_states = list(old_net.lstm_states)
+        elif keep_state:
+            click.secho("MDRNN: New model has a different shape, so LSTM state is reset.", fg="yellow")
+        with self.params.lock:
+            # temperatures set while loading are kept.
+            self.params.apply_temperature(new_net)
+            self.net = new_net  # the interaction loop picks up the new model on its next prediction.
+        self.config["model"]["file"] = str(model_file)
+        click.secho(f"MDRNN: Swapped in {model_file} in {round(time.time() - start_load, 2)}s.", fg="green")
+
+    def stop(self):
+        """Ask a running serve_forever loop to finish and shut down."""
+        self.running = False
+
+
     def shutdown(self):
         """Close IO and logs and prepare to exit."""
-        for sender in self.senders:
-            sender.disconnect()
+        if self.reactor == "threads":
+            for sender in self.senders:
+                sender.disconnect()  # the asyncio reactor disconnects IO as it finishes.
         close_log(self.logger)
+        if self.owns_model_cache:
+            self.model_cache.close()
+
+
+    async def serve_async(self):
+        """Runs all IO on one asyncio event loop, with predictions made in a separate inference thread."""
+        loop = asyncio.get_running_loop()
+        for sender in self.senders:
+            await sender.connect_async(loop)
+        inference_thread = Thread(
+            target=self.inference_loop, name="rnn_inference_thread", daemon=True
+        )
+        inference_thread.start()
+        click.secho("Asyncio reactor started", fg="green")
+        try:
+            while self.running:
+                await asyncio.sleep(REACTOR_MONITOR_INTERVAL)
+                # Only do call/response monitoring in that specific mode
+                if self.config["interaction"]["mode"] == "callresponse":
+                    self.monitor_user_action()
+        finally:
+            self.running = False
+            self.prediction_event.set()
+            inference_thread.join(timeout=1.0)
+            for sender in self.senders:
+                await sender.disconnect_async()
 
 
     def serve_forever(self):
         """Run the interaction server opening required IO."""
         click.secho("Preparing MDRNN.", fg="yellow")
-        net = build_network(self.config)
+        net = build_network(self.config, self.model_cache)
+        net.sampling_timing = self.metrics.histogram("sampling")
+        with self.params.lock:
+            self.params.apply_temperature(net)
+            self.net = net
 
         # Threads
         click.secho("Preparing MDRNN thread.", fg="yellow")
@@ -365,15 +732,22 @@ class InteractionServer(object):
         try:
             rnn_thread.start()
             click.secho("RNN Thread Started", fg="green")
-            while True:
-                self.make_prediction(net)
-                # Process inputs for all modes, not just callresponse
-                for sender in self.senders:
-                    sender.handle()  # handle incoming inputs
-                
-                # Only do call/response monitoring in that specific mode
-                if self.config["interaction"]["mode"] == "callresponse":
-                    self.monitor_user_action()
+            self.running = True
+            if self.reactor == "asyncio":
+                asyncio.run(self.serve_async())
+            else:
+                while self.running:
+                    self.make_prediction(self.net) # self.net can be swapped by another thread at any time.
+                    # Process inputs for all modes, not just callresponse
+                    for sender in self.senders:
+                        sender.handle()  # handle incoming inputs
+                    
+                    # Only do call/response monitoring in that specific mode
+                    if self.config["interaction"]["mode"] == "callresponse":
+                        self.monitor_user_action()
+            # stop() was called from another thread.
+            rnn_thread.join(timeout=1.0)
+            self.shutdown()
         except KeyboardInterrupt:
             click.secho("\nCtrl-C received... exiting.", fg="red")
             rnn_thread.join(timeout=1.0)
@@ -440,3 +814,69 @@ def run(config: str, logdir: str):
     # TODO: have some way set log dir in config as well?
     interaction_server = InteractionServer(config_data, log_location=logdir)
     interaction_server.serve_forever()
+
+
+def session_endpoints(config: dict) -> list:
+    """Lists the network ports and serial devices a session's IO opens, which can't be shared with another session."""
+    endpoints = []
+    if "osc" in config:
+        endpoints.append(f"OSC port {config['osc']['server_port']}")
+    if "websocket" in config:
+        endpoints.append(f"WebSocket port {config['websocket']['server_port']}")
+    if "serial" in config:
+        endpoints.append(f"serial device {config['serial']['port']}")
+    if "serialmidi" in config:
+        endpoints.append(f"serial device {config['serialmidi'].get('port', config.get('serial', {}).get('port'))}")
+    return endpoints
+
+
+@click.command(name="run-multi")
+@click.argument('configs', nargs=-1, required=True)
+@click.option('--logdir', '-l', default='logs', help='Path to a directory for logs.')
+def run_multi(configs: tuple, logdir: str):
+    """Run several IMPSY sessions in one process, one for each .toml configuration file.
+    Each session has its own IO, log and LSTM state, sessions using the same model file share its weights."""
+    click.secho(f"IMPSY Starting up {len(configs)} sessions...", fg="blue")
+    sessions = []
+    used_endpoints = {}
+    for config in configs:
+        config_data = get_config_data(config)
+        name = config_data.get("project_name", Path(config).stem)
+        if name in [n for n, _ in sessions]:
+            name = f"{name}-{len(sessions)}"
+        for endpoint in session_endpoints(config_data):
+            if endpoint in used_endpoints:
+                click.secho(f"{name} and {used_endpoints[endpoint]} both use {endpoint}, sessions need separate IO.", fg="red")
+                return
+            used_endpoints[endpoint] = name
+        if config_data["interaction"].get("reactor", "threads") != "asyncio":
+            # the threads reactor polls IO without waiting, so sessions would compete for the interpreter.
+            click.secho(f"{name}: using the asyncio reactor to share the process with other sessions.", fg="yellow")
+            config_data["interaction"]["reactor"] = "asyncio"
+        sessions.append((name, config_data))
+
+    import impsy.mdrnn as mdrnn
+
+    model_cache = mdrnn.ModelCache(ModelRegistry())  # models loaded by one session are reused by the others.
+    servers = [
+        # sessions don't add their logs to the global config.toml, which would mix logs from different projects.
+        InteractionServer(config_data, log_location=logdir, update_config_files=False, session_name=name, model_cache=model_cache)
+        for name, config_data in sessions
+    ]
+    threads = [
+        Thread(target=server.serve_forever, name=f"impsy_session_{name}", daemon=True)
+        for server, (name, _) in zip(servers, sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        click.secho("\nCtrl-C received... stopping sessions.", fg="red")
+        for server in servers:
+            server.stop()
+        for thread in threads:
+            thread.join(timeout=5.0)
+    finally:
+        model_cache.close()
@@ -8,9 +8,11 @@ import numpy as np
 import tensorflow as tf
 import keras_mdn_layer as mdn
 import datetime
+import time
 from pathlib import Path
 import abc
 import click
+from threading import Lock
 
 
 NET_MODE_TRAIN = "train"
@@ -65,10 +67,12 @@ def mdrnn_model_name(dimension: int, n_rnn_layers: int, n_hidden_units: int, n_m
     return name
 
 
-def build_mdrnn_model(dimension: int, n_hidden_units: int, n_mixtures: int, n_layers: int, inference: bool, seq_length = 30):
+def build_mdrnn_model(dimension: int, n_hidden_units: int, n_mixtures: int, n_layers: int, inference: bool, seq_length = 30, jit_compile = False, steps_per_execution = 1, stateful = False, batch_size = None):
     """Builds a Keras MDRNN model with specified parameters.
     Can either be a training model or inference model which affects the configured 
     sequence length and whether a loss function is added.
+    jit_compile (XLA) and steps_per_execution are passed to compile for training models.
+    A stateful training model carries its LSTM states from one batch to the next, this needs a fixed batch_size.
     """
     # Set parameters for inference/training versions.
     if inference:
@@ -80,8 +84,9 @@ def build_mdrnn_model(dimension: int, n_hidden_units: int, n_mixtures: int, n_la
         sequence_length = seq_length
         time_dist = True
     # inputs
+    stateful = stateful and not inference
     data_input = tf.keras.layers.Input(
-        shape=(sequence_length, dimension), name="inputs"
+        shape=(sequence_length, dimension), batch_size=batch_size if stateful else None, name="inputs"
     )
     lstm_in = data_input  # starter input for lstm
     state_inputs = []  # storage for LSTM state inputs
@@ -108,6 +113,7 @@ def build_mdrnn_model(dimension: int, n_hidden_units: int, n_mixtures: int, n_la
             name=f"lstm_{layer_i}",
             return_sequences=return_sequences,
             return_state=True,  # state_input_output # better to keep these outputs and just not use.
+            stateful=stateful,
         )(lstm_in, initial_state=state_input)
         lstm_in = lstm_out
         state_outputs += [state_h_output, state_c_output]
@@ -117,6 +123,9 @@ def build_mdrnn_model(dimension: int, n_hidden_units: int, n_mixtures: int, n_la
     if time_dist:
         mdn_layer = tf.keras.layers.TimeDistributed(mdn_layer, name="td_mdn")
     mdn_out = mdn_layer(lstm_out)  # apply mdn
+    if not inference and tf.keras.mixed_precision.global_policy().compute_dtype != "float32":
+        # with mixed precision, the loss is calculated on float32 outputs so that it stays stable.
+        mdn_out = tf.keras.layers.Activation("linear", dtype="float32", name="mdn_outputs_float32")(mdn_out)
     if inference:
         # for inference, need to track state of the model
         inputs = [data_input] + state_inputs
@@ -134,11 +143,34 @@ def build_mdrnn_model(dimension: int, n_hidden_units: int, n_mixtures: int, n_la
         # only need loss function and compile when training
         loss_func = mdn.get_mixture_loss_func(dimension, n_mixtures)
         optimizer = tf.keras.optimizers.Adam()
-        new_model.compile(loss=loss_func, optimizer=optimizer)
+        new_model.compile(loss=loss_func, optimizer=optimizer, jit_compile=jit_compile, steps_per_execution=steps_per_execution)
 
     return new_model
 
 
+class EpochSampler(tf.keras.utils.Sequence):
+    """Feeds training batches from examples that are sampled again for each epoch.
+    sample is a function returning (X, y) examples, it must return the same number each time."""
+
+    def __init__(self, sample, batch_size: int) -> None:
+        super().__init__()
+        self.sample = sample
+        self.batch_size = batch_size
+        self.on_epoch_end()
+
+    def __len__(self) -> int:
+        return -(-len(self.X) // self.batch_size)
+
+    def __getitem__(self, index: int):
+        batch = slice(index * self.batch_size, (index + 1) * self.batch_size)
+        return self.X[batch], self.y[batch]
+
+    def on_epoch_end(self) -> None:
+        X, y = self.sample()
+        self.X = np.asarray(X, dtype=np.float32) * SCALE_FACTOR
+        self.y = np.asarray(y, dtype=np.float32) * SCALE_FACTOR
+
+
 class PredictiveMusicMDRNN(object):
     """Builds and operates a mixture density recurrent neural network model."""
 
@@ -150,6 +182,10 @@ class PredictiveMusicMDRNN(object):
         n_mixtures=5,
         sequence_length=30,
         layers=2,
+        jit_compile=False,
+        steps_per_execution=1,
+        stateful=False,
+        batch_size=None,
     ):
         """Initialise the MDRNN model. Use mode='run' for evaluation graph and
         mode='train' for training graph.
@@ -161,6 +197,9 @@ class PredictiveMusicMDRNN(object):
         n_mixtures : number of mixture components (5-10 is good)
         layers : number of layers (2 is good)
         seq_len : sequence length to unroll
+        jit_compile : compile training steps with XLA
+        steps_per_execution : training batches run in each call to the compiled training function
+        stateful : carry LSTM states between training batches (truncated backpropagation through time), needs batch_size
         """
         # network parameters
         self.dimension = dimension
@@ -169,6 +208,8 @@ class PredictiveMusicMDRNN(object):
         self.n_rnn_layers = layers
         self.n_mixtures = n_mixtures  # number of mixtures
         self.sequence_length = sequence_length # only needed for training.
+        self.stateful = stateful and mode == NET_MODE_TRAIN
+        self.batch_size = batch_size # only needed for stateful training.
 
         # Sampling hyperparameters
         self.pi_temp = 1.5
@@ -185,7 +226,10 @@ class PredictiveMusicMDRNN(object):
         # Add timestamp as class variable
         self.timestamp = datetime.datetime.now().strftime("%Y%m%d-%H_%M_%S")
         
-        self.model = build_mdrnn_model(self.dimension, self.n_hidden_units, self.n_mixtures, self.n_rnn_layers, self.inference, self.sequence_length)
+        self.model = build_mdrnn_model(
+            self.dimension, self.n_hidden_units, self.n_mixtures, self.n_rnn_layers, self.inference, self.sequence_length,
+            jit_compile, steps_per_execution, self.stateful, self.batch_size,
+        )
         self.model_name = self.mdrnn_model_name()
         self.model.summary()
         self.reset_lstm_states()
@@ -203,6 +247,17 @@ class PredictiveMusicMDRNN(object):
             click.secho(f"Using untrained MDRNN", fg="red")
 
 
+    def warm_start(self, model_file):
+        """Starts from the weights of an existing .keras or .h5 model of the same size, e.g., to fine-tune it on new data."""
+        model_file = Path(model_file)
+        if model_file.suffix == ".keras":
+            # inference and training models have the same weights, but different layers, so these are copied in order.
+            existing_model = tf.keras.saving.load_model(model_file, custom_objects={"MDN": mdn.MDN})
+            self.model.set_weights(existing_model.get_weights())
+        else:
+            self.model.load_weights(model_file)
+
+
     def train(
         self,
         X,
@@ -215,8 +270,16 @@ class PredictiveMusicMDRNN(object):
         validation_split=0.1,
         patience=10,
         logging=True,
+        validation_data=None,
+        sample=None,
+        backup_dir=None,
     ):
-        """Train the network for a number of epochs with a specific dataset."""
+        """Train the network for a number of epochs with a specific dataset.
+        validation_data (X, y) is used instead of validation_split if given.
+        sample is a function returning new (X, y) examples for each epoch, used instead of X and y if given.
+        With a backup_dir, the model, optimiser state and epoch are saved there after each epoch, and restored from it
+        if it holds a backup of an interrupted training run. The backup is removed when training finishes.
+        Stateful models are trained on batches in order, with their LSTM states reset at the start of each epoch."""
         # Setup callbacks
         save_location = Path(save_location)
         checkpoint_path = save_location / f"{self.model_name}-ckpt.keras"
@@ -244,15 +307,30 @@ class PredictiveMusicMDRNN(object):
             callbacks.append(early_stopping_callback)
         if logging:
             callbacks.append(tensorboard_callback)
+        if backup_dir is not None:
+            callbacks.append(tf.keras.callbacks.BackupAndRestore(str(backup_dir)))
+        if self.stateful:
+            callbacks.append(tf.keras.callbacks.LambdaCallback(on_epoch_begin=lambda epoch, logs: self.model.reset_states()))
 
         # Do the data scaling in here.
-        X = np.array(X) * SCALE_FACTOR
-        y = np.array(y) * SCALE_FACTOR
-
-        ## print out stats.
-        print("Number of training examples:")
-        print("X:", X.shape)
-        print("y:", y.shape)
+        if sample is not None:
+            X = EpochSampler(sample, batch_size)
+            y = None
+            batch_size = None  # the sampler makes the batches.
+            validation_split = 0.0
+            print("Number of training examples per epoch:", X.X.shape)
+        else:
+            X = np.array(X) * SCALE_FACTOR
+            y = np.array(y) * SCALE_FACTOR
+
+            ## print out stats.
+            print("Number of training examples:")
+            print("X:", X.shape)
+            print("y:", y.shape)
+
+        if validation_data is not None:
+            validation_data = (np.array(validation_data[0]) * SCALE_FACTOR, np.array(validation_data[1]) * SCALE_FACTOR)
+            validation_split = 0.0
 
         # Train
         history = self.model.fit(
@@ -261,6 +339,8 @@ class PredictiveMusicMDRNN(object):
             batch_size=batch_size,
             epochs=epochs,
             validation_split=validation_split,
+            validation_data=validation_data,
+            shuffle=not self.stateful,  # stateful batches follow on from each other.
             callbacks=callbacks,
         )
         return history
@@ -309,8 +389,38 @@ class PredictiveMusicMDRNN(object):
         return name
 
 
+class ModelCache(object):
+    """Loaded models that can be shared by several IMPSY sessions in one process.
+    Entries are keyed by a model file's content hash if there is a registry.ModelRegistry, otherwise by its
+    resolved path, size and modification time, so a changed file is loaded again.
+    Only things without per-session state should be cached (e.g., weights), LSTM states stay with each session."""
+
+    def __init__(self, registry=None) -> None:
+        self.registry = registry
+        self.entries = {}
+        self.lock = Lock()
+
+    def get(self, model_file: Path, load, variant: tuple = ()):
+        """Returns the cached result of load() for a model file, calling it if the file hasn't been loaded yet."""
+        if self.registry is not None:
+            key = (self.registry.fingerprint(model_file), *variant)
+        else:
+            stat = model_file.stat()
+            key = (str(model_file.resolve()), stat.st_size, stat.st_mtime_ns, *variant)
+        with self.lock:  # held while loading so the same file is never loaded twice at once.
+            if key not in self.entries:
+                self.entries[key] = load()
+            return self.entries[key]
+
+    def close(self) -> None:
+        """Forgets the loaded models, so they can be freed once no session is using them."""
+        with self.lock:
+            self.entries = {}
+
+
 class MDRNNInferenceModel(abc.ABC):
-    """Abstract class for IMPSY inferences models."""
+    """Abstract class for IMPSY inferences models.
+    A ModelCache can be given to share loaded weights with other models made from the same file."""
 
     model_file: Path
     dimension: int
@@ -325,8 +435,10 @@ class MDRNNInferenceModel(abc.ABC):
         n_hidden_units: int,
         n_mixtures: int,
         n_layers: int,
+        cache: ModelCache = None,
     ) -> None:
         self.model_file = file
+        self.cache = cache
         self.dimension = dimension
         self.n_hidden_units = n_hidden_units
         self.n_mixtures = n_mixtures
@@ -335,12 +447,34 @@ class MDRNNInferenceModel(abc.ABC):
         # sampling hyperparameters
         self.pi_temp = 1.5
         self.sigma_temp = 0.01
+        self.sampling_timing = None # optional histogram for timing sampling.
         self.reset_lstm_states()
         self.prepare() # load the network files.
 
 
     def reset_lstm_states(self):
         self.lstm_states = lstm_blank_states(self.n_layers, self.n_hidden_units)
+
+
+    def sample(self, mdn_params: np.ndarray) -> np.ndarray:
+        """Sample a new (dt, x_1,...,x_n) value from the MDN parameters output by the network."""
+        start = time.perf_counter_ns()
+        new_sample = (
+            mdn.sample_from_output(
+                mdn_params,
+                self.dimension,
+                self.n_mixtures,
+                temp=self.pi_temp,
+                sigma_temp=self.sigma_temp,
+            )
+            / SCALE_FACTOR
+        )
+        new_sample = new_sample.reshape(
+            self.dimension,
+        )
+        if self.sampling_timing is not None:
+            self.sampling_timing.record_since(start)
+        return new_sample
     
 
     @abc.abstractmethod
@@ -355,23 +489,42 @@ class MDRNNInferenceModel(abc.ABC):
         pass
 
 
+def tflite_interpreter(model_file: Path):
+    """An interpreter for a .tflite file. Uses the slim tflite_runtime interpreter if it's installed and the model only
+    has builtin ops (e.g., converted with convert-tflite --builtins), otherwise TensorFlow's, which includes the Flex delegate."""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        interpreter = Interpreter(model_path=str(model_file))
+        interpreter.allocate_tensors()  # fails if the model needs TF ops.
+        return interpreter
+    except (ImportError, RuntimeError, ValueError):
+        return tf.lite.Interpreter(model_path=str(model_file))
+
+
 class TfliteMDRNN(MDRNNInferenceModel):
     """Loads an MDRNN from a tensorflow lite (.tflite) file for running predictions efficiently."""
 
 
-    def __init__(self, file: Path, dimension: int, n_hidden_units: int, n_mixtures: int, n_layers: int) -> None:
-        super().__init__(file, dimension, n_hidden_units, n_mixtures, n_layers)
+    def __init__(self, file: Path, dimension: int, n_hidden_units: int, n_mixtures: int, n_layers: int, cache: ModelCache = None) -> None:
+        super().__init__(file, dimension, n_hidden_units, n_mixtures, n_layers, cache)
     
 
     def prepare(self) -> None:
         assert self.model_file.suffix == ".tflite", "TfliteMDRNN only works on .tflite files."
-        self.interpreter = tf.lite.Interpreter(model_path=str(self.model_file))
+        # interpreters aren't thread safe so each model has its own, they map the model file into memory,
+        # so the operating system shares its pages between all the interpreters (and processes) using the same file.
+        self.interpreter = tflite_interpreter(self.model_file)
         self.signatures = self.interpreter.get_signature_list()
         self.runner = self.interpreter.get_signature_runner()
 
 
     def generate(self, prev_value: np.ndarray) -> np.ndarray:
         """makes a prediction. Needs to know the exact state names at the moment."""
+        return self.sample(self.mixture_parameters(prev_value))
+
+
+    def mixture_parameters(self, prev_value: np.ndarray) -> np.ndarray:
+        """Runs the network for one step (updating the LSTM state) and returns the MDN parameters it outputs."""
         input_value = prev_value.reshape(1,1,self.dimension) * SCALE_FACTOR
         input_value = input_value.astype(np.float32, copy=False)
         ## Create the input dictionary:
@@ -385,44 +538,58 @@ class TfliteMDRNN(MDRNNInferenceModel):
         for i in range(self.n_layers):
             self.lstm_states[2 * i] = raw_out[f'lstm_{i}'] # h
             self.lstm_states[2 * i + 1] = raw_out[f'lstm_{i}_1'] # c
-        mdn_params = raw_out['mdn_outputs'].squeeze()
-        # sample from the MDN:
-        new_sample = (
-            mdn.sample_from_output(
-                mdn_params,
-                self.dimension,
-                self.n_mixtures,
-                temp=self.pi_temp,
-                sigma_temp=self.sigma_temp,
-            )
-            / SCALE_FACTOR
-        )
-        new_sample = new_sample.reshape(
-            self.dimension,
-        )
-        return new_sample
+        return raw_out['mdn_outputs'].squeeze()
 
 
 class  KerasMDRNN(MDRNNInferenceModel):
     """Loads an MDRNN in inference mode from a .keras file."""
 
 
-    def __init__(self, file: Path, dimension: int, n_hidden_units: int, n_mixtures: int, n_layers: int) -> None:
-        super().__init__(file, dimension, n_hidden_units, n_mixtures, n_layers)
+    def __init__(self, file: Path, dimension: int, n_hidden_units: int, n_mixtures: int, n_layers: int, cache: ModelCache = None) -> None:
+        super().__init__(file, dimension, n_hidden_units, n_mixtures, n_layers, cache)
 
 
     def prepare(self) -> None:
         assert self.model_file.suffix == ".keras" or self.model_file.suffix == ".h5", "KerasMDRNN only works on .keras or .h5 files."
+        if self.cache is None:
+            self.model = self.load_model()
+        else:
+            # LSTM states are passed in and out of the inference model, so one Keras model can serve several sessions.
+            variant = ("keras", self.dimension, self.n_hidden_units, self.n_mixtures, self.n_layers)
+            self.model = self.cache.get(self.model_file, self.load_model, variant)
+
+
+    def load_model(self):
+        """Loads the Keras inference model, from weights cached by the cache's registry if this file has been loaded before."""
+        registry = None if self.cache is None else self.cache.registry
+        if registry is not None:
+            content_hash = registry.fingerprint(self.model_file)
+            weights = registry.load_weights(content_hash)
+            if weights is not None:
+                model = build_mdrnn_model(self.dimension, self.n_hidden_units, self.n_mixtures, self.n_layers, inference=True, seq_length=1)
+                try:
+                    model.set_weights(weights)
+                    return model
+                except ValueError as e:
+                    click.secho(f"MDRNN: Cached weights don't fit a {self.model_name}, loading {self.model_file}: {e}", fg="yellow")
+        model = self.load_model_file()
+        if registry is not None:
+            registry.save_weights(content_hash, model.get_weights())
+        return model
+
+
+    def load_model_file(self):
+        """Loads the Keras inference model from the model file."""
         if self.model_file.suffix == ".keras":
             # Loading model for .keras files
-            self.model = tf.keras.saving.load_model(
+            return tf.keras.saving.load_model(
                 str(self.model_file), 
                 custom_objects={"MDN": mdn.MDN}
             )
-        elif self.model_file.suffix == ".h5":
-            # Loading model for .h5 files
-            self.model = build_mdrnn_model(self.dimension, self.n_hidden_units, self.n_mixtures, self.n_layers, inference=True, seq_length=1)
-            self.model.load_weights(self.model_file)
+        # Loading model for .h5 files
+        model = build_mdrnn_model(self.dimension, self.n_hidden_units, self.n_mixtures, self.n_layers, inference=True, seq_length=1)
+        model.load_weights(self.model_file)
+        return model
 
 
     def generate(self, prev_value: np.ndarray) -> np.ndarray:
@@ -443,28 +610,15 @@ class  KerasMDRNN(MDRNNInferenceModel):
         self.lstm_states = model_output[1:]  # update storage of LSTM state
 
         # sample from the MDN:
-        new_sample = (
-            mdn.sample_from_output(
-                mdn_params,
-                self.dimension,
-                self.n_mixtures,
-                temp=self.pi_temp,
-                sigma_temp=self.sigma_temp,
-            )
-            / SCALE_FACTOR
-        )
-        new_sample = new_sample.reshape(
-            self.dimension,
-        )
-        return new_sample
+        return self.sample(mdn_params)
 
 
 class DummyMDRNN(MDRNNInferenceModel):
     """A dummy MDRNN for use if there is no model available (yet or ever). It just generates the same value over and over again."""
 
 
-    def __init__(self, file: Path, dimension: int, n_hidden_units: int, n_mixtures: int, n_layers: int) -> None:
-        super().__init__(file, dimension, n_hidden_units, n_mixtures, n_layers)
+    def __init__(self, file: Path, dimension: int, n_hidden_units: int, n_mixtures: int, n_layers: int, cache: ModelCache = None) -> None:
+        super().__init__(file, dimension, n_hidden_units, n_mixtures, n_layers, cache)
 
 
     def prepare(self) -> None:
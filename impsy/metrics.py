@@ -0,0 +1,107 @@
+"""impsy.metrics: Lightweight counters and timing histograms for the interaction loop."""
+
+import time
+
+
+SUB_BUCKET_BITS = 4  # 16 sub-buckets per power of two gives ~6% relative precision.
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+NUM_BUCKETS = 64 * SUB_BUCKETS
+
+
+def bucket_index(value: int) -> int:
+    """Log-linear bucket index for a non-negative integer, exact below 2 * SUB_BUCKETS."""
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - (SUB_BUCKET_BITS + 1)
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_lower_bound(index: int) -> int:
+    """Smallest value that falls into a bucket."""
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+
+
+class LatencyHistogram:
+    """HDR-style histogram of durations in nanoseconds.
+    Recording is a couple of integer operations so it can be always on, percentiles are only worked out when read.
+    Updates aren't locked, so a reading taken while values are being recorded may be very slightly out."""
+
+    __slots__ = ["counts", "count", "total", "max"]
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.counts = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, duration_ns: int) -> None:
+        """Record a duration in nanoseconds."""
+        if duration_ns < 0:
+            duration_ns = 0
+        self.counts[bucket_index(duration_ns)] += 1
+        self.count += 1
+        self.total += duration_ns
+        if duration_ns > self.max:
+            self.max = duration_ns
+
+    def record_since(self, start_ns: int) -> None:
+        """Record the time since a time.perf_counter_ns() reading."""
+        self.record(time.perf_counter_ns() - start_ns)
+
+    def percentile(self, percent: float) -> int:
+        """Approximate percentile in nanoseconds (the lower bound of the bucket it falls in)."""
+        if self.count == 0:
+            return 0
+        target = max(1, round(self.count * percent / 100))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(bucket_lower_bound(index), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """Count, mean, percentiles and max in milliseconds."""
+        return {
+            "count": self.count,
+            "mean_ms": (self.total / self.count / 1e6) if self.count else 0.0,
+            "p50_ms": self.percentile(50) / 1e6,
+            "p95_ms": self.percentile(95) / 1e6,
+            "p99_ms": self.percentile(99) / 1e6,
+            "max_ms": self.max / 1e6,
+        }
+
+
+class Metrics:
+    """A named collection of counters and latency histograms."""
+
+    def __init__(self) -> None:
+        self.histograms = {}
+        self.counters = {}
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        """Get (or create) a histogram. Hot paths should hold on to the histogram rather than looking it up each time."""
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram()
+        return self.histograms[name]
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self) -> dict:
+        """All the current measurements as a JSON-friendly dict."""
+        return {
+            "histograms": {name: h.summary() for name, h in list(self.histograms.items())},
+            "counters": dict(self.counters),
+        }
+
+    def reset(self) -> None:
+        for h in list(self.histograms.values()):
+            h.reset()
+        self.counters = {}
@@ -0,0 +1,111 @@
+"""impsy.registry: Identifies IMPSY model files by their content, and caches things made from them."""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from threading import Lock
+import click
+import numpy as np
+from .utils import model_file_parameters
+
+
+MODEL_FILE_SUFFIXES = [".keras", ".h5", ".tflite"]
+CACHE_DIR = Path("models") / ".cache"
+HASH_CHUNK_SIZE = 1 << 20  # bytes read at a time when hashing a model file.
+
+
+def file_hash(path: Path) -> str:
+    """The sha256 hash of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelRegistry(object):
+    """Fingerprints model files by their content and caches things made from them under that hash:
+    parsed weights and converted artefacts, in the cache directory.
+    Hashes are remembered by file path, size and modification time, so files are only read again when they change."""
+
+    def __init__(self, cache_dir: Path = CACHE_DIR) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.index_file = self.cache_dir / "index.json"
+        self.lock = Lock()
+        try:
+            self.index = json.loads(self.index_file.read_text())
+        except (OSError, ValueError):
+            self.index = {}
+
+    def describe(self, model_file: Path) -> dict:
+        """The name, content hash, size, modification time and size parameters of a model file."""
+        model_file = Path(model_file)
+        stat = model_file.stat()
+        key = str(model_file.resolve())
+        with self.lock:
+            record = self.index.get(key)
+            if record is None or record["size"] != stat.st_size or record["modified"] != stat.st_mtime_ns:
+                record = {
+                    "name": model_file.name,
+                    "hash": file_hash(model_file),
+                    "size": stat.st_size,
+                    "modified": stat.st_mtime_ns,
+                    "parameters": model_file_parameters(model_file),
+                }
+                self.index[key] = record
+                self.save_index()
+            return record
+
+    def fingerprint(self, model_file: Path) -> str:
+        """The hash of a model file's contents."""
+        return self.describe(model_file)["hash"]
+
+    def list_models(self, directory: Path) -> list:
+        """Describes the model files in a directory."""
+        directory = Path(directory)
+        if not directory.is_dir():
+            return []
+        files = sorted(f for f in directory.iterdir() if f.suffix in MODEL_FILE_SUFFIXES and f.is_file())
+        return [self.describe(f) for f in files]
+
+    def save_index(self) -> None:
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            temporary_file = self.index_file.with_suffix(f".{os.getpid()}.tmp")
+            temporary_file.write_text(json.dumps(self.index, indent=1))
+            temporary_file.replace(self.index_file)  # atomic, so other processes never read half an index.
+        except OSError as e:
+            click.secho(f"Registry: Couldn't save model index: {e}", fg="yellow")
+
+    def artefact(self, model_file: Path, suffix: str, create=None) -> Path:
+        """The cache location for something made from a model file (e.g., a converted model), by content hash.
+        If create is given, it is called with the model file and a temporary path if the artefact doesn't exist yet."""
+        path = self.cache_dir / f"{self.fingerprint(model_file)}{suffix}"
+        if create is not None and not path.exists():
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            temporary_path = path.with_name(f"{os.getpid()}-{path.name}")
+            create(Path(model_file), temporary_path)
+            temporary_path.replace(path)
+        return path
+
+    def save_weights(self, content_hash: str, weights: list) -> None:
+        """Caches a model's parsed weights arrays on disk."""
+        path = self.cache_dir / f"{content_hash}-weights.npz"
+        try:
+            if not path.exists():
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                temporary_path = path.with_name(f"{os.getpid()}-{path.name}")
+                with open(temporary_path, "wb") as f:
+                    np.savez(f, *weights)
+                temporary_path.replace(path)
+        except OSError as e:
+            click.secho(f"Registry: Couldn't cache weights: {e}", fg="yellow")
+
+    def load_weights(self, content_hash: str) -> list:
+        """Cached weights arrays for a model, or None if they haven't been cached."""
+        path = self.cache_dir / f"{content_hash}-weights.npz"
+        if not path.exists():
+            return None
+        with np.load(path) as archive:
+            return [archive[f"arr_{i}"] for i in range(len(archive.files))]
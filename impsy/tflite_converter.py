@@ -1,30 +1,129 @@
 """impsy.tflite_converter: Functions for converting a model to tflite format."""
 
 import click
+import multiprocessing
+import numpy as np
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .registry import ModelRegistry
 from .utils import mdrnn_config, get_config_data
 from pathlib import Path
 
 
-def model_to_tflite(model, model_path: Path, save_path: Path = None, optimise=False):
-    """This actually converts a loaded Keras model to tflite format."""
+QUANTISATION_MODES = ["dynamic", "float16", "int8"]
+CALIBRATION_SAMPLES = 500  # steps of the dataset used to calibrate int8 quantisation.
+EVALUATION_SAMPLES = 2000  # held-out steps used to measure log-likelihood.
+HELD_OUT_SPLIT = 0.1  # the end of the dataset, matching the validation split used in training.
+VALIDATION_STEPS = 100  # steps a builtins-only model is run alongside the Keras model to check their outputs match.
+VALIDATION_TOLERANCE = 1e-3  # largest difference allowed between their MDN parameters.
+
+
+def builtins_inference_function(model):
+    """A tf.function running one step of a Keras inference model using only ops TFLite has builtins for.
+    The LSTM layers are unrolled into matrix multiplications of their weights, with the states as explicit inputs and outputs
+    named as in the Keras model, so TfliteMDRNN runs either conversion the same way."""
     import tensorflow as tf
 
-    # Setup output path and name.
-    output_file = model_path.with_suffix(".tflite")
+    dimension, units, _, layers = inference_model_size(model)
+    lstm_weights = [[tf.constant(w) for w in model.get_layer(f"lstm_{i}").get_weights()] for i in range(layers)]
+    mdn_layer = model.get_layer("mdn_outputs")
+    mdn_weights = [[tf.constant(w) for w in dense.get_weights()] for dense in [mdn_layer.mdn_mus, mdn_layer.mdn_sigmas, mdn_layer.mdn_pi]]
+    epsilon = tf.keras.backend.epsilon()
+    input_signature = {"inputs": tf.TensorSpec([1, 1, dimension], tf.float32, name="inputs")}
+    for i in range(layers):
+        input_signature[f"state_h_{i}"] = tf.TensorSpec([1, units], tf.float32, name=f"state_h_{i}")
+        input_signature[f"state_c_{i}"] = tf.TensorSpec([1, units], tf.float32, name=f"state_c_{i}")
+
+    @tf.function(input_signature=[input_signature])
+    def step(inputs):
+        outputs = {}
+        x = tf.reshape(inputs["inputs"], [1, dimension])
+        for i, (kernel, recurrent_kernel, bias) in enumerate(lstm_weights):
+            # Keras stores the LSTM's gates in the order: input, forget, cell, output.
+            gates = tf.matmul(x, kernel) + tf.matmul(inputs[f"state_h_{i}"], recurrent_kernel) + bias
+            input_gate, forget_gate, cell_gate, output_gate = tf.split(gates, 4, axis=1)
+            c = tf.sigmoid(forget_gate) * inputs[f"state_c_{i}"] + tf.sigmoid(input_gate) * tf.tanh(cell_gate)
+            x = tf.sigmoid(output_gate) * tf.tanh(c)
+            outputs[f"lstm_{i}"] = x
+            outputs[f"lstm_{i}_1"] = c
+        mus, sigmas, pis = [tf.matmul(x, kernel) + bias for kernel, bias in mdn_weights]
+        sigmas = tf.nn.elu(sigmas) + 1 + epsilon  # the MDN layer's sigma activation.
+        outputs["mdn_outputs"] = tf.concat([mus, sigmas, pis], axis=1)
+        return outputs
+
+    return step
+
+
+def validate_builtins_model(model, tflite_file: Path, steps: int = VALIDATION_STEPS) -> float:
+    """Runs a Keras inference model and a builtins-only conversion of it on the same random inputs, each carrying its own
+    LSTM states as KerasMDRNN and TfliteMDRNN do, and returns the largest difference between their MDN parameters."""
+    import impsy.mdrnn as mdrnn
+
+    dimension, units, mixtures, layers = inference_model_size(model)
+    tflite_model = mdrnn.TfliteMDRNN(Path(tflite_file), dimension, units, mixtures, layers)
+    states = mdrnn.lstm_blank_states(layers, units)
+    difference = 0.0
+    for value in np.random.rand(steps, dimension).astype(np.float32):
+        outputs = model([value.reshape(1, 1, dimension) * mdrnn.SCALE_FACTOR, *states])
+        states = outputs[1:]
+        keras_params = np.asarray(outputs[0]).squeeze()
+        difference = max(difference, float(np.max(np.abs(keras_params - tflite_model.mixture_parameters(value)))))
+    return difference
+
+
+def tflite_file_name(model_path: Path, save_path: Path = None, quantisation: str = None, builtins=False) -> Path:
+    """Where model_to_tflite saves the conversion of a model."""
+    output_file = Path(model_path).with_suffix(".tflite")
+    if builtins:
+        output_file = output_file.with_name(f"{output_file.stem}-builtins.tflite")
+    if quantisation is not None:
+        output_file = output_file.with_name(f"{output_file.stem}-{quantisation}.tflite")
     if save_path is not None:
-        output_file = save_path / output_file.name
+        output_file = Path(save_path) / output_file.name
+    return output_file
+
+
+def model_to_tflite(model, model_path: Path, save_path: Path = None, optimise=False, quantisation: str = None, representative_data=None, builtins=False, analyse=True, output_file: Path = None):
+    """This actually converts a loaded Keras model to tflite format.
+    quantisation can be one of QUANTISATION_MODES, the model is saved with the mode added to its name.
+    int8 quantisation needs representative_data: a function returning an iterator of model input lists for calibration.
+    builtins converts an unrolled single step of the model that only uses TFLite's builtin ops, so it runs without the
+    Flex delegate (e.g., on tflite_runtime). These models are saved with -builtins in their name.
+    output_file overrides the name the model is saved with."""
+    import tensorflow as tf
+
+    # Setup output path and name.
+    if output_file is None:
+        output_file = tflite_file_name(model_path, save_path, quantisation, builtins)
 
     click.secho("Setup converter.", fg="blue")
-    converter = tf.lite.TFLiteConverter.from_keras_model(model)
-    converter.target_spec.supported_ops = [
-        tf.lite.OpsSet.TFLITE_BUILTINS,
-        tf.lite.OpsSet.SELECT_TF_OPS,
-    ]
-    converter._experimental_lower_tensor_list_ops = False
+    if builtins:
+        step = builtins_inference_function(model)
+        converter = tf.lite.TFLiteConverter.from_concrete_functions([step.get_concrete_function()], step)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS]
+        if representative_data is not None:
+            # the unrolled step takes its inputs by name.
+            input_names = ["inputs"] + [f"state_{s}_{i}" for i in range(inference_model_size(model)[3]) for s in "hc"]
+            calibration_data = representative_data
+            representative_data = lambda: (dict(zip(input_names, inputs)) for inputs in calibration_data())
+    else:
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS,
+            tf.lite.OpsSet.SELECT_TF_OPS,
+        ]
+        converter._experimental_lower_tensor_list_ops = False
 
-    if optimise:
+    if optimise or quantisation is not None:
         click.secho("Using default optimisations: this will reduce model size but may degrade performance.")
         converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantisation == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantisation == "int8":
+        assert representative_data is not None, "int8 quantisation needs representative data for calibration."
+        # the recurrent ops run as TF ops, so these stay float while the rest of the graph is int8.
+        converter.representative_dataset = representative_data
     
     converter.inference_input_type = tf.float32
     converter.inference_output_type = tf.float32
@@ -32,18 +131,159 @@ def model_to_tflite(model, model_path: Path, save_path: Path = None, optimise=Fa
     click.secho("Do the conversion.", fg="blue")
     tflite_model = converter.convert()
     
-    click.secho("Print Analysis...", fg="blue")
-    tf.lite.experimental.Analyzer.analyze(model_content=tflite_model)
+    if analyse:
+        click.secho("Print Analysis...", fg="blue")
+        tf.lite.experimental.Analyzer.analyze(model_content=tflite_model)
 
     click.secho("Saving..", fg="blue")
     click.secho(f"Saving tflite model to: {output_file}", fg="blue")
     with open(output_file, "wb") as f:
         f.write(tflite_model)
+
+    if builtins and not (optimise or quantisation is not None):
+        click.secho("Checking the builtins model against the Keras model...", fg="blue")
+        difference = validate_builtins_model(model, output_file)
+        if difference >= VALIDATION_TOLERANCE:
+            output_file.unlink()
+            raise AssertionError(f"The builtins model's outputs differ from the Keras model's by up to {difference}.")
+        click.secho(f"Builtins model matches the Keras model (largest difference: {difference:.2e}).", fg="green")
+    elif builtins:
+        # optimised weights are quantised, so the outputs only match the Keras model approximately.
+        difference = validate_builtins_model(model, output_file)
+        click.secho(f"Optimised builtins model differs from the Keras model by up to {difference:.2e}.", fg="yellow")
     return output_file
 
 
-def model_file_to_tflite(filename, save_path = None, optimise=False):
-    """Converts a given model"""
+def load_dataset_sequences(dataset_file: Path) -> list:
+    """Loads the performances, arrays of (dt, x_1, ..., x_n) rows, from a .npz dataset."""
+    with np.load(dataset_file, allow_pickle=True) as loaded:
+        return [np.asarray(perf, dtype=np.float32) for perf in loaded["perfs"]]
+
+
+def split_dataset(perfs: list) -> tuple:
+    """Splits a dataset into calibration data and held-out data from its end (which training doesn't learn from)."""
+    data = np.concatenate(perfs)
+    split = int(len(data) * (1 - HELD_OUT_SPLIT))
+    return data[:split], data[split:]
+
+
+def inference_model_size(model) -> tuple:
+    """The (dimension, units, mixtures, layers) of a Keras inference model with LSTM state inputs."""
+    dimension = model.inputs[0].shape[-1]
+    units = model.inputs[1].shape[-1]
+    layers = (len(model.inputs) - 1) // 2
+    mixtures = model.outputs[0].shape[-1] // (2 * dimension + 1)
+    return dimension, units, mixtures, layers
+
+
+def representative_dataset(model, data: np.ndarray, samples: int = CALIBRATION_SAMPLES):
+    """Makes a function yielding calibration inputs for an inference model:
+    steps from the dataset together with the LSTM states the model reaches while playing them."""
+    import impsy.mdrnn as mdrnn
+
+    dimension, units, _, layers = inference_model_size(model)
+
+    def generate():
+        states = mdrnn.lstm_blank_states(layers, units)
+        for value in data[:samples]:
+            inputs = [value.reshape(1, 1, dimension) * mdrnn.SCALE_FACTOR, *states]
+            yield [np.asarray(i, dtype=np.float32) for i in inputs]
+            states = [np.asarray(state) for state in model(inputs)[1:]]
+
+    return generate
+
+
+def logsumexp(values: np.ndarray) -> float:
+    largest = np.max(values)
+    return largest + np.log(np.sum(np.exp(values - largest)))
+
+
+def mdn_negative_log_likelihood(params: np.ndarray, target: np.ndarray, dimension: int, mixtures: int) -> float:
+    """The negative log-likelihood of a target under an MDN's mixture of diagonal gaussians.
+    params are laid out as keras_mdn_layer outputs them: means, then standard deviations, then mixture weight logits."""
+    split = mixtures * dimension
+    mus = params[:split].reshape(mixtures, dimension)
+    sigmas = params[split : 2 * split].reshape(mixtures, dimension)
+    logits = params[2 * split :]
+    log_pis = logits - logsumexp(logits)
+    log_gaussians = -0.5 * np.sum(((target - mus) / sigmas) ** 2 + 2 * np.log(sigmas) + np.log(2 * np.pi), axis=1)
+    return -logsumexp(log_pis + log_gaussians)
+
+
+def evaluate_tflite(tflite_file: Path, data: np.ndarray, dimension: int, units: int, mixtures: int, layers: int, samples: int = EVALUATION_SAMPLES) -> dict:
+    """Measures a tflite model's size, mean negative log-likelihood of each next step in some data, and generate latency."""
+    import impsy.mdrnn as mdrnn
+    from .bench import generate_latencies, latency_summary
+
+    model = mdrnn.TfliteMDRNN(Path(tflite_file), dimension, units, mixtures, layers)
+    data = data[: samples + 1]
+    nll = [
+        mdn_negative_log_likelihood(model.mixture_parameters(value).astype(np.float64), target * mdrnn.SCALE_FACTOR, dimension, mixtures)
+        for value, target in zip(data[:-1], data[1:])
+    ]
+    model.reset_lstm_states()
+    latency = latency_summary(generate_latencies(model))
+    return {
+        "file": str(tflite_file),
+        "size_bytes": Path(tflite_file).stat().st_size,
+        "nll": float(np.mean(nll)),
+        "p50_ms": latency["p50_ms"],
+        "p99_ms": latency["p99_ms"],
+    }
+
+
+def print_quantisation_report(report: dict) -> None:
+    for name in ["float", "quantised"]:
+        result = report[name]
+        click.secho(
+            f"{name}: {result['size_bytes'] / 1024:.1f}KB, NLL {result['nll']:.4f}, p50 {result['p50_ms']:.3f}ms, p99 {result['p99_ms']:.3f}ms",
+            fg="blue",
+        )
+    float_result, quantised_result = report["float"], report["quantised"]
+    click.secho(
+        f"{report['quantisation']} quantisation: {quantised_result['size_bytes'] / float_result['size_bytes']:.2f}x size, "
+        f"NLL drift {quantised_result['nll'] - float_result['nll']:+.4f}, "
+        f"p50 latency {quantised_result['p50_ms'] - float_result['p50_ms']:+.3f}ms",
+        fg="green",
+    )
+
+
+def quantise_model(model, model_path: Path, save_path: Path = None, quantisation: str = "int8", dataset_file: Path = None, builtins=False, analyse=True) -> dict:
+    """Converts a Keras inference model to both a float and a quantised tflite file.
+    With a .npz dataset (by default, the training dataset for the model's dimension if it exists), int8 quantisation is
+    calibrated on it, and the two models' log-likelihood and latency are compared on its held-out end.
+    The report is returned and saved as a .json file next to the quantised model."""
+    import json
+
+    assert quantisation in QUANTISATION_MODES, f"quantisation must be one of {QUANTISATION_MODES}"
+    dimension, units, mixtures, layers = inference_model_size(model)
+    if dataset_file is None and Path(f"datasets/training-dataset-{dimension}d.npz").exists():
+        dataset_file = Path(f"datasets/training-dataset-{dimension}d.npz")
+    calibration = held_out = None
+    if dataset_file is not None:
+        click.secho(f"Using dataset: {dataset_file}", fg="blue")
+        calibration, held_out = split_dataset(load_dataset_sequences(dataset_file))
+    assert calibration is not None or quantisation != "int8", "int8 quantisation needs a dataset for calibration."
+
+    float_file = model_to_tflite(model, model_path, save_path, builtins=builtins, analyse=analyse)
+    representative_data = None if calibration is None else representative_dataset(model, calibration)
+    quantised_file = model_to_tflite(model, model_path, save_path, quantisation=quantisation, representative_data=representative_data, builtins=builtins, analyse=analyse)
+    report = {"quantisation": quantisation, "dataset": None if dataset_file is None else str(dataset_file)}
+    if held_out is not None and len(held_out) > 1:
+        report["float"] = evaluate_tflite(float_file, held_out, dimension, units, mixtures, layers)
+        report["quantised"] = evaluate_tflite(quantised_file, held_out, dimension, units, mixtures, layers)
+        print_quantisation_report(report)
+    else:
+        report["float"] = {"file": str(float_file), "size_bytes": float_file.stat().st_size}
+        report["quantised"] = {"file": str(quantised_file), "size_bytes": quantised_file.stat().st_size}
+        click.secho("No held-out data, so the models' accuracy and latency weren't compared.", fg="yellow")
+    with open(quantised_file.with_suffix(".json"), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def model_file_to_tflite(filename, save_path = None, optimise=False, quantisation=None, dataset=None, builtins=False, analyse=True):
+    """Converts a given model, if quantisation is given both a float and quantised model are saved and the quantised file is returned."""
     import tensorflow as tf
     import keras_mdn_layer as mdn_layer
 
@@ -52,12 +292,15 @@ def model_file_to_tflite(filename, save_path = None, optimise=False):
     loaded_model = tf.keras.saving.load_model(
         filename, custom_objects={"MDN": mdn_layer.MDN}
     )
-    tflite_file = model_to_tflite(loaded_model, model_file, save_path=save_path, optimise=optimise)
+    if quantisation is not None:
+        report = quantise_model(loaded_model, model_file, save_path=save_path, quantisation=quantisation, dataset_file=dataset, builtins=builtins, analyse=analyse)
+        return Path(report["quantised"]["file"])
+    tflite_file = model_to_tflite(loaded_model, model_file, save_path=save_path, optimise=optimise, builtins=builtins, analyse=analyse)
     return tflite_file
 
 
 
-def config_to_tflite(config_path, save_path = None, optimise=False):
+def config_to_tflite(config_path, save_path = None, optimise=False, quantisation=None, dataset=None, builtins=False, analyse=True):
     """Converts the model specified in a config dictionary to tflite format."""
     import tensorflow as tf
     import impsy.mdrnn as mdrnn
@@ -78,10 +321,80 @@ def config_to_tflite(config_path, save_path = None, optimise=False):
     click.secho(f"MDRNN Loaded: {net.model_name}", fg="green")
     model_path = Path(config["model"]["file"])
     net.load_model(model_file=model_path)
-    tflite_file = model_to_tflite(net.model, model_path, save_path, optimise=optimise)
+    if quantisation is not None:
+        report = quantise_model(net.model, model_path, save_path=save_path, quantisation=quantisation, dataset_file=dataset, builtins=builtins, analyse=analyse)
+        return Path(report["quantised"]["file"])
+    tflite_file = model_to_tflite(net.model, model_path, save_path, optimise=optimise, builtins=builtins, analyse=analyse)
     return tflite_file
 
 
+def conversion_suffix(optimise=False, builtins=False) -> str:
+    """Names a conversion of a model in the registry's cache, so conversions with different options are kept apart."""
+    return "".join(["-builtins" if builtins else "", "-optimised" if optimise else "", ".tflite"])
+
+
+def convert_model_file(model_file: Path, output_file: Path, optimise=False, builtins=False, analyse=False) -> Path:
+    """Loads a .keras model and converts it to output_file, runs in convert_directory's worker processes."""
+    import tensorflow as tf
+    import keras_mdn_layer as mdn_layer
+
+    loaded_model = tf.keras.saving.load_model(model_file, custom_objects={"MDN": mdn_layer.MDN})
+    return model_to_tflite(loaded_model, model_file, optimise=optimise, builtins=builtins, analyse=analyse, output_file=output_file)
+
+
+def convert_directory(directory: Path, save_path: Path = None, optimise=False, builtins=False, analyse=False, workers: int = None, force=False) -> dict:
+    """Converts every .keras model (but not training checkpoints) in a directory to tflite in a pool of processes.
+    Conversions are cached in the registry by the model's content hash (and the conversion options), so models that
+    haven't changed since they were last converted are skipped, and their output is restored from the cache if it's missing
+    or was replaced. force converts every model again, e.g., after a change to the converter.
+    Returns the lists of model files that were converted, skipped and failed."""
+    directory = Path(directory)
+    registry = ModelRegistry(directory / ".cache")
+    suffix = conversion_suffix(optimise, builtins)
+    results = {"converted": [], "skipped": [], "failed": []}
+    pending = {}  # model files to convert, with their cache and output locations.
+    for record in registry.list_models(directory):
+        model_file = directory / record["name"]
+        if model_file.suffix != ".keras" or model_file.stem.endswith("-ckpt"):
+            continue  # training checkpoints are not inference models, so they aren't converted.
+        output_file = tflite_file_name(model_file, save_path, builtins=builtins)
+        cached_file = registry.artefact(model_file, suffix)
+        if force or not cached_file.exists():
+            pending[model_file] = (cached_file, output_file)
+            continue
+        if not output_file.exists() or registry.fingerprint(output_file) != registry.fingerprint(cached_file):
+            click.secho(f"Restoring {output_file} from the cache.", fg="blue")
+            shutil.copyfile(cached_file, output_file)
+        results["skipped"].append(model_file)
+
+    if pending:
+        click.secho(f"Converting {len(pending)} models ({len(results['skipped'])} up to date).", fg="blue")
+        registry.cache_dir.mkdir(parents=True, exist_ok=True)
+        # TensorFlow isn't safe to fork, so workers are started fresh.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {}
+            for model_file, (cached_file, output_file) in pending.items():
+                temporary_file = cached_file.with_name(f"{os.getpid()}-{cached_file.name}")
+                futures[pool.submit(convert_model_file, model_file, temporary_file, optimise, builtins, analyse)] = model_file
+            for future in as_completed(futures):
+                model_file = futures[future]
+                cached_file, output_file = pending[model_file]
+                try:
+                    future.result().replace(cached_file)
+                    shutil.copyfile(cached_file, output_file)
+                    results["converted"].append(model_file)
+                    click.secho(f"Converted {model_file} to {output_file}", fg="green")
+                except Exception as e:
+                    cached_file.with_name(f"{os.getpid()}-{cached_file.name}").unlink(missing_ok=True)
+                    results["failed"].append(model_file)
+                    click.secho(f"Couldn't convert {model_file}: {e}", fg="red")
+    click.secho(
+        f"Converted {len(results['converted'])}, skipped {len(results['skipped'])}, failed {len(results['failed'])}.",
+        fg="red" if results["failed"] else "green",
+    )
+    return results
+
+
 def weights_file_to_model_file(weights_file, model_size, dimension, save_path = None):
     """Constructs a model from a given weights file and saves as a .keras inference model."""
     import impsy.mdrnn as mdrnn
@@ -110,17 +423,32 @@ def weights_file_to_model_file(weights_file, model_size, dimension, save_path =
 @click.option(
     "--optimise/--no-optimise", default=False, help="Use default optimisations in TFLite conversion (may degrade model performance, but reduce model size)."
 )
-def convert_tflite(model, dimension, size, out_dir, optimise):
+@click.option(
+    "--quantise", "-q", type=click.Choice(QUANTISATION_MODES), help="Also save a quantised model (dynamic range, float16, or int8 which needs a dataset)."
+)
+@click.option('--dataset', help="A .npz dataset to calibrate int8 quantisation and compare the quantised model on (default: the training dataset for the model's dimension).")
+@click.option(
+    "--builtins/--no-builtins", default=False, help="Convert an unrolled model that only uses TFLite builtin ops, so it runs without the Flex delegate (e.g., with tflite_runtime)."
+)
+@click.option('--all', 'convert_all', is_flag=True, help="Convert every .keras model in the models directory (or the directory given with --model), skipping models that are already converted.")
+@click.option('--workers', '-w', type=int, help="Processes to convert models in with --all (default: one per CPU).")
+@click.option('--force', is_flag=True, help="With --all, convert models even if they are already converted (e.g., after updating TensorFlow).")
+@click.option("--analyse/--no-analyse", default=True, help="Print an analysis of each converted model.")
+def convert_tflite(model, dimension, size, out_dir, optimise, quantise, dataset, builtins, convert_all, workers, force, analyse):
     """Convert existing IMPSY model to tflite format."""
-    if model is None:
-        config_to_tflite("config.toml", save_path=out_dir, optimise=optimise)
+    if convert_all:
+        if quantise is not None or dataset is not None:
+            raise click.UsageError("--quantise and --dataset can't be used with --all, quantise models one at a time.")
+        convert_directory(model or "models", save_path=out_dir, optimise=optimise, builtins=builtins, analyse=analyse, workers=workers, force=force)
+    elif model is None:
+        config_to_tflite("config.toml", save_path=out_dir, optimise=optimise, quantisation=quantise, dataset=dataset, builtins=builtins, analyse=analyse)
     elif Path(model).suffix == ".keras":
         # it's a keras file
-        model_file_to_tflite(model, save_path=out_dir, optimise=optimise)
+        model_file_to_tflite(model, save_path=out_dir, optimise=optimise, quantisation=quantise, dataset=dataset, builtins=builtins, analyse=analyse)
     elif Path(model).suffix == ".h5":
         # it's an h5 file
         if dimension is not None and size is not None:
             model_file = weights_file_to_model_file(model, size, dimension, save_path=out_dir)
-            model_file_to_tflite(model_file, save_path=out_dir, optimise=optimise)
+            model_file_to_tflite(model_file, save_path=out_dir, optimise=optimise, quantisation=quantise, dataset=dataset, builtins=builtins, analyse=analyse)
         else:
             click.secho("You need to specify a dimension and size to convert an h5 file.")
@@ -1,9 +1,11 @@
 """impsy.train: Functions for training an impsy mdrnn model."""
 
+import json
 import random
+import shutil
 import numpy as np
 import click
-from .utils import mdrnn_config
+from .utils import mdrnn_config, model_file_parameters
 from pathlib import Path
 import os
 
@@ -13,6 +15,27 @@ import os
 SEQ_LEN = 50
 SEQ_STEP = 1
 SEED = 2345
+BACKUP_DIR = ".training-backup"  # in the save location, interrupted training runs are resumed from here.
+
+# Training performance options
+
+PRECISIONS = ["float32", "mixed_bfloat16", "mixed_float16"]  # Keras precision policies, bfloat16 is the fast one on CPUs.
+
+
+def configure_training(intra_op_threads: int = 0, inter_op_threads: int = 0, precision: str = "float32"):
+    """Sets TensorFlow's CPU thread pools (0 leaves TensorFlow's default) and the Keras precision policy for models built afterwards.
+    Threads can only be set before TensorFlow runs anything, so this should be called before building a model."""
+    import tensorflow as tf
+
+    assert precision in PRECISIONS, f"precision must be one of {PRECISIONS}"
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        click.secho(f"Couldn't set training threads (TensorFlow has already started): {e}", fg="yellow")
+    tf.keras.mixed_precision.set_global_policy(precision)
 
 # Functions for slicing up data
 
@@ -38,6 +61,75 @@ def seq_to_overlapping_format(examples):
     return (xs, ys)
 
 
+def strided_window_starts(lengths, num_steps, step_size, rng=None):
+    """The (performance, start) of each num_steps window, step_size apart, in performances of the given lengths.
+    With a numpy random generator, each performance's windows are moved along by a random offset
+    (less than step_size, and keeping the same number of windows), so different windows are picked each time."""
+    starts = []
+    for i, length in enumerate(lengths):
+        count = (length - num_steps) // step_size + 1
+        offset = 0
+        if rng is not None:
+            slack = length - num_steps - (count - 1) * step_size  # room left after the last window.
+            offset = int(rng.integers(0, min(slack, step_size - 1) + 1))
+        starts += [(i, offset + k * step_size) for k in range(count)]
+    return starts
+
+
+def strided_window_examples(corpus, num_steps, step_size, validation_split=0.1, seed=SEED):
+    """Prepares overlapping format examples from num_steps + 1 windows every step_size steps in each performance.
+    Returns a function that samples the training examples (X, y) for an epoch: each performance's windows start at a new
+    random offset and are shuffled. The last validation_split of the windows (from the end of the corpus, like
+    Keras' validation_split) are fixed validation examples (X_val, y_val), also returned."""
+    rng = np.random.default_rng(seed)
+    lengths = [len(perf) for perf in corpus]
+    starts = strided_window_starts(lengths, num_steps + 1, step_size)
+    split = len(starts) - int(len(starts) * validation_split)
+    assert split > 0, f"Not enough data for windows of {num_steps} steps."
+
+    def windows(starts):
+        examples = np.stack([corpus[i][start : start + num_steps + 1] for i, start in starts])
+        return examples[:, :-1], examples[:, 1:]
+
+    def sample():
+        # windows keep their order in each performance when moved, so the first split are still the training windows.
+        epoch_starts = strided_window_starts(lengths, num_steps + 1, step_size, rng)[:split]
+        return windows([epoch_starts[i] for i in rng.permutation(split)])
+
+    X_val, y_val = windows(starts[split:]) if split < len(starts) else (None, None)
+    return sample, X_val, y_val
+
+
+def stateful_sequence_examples(corpus, num_steps, batch_size, validation_split=0.1):
+    """Arranges performances into batch_size streams, cut into consecutive chunks of num_steps for stateful training.
+    Each performance is added to the shortest stream so far, and the streams are cut to the same length.
+    Batch k holds chunk k of every stream, so the LSTM states from one batch carry on into the next.
+    The last chunks of each stream (validation_split of them, at least one) are returned separately for validation.
+    Returns X, y, X_val, y_val where y is X one step later."""
+    streams = [[] for _ in range(batch_size)]
+    lengths = [0] * batch_size
+    for perf in sorted(corpus, key=len, reverse=True):
+        shortest = lengths.index(min(lengths))
+        streams[shortest].append(perf)
+        lengths[shortest] += len(perf)
+    chunks = (min(lengths) - 1) // num_steps
+    assert chunks > 1, f"Not enough data for {batch_size} streams of {num_steps} step chunks, try a smaller batch size."
+    steps = chunks * num_steps
+    streams = np.stack([np.concatenate(stream)[: steps + 1] for stream in streams])
+    dimension = streams.shape[-1]
+    # (batch, chunk, step, dimension) -> (chunk, batch, step, dimension) so that batches are consecutive chunks of each stream.
+    xs = streams[:, :-1].reshape(batch_size, chunks, num_steps, dimension).swapaxes(0, 1)
+    ys = streams[:, 1:].reshape(batch_size, chunks, num_steps, dimension).swapaxes(0, 1)
+    validation_chunks = max(1, int(chunks * validation_split)) if validation_split > 0 else 0
+    split = chunks - validation_chunks
+    return (
+        xs[:split].reshape(-1, num_steps, dimension),
+        ys[:split].reshape(-1, num_steps, dimension),
+        xs[split:].reshape(-1, num_steps, dimension),
+        ys[split:].reshape(-1, num_steps, dimension),
+    )
+
+
 def seq_to_singleton_format(examples):
     """Return the examples in seq to singleton format."""
     xs = []
@@ -60,15 +152,38 @@ def train_mdrnn(
     save_model: bool = True,
     save_weights: bool = False,
     save_tflite: bool = True,
-    log_files: list = None
+    log_files: list = None,
+    intra_op_threads: int = 0,
+    inter_op_threads: int = 0,
+    precision: str = "float32",
+    jit_compile: bool = False,
+    steps_per_execution: int = 1,
+    stateful: bool = False,
+    sequence_length: int = SEQ_LEN,
+    sequence_step: int = SEQ_STEP,
+    resume: bool = False,
+    finetune: str = None,
 ):
-    """Loads a dataset, creates a model and runs the training procedure."""
+    """Loads a dataset, creates a model and runs the training procedure.
+    The threads, precision, jit_compile and steps_per_execution options only change how fast training runs.
+    Training examples are overlapping windows of sequence_length steps, sequence_step apart. With a sequence_step over 1,
+    each epoch uses windows from a new random offset in each performance, so epochs are quicker but see different windows.
+    stateful streams each performance through the model in consecutive sequence_length chunks carrying the LSTM states
+    between batches (truncated backpropagation through time), rather than training on windows.
+    Training is backed up after each epoch, resume carries on from the backup of an interrupted run with the same dataset and model size.
+    finetune starts from the weights of an existing model (and uses its size) rather than from scratch."""
+    assert not (stateful and sequence_step > 1), "sequence_step can't be used with stateful training."
     import impsy.mdrnn as mdrnn
     from tensorflow import keras
     from .tflite_converter import model_to_tflite
 
-
     model_config = mdrnn_config(model_size)
+    if finetune is not None:
+        finetune_parameters = model_file_parameters(finetune)
+        if finetune_parameters is not None:
+            assert finetune_parameters["dimension"] == dimension, f"{finetune} is a {finetune_parameters['dimension']}D model, not {dimension}D."
+            model_config = finetune_parameters
+        click.secho(f"Fine-tuning: {finetune}", fg="blue")
     mdrnn_units = model_config["units"]
     mdrnn_layers = model_config["layers"]
     mdrnn_mixes = model_config["mixes"]
@@ -79,6 +194,12 @@ def train_mdrnn(
     click.secho(f"Units: {mdrnn_units}", fg="blue")
     click.secho(f"Layers: {mdrnn_layers}", fg="blue")
     click.secho(f"Mixtures: {mdrnn_mixes}", fg="blue")
+    click.secho(
+        f"Threads: {intra_op_threads or 'default'} intra-op, {inter_op_threads or 'default'} inter-op, precision: {precision}, "
+        f"XLA: {jit_compile}, steps per execution: {steps_per_execution}",
+        fg="blue",
+    )
+    configure_training(intra_op_threads, inter_op_threads, precision)
 
     random.seed(SEED)
     np.random.seed(SEED)
@@ -96,15 +217,29 @@ def train_mdrnn(
     print("Loaded performances:", len(corpus))
     print("Num touches:", np.sum([len(l) for l in corpus]))
 
-    # Restrict corpus to performances longer than the training sequence length.
-    corpus = [l for l in corpus if len(l) > SEQ_LEN + 1]
+    # Restrict corpus to performances long enough for at least one training example.
+    corpus = [l for l in corpus if len(l) >= sequence_length + 1]
     click.secho(f"Corpus Examples: {len(corpus)}", fg="blue")
+    click.secho(f"Sequence length: {sequence_length}, step: {sequence_step}", fg="blue")
 
+    validation_split = 0.10
+    validation_data = None
+    sample = None
     # Prepare training data as X and Y.
-    slices = []
-    for seq in corpus:
-        slices += slice_sequence_examples(seq, SEQ_LEN + 1, step_size=SEQ_STEP)
-    X, y = seq_to_overlapping_format(slices)
+    if stateful:
+        X, y, X_val, y_val = stateful_sequence_examples(corpus, sequence_length, batch_size, validation_split)
+        validation_data = (X_val, y_val)
+        click.secho(f"Stateful training: {batch_size} streams of {(len(X) + len(X_val)) // batch_size} chunks.", fg="blue")
+    elif sequence_step > 1:
+        X = y = None
+        sample, X_val, y_val = strided_window_examples(corpus, sequence_length, sequence_step, validation_split)
+        if X_val is not None:
+            validation_data = (X_val, y_val)
+    else:
+        slices = []
+        for seq in corpus:
+            slices += slice_sequence_examples(seq, sequence_length + 1, step_size=sequence_step)
+        X, y = seq_to_overlapping_format(slices)
 
     # Setup Training Model
     mdrnn_manager = mdrnn.PredictiveMusicMDRNN(
@@ -112,11 +247,38 @@ def train_mdrnn(
         dimension=dimension,
         n_hidden_units=mdrnn_units,
         n_mixtures=mdrnn_mixes,
-        sequence_length=SEQ_LEN,
+        sequence_length=sequence_length,
         layers=mdrnn_layers,
+        jit_compile=jit_compile,
+        steps_per_execution=steps_per_execution,
+        stateful=stateful,
+        batch_size=batch_size,
     )
+    if finetune is not None:
+        mdrnn_manager.warm_start(finetune)
+
+    # Training is backed up for each dataset and model size, so that an interrupted run can be resumed.
+    backup_dir = save_location / BACKUP_DIR / f"{dataset_location.stem}-dim{dimension}-layers{mdrnn_layers}-units{mdrnn_units}-mixtures{mdrnn_mixes}"
+    run_file = backup_dir / "run.json"
+    run = {"dataset": str(dataset_location), "finetune": None if finetune is None else str(finetune)}
+    if resume and run_file.exists():
+        interrupted_run = json.loads(run_file.read_text())
+        if any(interrupted_run.get(key) != value for key, value in run.items()):
+            raise click.ClickException(
+                f"The interrupted run in {backup_dir} was training on {interrupted_run.get('dataset')} "
+                f"(fine-tuning {interrupted_run.get('finetune')}), so it can't be resumed with these settings."
+            )
+        # carry on with the interrupted run's name, so it keeps the same checkpoint and log files.
+        mdrnn_manager.timestamp = interrupted_run["timestamp"]
+        mdrnn_manager.model_name = mdrnn_manager.mdrnn_model_name()
+        click.secho(f"Resuming training of {mdrnn_manager.model_name}", fg="yellow")
+    else:
+        if resume:
+            click.secho("No interrupted training to resume, starting a new run.", fg="yellow")
+        shutil.rmtree(backup_dir, ignore_errors=True)
+        backup_dir.mkdir(parents=True)
+        run_file.write_text(json.dumps({"timestamp": mdrnn_manager.timestamp, **run}))
 
-    validation_split = 0.10
     history = mdrnn_manager.train(
         X,
         y,
@@ -126,8 +288,12 @@ def train_mdrnn(
         early_stopping=early_stopping,
         save_location=save_location,
         validation_split=validation_split,
-        patience=patience
+        patience=patience,
+        validation_data=validation_data,
+        sample=sample,
+        backup_dir=backup_dir / "checkpoint",
     )
+    shutil.rmtree(backup_dir, ignore_errors=True)  # training finished, so there's nothing to resume.
 
     # Save final Model
     model_name = mdrnn_manager.model_name
@@ -145,6 +311,9 @@ def train_mdrnn(
         mdrnn_manager.model.save_weights(model_weights_file)
         output["weights_file"] = model_weights_file
     
+    # Inference models are always float32, the trained weights are float32 in either precision.
+    keras.mixed_precision.set_global_policy("float32")
+
     if save_model:
         # Save .keras file
         trained_weights = mdrnn_manager.model.get_weights()
@@ -232,6 +401,22 @@ def train_mdrnn(
     default="",
     help="Comma-separated list of log files used for training",
 )
+@click.option("--intra-threads", type=int, default=0, help="Threads used within each TensorFlow op (default: TensorFlow's choice).")
+@click.option("--inter-threads", type=int, default=0, help="TensorFlow ops run at the same time (default: TensorFlow's choice).")
+@click.option(
+    "--precision", type=click.Choice(PRECISIONS), default="float32", help="Training precision, mixed_bfloat16 can be faster on recent CPUs."
+)
+@click.option("--jit/--no-jit", default=False, help="Compile training steps with XLA.")
+@click.option("--steps-per-execution", type=int, default=1, help="Training batches run in each TensorFlow call, higher values reduce overhead for small models.")
+@click.option("-L", "--seqlen", type=int, default=SEQ_LEN, help=f"Length of the training sequences, default={SEQ_LEN}.")
+@click.option(
+    "--seqstep", type=int, default=SEQ_STEP, help="Steps between training sequences, over 1 samples windows from a random offset each epoch (not with --stateful), default=1."
+)
+@click.option("--resume", is_flag=True, help="Carry on from the last epoch of an interrupted training run of the same model size.")
+@click.option("--finetune", type=str, default=None, help="A .keras or .h5 model to start training from, e.g., to update a model with new logs.")
+@click.option(
+    "--stateful/--no-stateful", default=False, help="Stream performances through the model in consecutive chunks, carrying LSTM state between batches, instead of overlapping windows."
+)
 def train(
     dimension: int,
     source: str,
@@ -241,8 +426,20 @@ def train(
     numepochs: int,
     batchsize: int,
     log_files: str,
+    intra_threads: int,
+    inter_threads: int,
+    precision: str,
+    jit: bool,
+    steps_per_execution: int,
+    stateful: bool,
+    seqlen: int,
+    seqstep: int,
+    resume: bool,
+    finetune: str,
 ):
     """Trains an IMPSY MDRNN model based on an existing dataset (run dataset command first!)."""
+    if stateful and seqstep > 1:
+        raise click.UsageError("--seqstep can't be used with --stateful, stateful training streams every step of each performance.")
     log_files_list = log_files.split(",") if log_files else []
     click.secho(
         f"IMPSY: Going to train a {dimension}D, {modelsize} sized MDRNN model.",
@@ -250,6 +447,16 @@ def train(
     )
     train_mdrnn(
         dimension, source, modelsize, earlystopping, patience, numepochs, batchsize,
-        log_files=log_files_list
+        log_files=log_files_list,
+        intra_op_threads=intra_threads,
+        inter_op_threads=inter_threads,
+        precision=precision,
+        jit_compile=jit,
+        steps_per_execution=steps_per_execution,
+        stateful=stateful,
+        sequence_length=seqlen,
+        sequence_step=seqstep,
+        resume=resume,
+        finetune=finetune,
     )
     click.secho("IMPSY: training completed.", fg="green")
@@ -1,8 +1,10 @@
 import numpy as np
 import pandas as pd
 import tomllib
+import re
 import click
 import mido
+from mido.messages.specs import SPEC_BY_STATUS
 from typing import List
 
 
@@ -33,6 +35,18 @@ def mdrnn_config(size: str):
     return SIZE_TO_PARAMETERS[size]
 
 
+MODEL_NAME_PATTERN = re.compile(r"dim(\d+)-layers(\d+)-units(\d+)-mixtures(\d+)")
+
+
+def model_file_parameters(model_file) -> dict:
+    """Get the dimension, layers, units and mixtures from an IMPSY model file name, or None if they are not in the name."""
+    match = MODEL_NAME_PATTERN.search(str(model_file))
+    if match is None:
+        return None
+    dimension, layers, units, mixes = map(int, match.groups())
+    return {"dimension": dimension, "units": units, "mixes": mixes, "layers": layers}
+
+
 # Fake data generator for tests.
 
 
@@ -130,6 +144,37 @@ def midi_message_to_index_value(msg: mido.Message, input_mapping: dict) -> (int,
     return (index, value)
 
 
+class RunningStatusParser(mido.Parser):
+    """A mido MIDI parser that also understands running status (channel messages that leave out a repeated status byte),
+    as sent by many hardware MIDI devices over serial."""
+
+    def __init__(self, data=None):
+        self.running_status = None  # the last channel status byte.
+        self.data_remaining = 0  # data bytes left in the current message.
+        super().__init__(data)
+
+    def feed(self, data):
+        """Feed MIDI bytes to the parser, adding any status bytes left out by running status."""
+        expanded = bytearray()
+        for byte in data:
+            if byte >= 0xF8:
+                pass  # real time messages can appear anywhere and don't change the running status.
+            elif byte >= 0xF0:
+                # system messages cancel running status, sysex data is passed through as it is.
+                self.running_status = None
+                self.data_remaining = 0 if byte == 0xF0 or byte not in SPEC_BY_STATUS else SPEC_BY_STATUS[byte]["length"] - 1
+            elif byte >= 0x80:
+                self.running_status = byte
+                self.data_remaining = SPEC_BY_STATUS[byte]["length"] - 1
+            else:
+                if self.data_remaining == 0 and self.running_status is not None:
+                    expanded.append(self.running_status)
+                    self.data_remaining = SPEC_BY_STATUS[self.running_status]["length"] - 1
+                self.data_remaining = max(self.data_remaining - 1, 0)
+            expanded.append(byte)
+        super().feed(expanded)
+
+
 def match_midi_port_to_list(port, port_list):
     """Return the closest actual MIDI port name given a partial match and a list."""
     if port in port_list:
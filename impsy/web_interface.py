@@ -12,6 +12,7 @@ import subprocess
 from impsy.dataset import generate_dataset, generate_dataset_from_files
 from pathlib import Path
 from impsy.osc_server import IMPSYOSCServer
+from impsy.registry import ModelRegistry
 import asyncio
 import numpy as np
 import queue
@@ -22,6 +23,9 @@ import tensorflow as tf
 from tensorboard.backend.event_processing import event_accumulator
 import re
 import mido
+import socket
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.osc_message import OscMessage
 
 app = Flask(__name__, static_folder='./frontend/build', static_url_path='')
 app.secret_key = "impsywebui"
@@ -46,6 +50,8 @@ ROUTE_NAMES = {
     'datasets': 'Dataset Files',
 }
 
+model_registry = ModelRegistry(MODEL_DIR / '.cache')  # remembers model file hashes so the models page doesn't reread files.
+
 training_queue = queue.Queue()
 training_process = None
 model_process = None
@@ -202,14 +208,18 @@ def models():
             return jsonify({'error': str(e)}), 500
 
     # For GET request, get and sort model files
-    model_files = [f for f in os.listdir(MODEL_DIR) 
-                    if f.endswith('.h5') or f.endswith('.tflite') or f.endswith('.keras')]
+    model_files = [record['name'] for record in model_registry.list_models(MODEL_DIR)]
     
     # Sort model files by date in filename (newest first)
     model_files.sort(key=lambda x: x.split('-')[0] + x.split('-')[1] if '-' in x else '', reverse=True)
     
     return jsonify(model_files)
 
+# Model files with their content hashes and size parameters
+@app.route('/api/model-registry', methods=['GET'])
+def model_registry_info():
+    return jsonify(model_registry.list_models(MODEL_DIR))
+
 # Get the current configuration file
 @app.route('/api/config', methods=['GET'])
 def get_config():
@@ -325,6 +335,15 @@ def start_training():
         num_epochs = data.get('numEpochs', 100)
         batch_size = data.get('batchSize', 64)
         log_files = data.get('logFiles', [])
+        intra_threads = data.get('intraOpThreads', 0)
+        inter_threads = data.get('interOpThreads', 0)
+        precision = data.get('precision', 'float32')
+        jit_compile = data.get('jitCompile', False)
+        steps_per_execution = data.get('stepsPerExecution', 1)
+        sequence_length = data.get('sequenceLength', 50)
+        sequence_step = data.get('sequenceStep', 1)
+        resume = data.get('resume', False)
+        finetune_model = data.get('finetuneModel')
 
         def run_training_command():
             try:
@@ -337,9 +356,24 @@ def start_training():
                     "-M", model_size,
                     "-N", str(num_epochs),
                     "-B", str(batch_size),
-                    "--log-files", ",".join(log_files)
+                    "--log-files", ",".join(log_files),
+                    "--intra-threads", str(intra_threads),
+                    "--inter-threads", str(inter_threads),
+                    "--precision", precision,
+                    "--steps-per-execution", str(steps_per_execution),
+                    "--seqlen", str(sequence_length),
+                    "--seqstep", str(sequence_step),
+                    "--jit" if jit_compile else "--no-jit",
                 ]
 
+                if resume:
+                    command.append("--resume")
+                if finetune_model:
+                    finetune_file = MODEL_DIR / os.path.basename(finetune_model)
+                    if finetune_file.suffix == ".tflite":
+                        finetune_file = finetune_file.with_suffix(".keras")  # training saves both, only .keras can be trained.
+                    command.extend(["--finetune", str(finetune_file)])
+
                 # Add early stopping options if enabled
                 if early_stopping:
                     command.extend(["--earlystopping", "-P", str(patience)])
@@ -403,7 +437,16 @@ def start_training():
                 "earlyStoppingEnabled": early_stopping,
                 "patience": patience,
                 "numEpochs": num_epochs,
-                "batchSize": batch_size
+                "batchSize": batch_size,
+                "intraOpThreads": intra_threads,
+                "interOpThreads": inter_threads,
+                "precision": precision,
+                "jitCompile": jit_compile,
+                "stepsPerExecution": steps_per_execution,
+                "sequenceLength": sequence_length,
+                "sequenceStep": sequence_step,
+                "resume": resume,
+                "finetuneModel": finetune_model
             }
         })
 
@@ -740,10 +783,16 @@ def load_model():
         except Exception as e:
             return jsonify({'error': f'Error updating configuration: {str(e)}'}), 500
 
+        # If a model is already running, swap the new model in without restarting it.
+        hot_swapped = False
+        if model_file and model_process is not None and model_process.poll() is None:
+            hot_swapped = swap_running_model(model_file)
+
         return jsonify({
             'success': True,
-            'message': 'Model loaded successfully',
-            'configPath': str(project_file)
+            'message': 'Model swapped into the running system' if hot_swapped else 'Model loaded successfully',
+            'configPath': str(project_file),
+            'hotSwapped': hot_swapped
         })
 
     except Exception as e:
@@ -870,6 +919,65 @@ def model_status():
             "message": f"Error checking model status: {str(e)}"
         }), 500
 
+def run_process_osc_address():
+    """The address of the OSC server of a `run` process using the current config, or None if OSC isn't configured."""
+    with open(CONFIG_FILE, 'rb') as f:
+        config = tomllib.load(f)
+    if 'osc' not in config:
+        return None
+    server_ip = config['osc']['server_ip']
+    if server_ip in ['0.0.0.0', '']:
+        server_ip = '127.0.0.1' # the server listens everywhere, so ask it locally.
+    return (server_ip, config['osc']['server_port'])
+
+def swap_running_model(model_file, keep_state=False):
+    """Asks a running `run` process to load and swap in a new model over OSC. Returns True if the request was sent."""
+    address = run_process_osc_address()
+    if address is None:
+        return False
+    message = OscMessageBuilder(address='/model')
+    message.add_arg(str(model_file))
+    message.add_arg(1 if keep_state else 0)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(message.build().dgram, address)
+    return True
+
+# Swap a model into the running system without restarting it
+@app.route('/api/swap-model', methods=['POST'])
+def swap_model():
+    try:
+        data = request.json
+        model_file = data.get('modelFile', '')
+        if not model_file:
+            return jsonify({'error': 'Model file is required'}), 400
+        if not model_file.startswith('models/'):
+            model_file = f"models/{model_file}"
+        if model_process is None or model_process.poll() is not None:
+            return jsonify({'error': 'Model is not running'}), 409
+        if not swap_running_model(model_file, keep_state=data.get('keepState', False)):
+            return jsonify({'error': 'Model swapping needs an [osc] section in the config.'}), 404
+        return jsonify({'success': True, 'message': f'Swapping in {model_file}'})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Get timing metrics from the running model over OSC
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    try:
+        address = run_process_osc_address()
+        if address is None:
+            return jsonify({'error': 'Metrics need an [osc] section in the config.'}), 404
+        query = OscMessageBuilder(address='/metrics').build()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(1.0)
+            sock.sendto(query.dgram, address)
+            reply = OscMessage(sock.recv(65536))
+        return jsonify(json.loads(reply.params[0]))
+    except socket.timeout:
+        return jsonify({'error': 'No reply from IMPSY, is the model running?'}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/stop-model', methods=['POST'])
 def stop_model():
     try:
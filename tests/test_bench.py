@@ -0,0 +1,66 @@
+from impsy import bench, utils
+import numpy as np
+import pytest
+from pathlib import Path
+
+
+@pytest.fixture(scope="session")
+def user_only_untrained_config():
+    """get a config file without a neural network and in user-only mode."""
+    config_path = Path("configs") / "user-only-example.toml"
+    config = utils.get_config_data(config_path)
+    return(config)
+
+
+def test_latency_summary():
+    latencies = np.arange(1, 101) * 1_000_000 # 1ms to 100ms
+    summary = bench.latency_summary(latencies)
+    assert summary["max_ms"] == 100
+    assert summary["p50_ms"] < summary["p95_ms"] < summary["p99_ms"] <= summary["max_ms"]
+
+
+def test_match_responses():
+    sent = [0, 100, 200, 300]
+    arrivals = [10, 15, 250, 310]
+    latencies = bench.match_responses(sent, arrivals)
+    assert list(latencies) == [10, 50, 10] # no response to the second stimulus.
+
+
+def test_latency_histogram():
+    latencies = np.random.randint(100_000, 10_000_000, size=100)
+    histogram = bench.latency_histogram(latencies, bins=5)
+    assert len(histogram) == 5
+    assert sum(count for _, _, count in histogram) == 100
+
+
+@pytest.mark.parametrize("server_mode", bench.OSC_SERVER_MODES)
+def test_osc_throughput(server_mode):
+    result = bench.measure_osc_throughput(server_mode, packets=50)
+    assert result["received"] > 0
+    assert result["received"] + result["lost"] == 50
+    assert result["packets_per_s"] > 0
+
+
+@pytest.mark.parametrize("reactor", ["threads", "asyncio"])
+def test_e2e_latency(user_only_untrained_config, reactor):
+    latencies = bench.measure_e2e_latency(user_only_untrained_config, "useronly", "osc", stimuli=10, interval=0.01, reactor=reactor)
+    assert len(latencies) > 0
+
+
+def test_training_throughput():
+    result = bench.measure_training_throughput(Path("datasets") / "training-dataset-9d.npz", 9, "xs", batch_size=8, batches=2, steps_per_execution=2)
+    assert result["samples_per_s"] > 0
+    assert np.isfinite(result["loss"])
+
+
+def test_e2e_latency_server_fails(user_only_untrained_config, monkeypatch):
+    """If the interaction server can't start, the benchmark stops instead of waiting for it forever."""
+    import click
+    from impsy import interaction
+
+    def fail(self):
+        raise RuntimeError("no model")
+
+    monkeypatch.setattr(interaction.InteractionServer, "serve_forever", fail)
+    with pytest.raises(click.ClickException):
+        bench.measure_e2e_latency(user_only_untrained_config, "useronly", "osc", stimuli=1)
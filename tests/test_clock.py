@@ -0,0 +1,19 @@
+from impsy import clock
+import pytest
+import time
+
+
+def test_wall_time():
+    """Clock timestamps convert to wall clock times consistently."""
+    before = time.time()
+    timestamp = clock.now_ns()
+    after = time.time()
+    assert before - 0.01 <= clock.wall_time(timestamp) <= after + 0.01
+    assert clock.wall_time(timestamp + 1_500_000_000) - clock.wall_time(timestamp) == pytest.approx(1.5, abs=1e-6)
+    assert clock.wall_datetime(timestamp).timestamp() == pytest.approx(clock.wall_time(timestamp), abs=1e-6)
+
+
+def test_seconds_between():
+    start = clock.now_ns()
+    assert clock.seconds_between(start, start + 250_000_000) == 0.25
+    assert clock.seconds_between(start, clock.now_ns()) >= 0
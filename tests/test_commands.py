@@ -19,6 +19,13 @@ def test_tflite_converter_command(models_location, keras_file, weights_file):
     result = runner.invoke(cli, ["convert-tflite", "-model", str(keras_file),"--out_dir", str(models_location)])
     result = runner.invoke(cli, ["convert-tflite", "-model", str(weights_file),"--out_dir", str(models_location)])
 
+def test_train_stateful_seqstep():
+    """Stateful training uses every step, so a sequence step is rejected."""
+    runner = CliRunner()
+    result = runner.invoke(cli, ["train", "--stateful", "--seqstep", "4"])
+    assert result.exit_code == 2
+    assert "--seqstep" in result.output
+
 # def test_train_command():
     # runner = CliRunner()
     # result = runner.invoke(cli, ["train", "--out_dir", str(models_location)])
@@ -27,6 +34,14 @@ def test_tflite_converter_command(models_location, keras_file, weights_file):
 #     runner = CliRunner()
 #     result = runner.invoke(cli, ["dataset"])
 
+def test_bench_command(tmp_path):
+    runner = CliRunner()
+    output = tmp_path / "bench.json"
+    result = runner.invoke(cli, ["bench", "-D", "2", "-U", "8", "-n", "5", "-o", str(output)])
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ["bench", "-D", "2", "-U", "8", "-n", "5", "-b", "tflite", "-o", str(tmp_path / "bench2.json"), "--compare", str(output)])
+    assert result.exit_code == 0
+
 def test_run_command():
     runner = CliRunner()
     result = runner.invoke(cli, ["run"])
@@ -1,7 +1,10 @@
 from impsy import dataset
 from impsy import train
+import click
+import json
 import numpy as np
 import os
+import pytest
 import tensorflow as tf
 
 
@@ -51,3 +54,133 @@ def test_train_command(trained_model):
     assert os.path.isfile(trained_model["keras_file"])
     assert os.path.isfile(trained_model["tflite_file"])
     assert isinstance(trained_model["history"], tf.keras.callbacks.History)
+
+
+def test_stateful_sequence_examples(dimension):
+    """Batches of stateful examples carry on from each other in each stream."""
+    corpus = [np.random.rand(length, dimension) for length in [300, 250, 120, 90]]
+    X, y, X_val, y_val = train.stateful_sequence_examples(corpus, 10, 2, validation_split=0.1)
+    assert X.shape[1:] == (10, dimension)
+    assert len(X) % 2 == 0 and len(X_val) % 2 == 0 and len(X_val) > 0
+    assert np.array_equal(X[0, 1:], y[0, :-1])
+    assert np.array_equal(X[2, 0], y[0, -1]) # the next batch continues the first stream.
+    assert np.array_equal(X_val[0, 0], y[-2, -1])
+
+
+def test_strided_window_examples(dimension):
+    """Strided windows are resampled each epoch with the same number of examples."""
+    corpus = [np.random.rand(length, dimension) for length in [60, 75, 100]]
+    starts = train.strided_window_starts([20], 5, 4, np.random.default_rng())
+    assert len(starts) == 4 and all(start + 5 <= 20 for _, start in starts)
+    sample, X_val, y_val = train.strided_window_examples(corpus, 10, 4, validation_split=0.1)
+    X, y = sample()
+    assert X.shape[1:] == (10, dimension)
+    assert len(sample()[0]) == len(X)
+    assert np.array_equal(X[:, 1:], y[:, :-1])
+    assert len(X_val) > 0
+
+
+def test_finetune(trained_model, dimension, dataset_location, models_location, mdrnn_size):
+    """A model can be trained further from an existing model, and the training backup is removed afterwards."""
+    output = train.train_mdrnn(
+        dimension=dimension,
+        dataset_location=dataset_location,
+        model_size=mdrnn_size,
+        early_stopping=False,
+        patience=10,
+        num_epochs=1,
+        batch_size=1,
+        save_location=models_location,
+        save_tflite=False,
+        finetune=trained_model["keras_file"],
+    )
+    assert os.path.isfile(output["keras_file"])
+    assert not any((models_location / train.BACKUP_DIR).iterdir())
+
+
+def training_corpus(dataset_file, sequence_length):
+    """The performances train_mdrnn uses from a dataset file."""
+    with np.load(dataset_file, allow_pickle=True) as loaded:
+        return [l for l in loaded["perfs"] if len(l) >= sequence_length + 1]
+
+
+def test_stateful_training(dimension, dataset_file, dataset_location, tmp_path, mdrnn_size):
+    """A stateful model trains on each batch of stream chunks in order and saves an inference model."""
+    output = train.train_mdrnn(
+        dimension=dimension,
+        dataset_location=dataset_location,
+        model_size=mdrnn_size,
+        early_stopping=False,
+        patience=10,
+        num_epochs=1,
+        batch_size=2,
+        save_location=tmp_path,
+        save_tflite=False,
+        stateful=True,
+        sequence_length=10,
+    )
+    X, _, _, _ = train.stateful_sequence_examples(training_corpus(dataset_file, 10), 10, 2)
+    assert output["history"].params["steps"] == len(X) // 2
+    assert os.path.isfile(output["keras_file"])
+
+
+def test_strided_training(dimension, dataset_file, dataset_location, tmp_path, mdrnn_size):
+    """With a sequence step over 1, each epoch has one batch for every batch_size of the strided windows."""
+    output = train.train_mdrnn(
+        dimension=dimension,
+        dataset_location=dataset_location,
+        model_size=mdrnn_size,
+        early_stopping=False,
+        patience=10,
+        num_epochs=1,
+        batch_size=4,
+        save_location=tmp_path,
+        save_tflite=False,
+        sequence_length=10,
+        sequence_step=3,
+    )
+    sample, _, _ = train.strided_window_examples(training_corpus(dataset_file, 10), 10, 3)
+    X, _ = sample()
+    assert output["history"].params["steps"] == -(-len(X) // 4)
+    assert os.path.isfile(output["keras_file"])
+
+
+def test_resume(dimension, dataset_location, tmp_path, mdrnn_size, monkeypatch):
+    """An interrupted run is resumed with the same model name, from the epoch after its last backup, only with the same dataset."""
+
+    class InterruptedBackup(tf.keras.callbacks.BackupAndRestore):
+        def on_epoch_end(self, epoch, logs=None):
+            super().on_epoch_end(epoch, logs)
+            raise RuntimeError("interrupted")
+
+    training = dict(
+        dimension=dimension,
+        dataset_location=dataset_location,
+        model_size=mdrnn_size,
+        early_stopping=False,
+        patience=10,
+        num_epochs=2,
+        batch_size=1,
+        save_location=tmp_path,
+        save_tflite=False,
+        sequence_length=10,
+    )
+    monkeypatch.setattr(tf.keras.callbacks, "BackupAndRestore", InterruptedBackup)
+    with pytest.raises(RuntimeError):
+        train.train_mdrnn(**training)
+    monkeypatch.undo()
+    run_files = list((tmp_path / train.BACKUP_DIR).glob("*/run.json"))
+    assert len(run_files) == 1
+    run = json.loads(run_files[0].read_text())
+    timestamp = run["timestamp"]
+
+    # a backup from training on another dataset isn't resumed.
+    run_files[0].write_text(json.dumps({**run, "dataset": "another-dataset.npz"}))
+    with pytest.raises(click.ClickException):
+        train.train_mdrnn(**training, resume=True)
+    run_files[0].write_text(json.dumps(run))
+
+    output = train.train_mdrnn(**training, resume=True)
+    assert output["name"].startswith(f"{timestamp}-musicMDRNN")
+    assert output["history"].epoch == [1]
+    assert not run_files[0].exists()
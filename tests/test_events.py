@@ -0,0 +1,19 @@
+from impsy import events
+import numpy as np
+
+
+def test_event_ring():
+    """Slots are handed out until they run out, and can be claimed again once released."""
+    ring = events.EventRing(4, 3)
+    indexes = [ring.claim(i, events.SOURCE_RNN, voice=2) for i in range(4)]
+    assert sorted(indexes) == [0, 1, 2, 3]
+    assert ring.claim(5, events.SOURCE_INTERFACE) is None
+    ring.values[indexes[1]] = [0.1, 0.5, 1.0]
+    assert ring.values.dtype == np.float32
+    assert ring.timestamps[indexes[1]] == 1
+    assert ring.voices[indexes[1]] == 2
+    assert events.SOURCES[ring.sources[indexes[1]]] == "rnn"
+    ring.release(indexes[1])
+    assert ring.available() == 1
+    assert ring.claim(6, events.SOURCE_INTERFACE) == indexes[1]
+    assert ring.timestamps[indexes[1]] == 6
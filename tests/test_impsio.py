@@ -1,9 +1,20 @@
-from impsy import impsio, utils
+from impsy import impsio, utils, metrics, clock
 import pytest
 import numpy as np
 import time
 from pathlib import Path
 import mido
+import json
+import socket
+import asyncio
+import threading
+import os
+import select
+from websockets.sync.client import connect as websocket_connect
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.osc_message import OscMessage
+from pythonosc.osc_bundle import OscBundle
+from pythonosc import udp_client
 
 
 @pytest.fixture(scope="session")
@@ -75,6 +86,20 @@ def test_midi_message_handling():
 
 
 
+def test_running_status_parser():
+    """Channel messages without a repeated status byte are parsed, real time bytes don't interrupt them."""
+    parser = utils.RunningStatusParser()
+    parser.feed(bytes([0x90, 60, 100, 61, 101, 0xF8, 62, 102, 0xC0, 5, 6, 0xB0, 1, 2, 3, 4]))
+    messages = list(parser)
+    assert [m.type for m in messages] == ["note_on"] * 2 + ["clock", "note_on"] + ["program_change"] * 2 + ["control_change"] * 2
+    assert [m.note for m in messages if m.type == "note_on"] == [60, 61, 62]
+    assert messages[-1].control == 3 and messages[-1].value == 4
+    # running status carries over between feeds.
+    parser.feed(bytes([5]))
+    parser.feed(bytes([6]))
+    assert [(m.control, m.value) for m in parser] == [(5, 6)]
+
+
 def test_midi_mapping_to_output(output_values, midi_output_mapping):
     output_messages = utils.output_values_to_midi_messages(output_values, midi_output_mapping)
     assert len(output_messages) == len(output_values), "Number of output messages does not match number of output values"
@@ -106,6 +131,85 @@ def test_websocket_server(default_config, sparse_callback, dense_callback, outpu
 
 
 
+def test_websocket_batched_output(default_config, sparse_callback, dense_callback, output_values):
+    """With batch on, each output is sent to clients as one frame with a line per MIDI message."""
+    config = {**default_config, "websocket": {**default_config["websocket"], "server_ip": "127.0.0.1", "batch": True}}
+    sender = impsio.WebSocketServer(config, sparse_callback, dense_callback)
+    sender.connect()
+    time.sleep(0.1)
+    with websocket_connect(f"ws://127.0.0.1:{config['websocket']['server_port']}") as ws:
+        time.sleep(0.1)
+        sender.send(output_values)
+        frame = ws.recv(timeout=1.0)
+    sender.disconnect()
+    lines = frame.split("\n")
+    assert len(lines) == len(config["websocket"]["output"])
+    assert all(line.startswith("/channel/") for line in lines)
+
+
+def test_websocket_binary_subprotocols(default_config, output_values):
+    """Clients can use float32 vectors or raw MIDI bytes instead of text by asking for a subprotocol."""
+    dense_received = []
+    sparse_received = []
+    config = {**default_config, "websocket": {**default_config["websocket"], "server_ip": "127.0.0.1"}}
+    sender = impsio.WebSocketServer(
+        config,
+        lambda index, value, timestamp=None: sparse_received.append((index, value)),
+        lambda values, timestamp=None: dense_received.append(values),
+    )
+    sender.connect()
+    time.sleep(0.1)
+    url = f"ws://127.0.0.1:{config['websocket']['server_port']}"
+    with websocket_connect(url, subprotocols=[impsio.WEBSOCKET_FLOAT32_SUBPROTOCOL]) as float_ws, websocket_connect(
+        url, subprotocols=[impsio.WEBSOCKET_MIDI_SUBPROTOCOL]
+    ) as midi_ws:
+        assert float_ws.subprotocol == impsio.WEBSOCKET_FLOAT32_SUBPROTOCOL
+        float_ws.send(np.array([0.25, 0.75], dtype="<f4").tobytes())  # too short for the dimension, so it is ignored.
+        float_ws.send(np.asarray(output_values, dtype="<f4").tobytes())
+        midi_ws.send(mido.Message("note_on", channel=0, note=64, velocity=100).bin())
+        time.sleep(0.1)
+        sender.send(output_values)
+        float_frame = float_ws.recv(timeout=1.0)
+        midi_frame = midi_ws.recv(timeout=1.0)
+    sender.disconnect()
+    assert dense_received == [pytest.approx(list(output_values), abs=1e-6)]
+    assert sparse_received == [(0, 64 / 127.0)]
+    assert np.frombuffer(float_frame, dtype="<f4") == pytest.approx(output_values, abs=1e-6)
+    midi_messages = mido.parse_all(midi_frame)
+    assert len(midi_messages) == len(config["websocket"]["output"])
+
+
+def test_websocket_writer_drops_slow_client():
+    """A client that stops reading is dropped once its queue is full, without blocking the sender.
+    Its connection is shut down, so the writer thread blocked sending to it finishes."""
+    client, server = socket.socketpair()
+
+    class StalledWebsocket:
+        def __init__(self):
+            self.socket = server
+            self.closed = False
+
+        def send(self, frame):
+            while True:
+                server.sendall(b"x" * 65536)  # the client never reads, so this blocks until the socket is shut down.
+
+        def close(self):
+            self.closed = True
+
+    websocket = StalledWebsocket()
+    writer = impsio.WebSocketWriter(websocket, queue_size=4)
+    start = time.perf_counter()
+    results = [writer.put(["frame"]) for _ in range(10)]
+    assert time.perf_counter() - start < 0.1
+    assert not all(results)
+    assert writer.dropped
+    writer.thread.join(timeout=1.0)
+    assert not writer.thread.is_alive()
+    assert websocket.closed
+    client.close()
+    server.close()
+
+
 def test_osc_server(default_config, sparse_callback, dense_callback, output_values):
     sender = impsio.OSCServer(
         default_config, sparse_callback, dense_callback
@@ -118,6 +222,291 @@ def test_osc_server(default_config, sparse_callback, dense_callback, output_valu
     time.sleep(0.1)
 
 
+@pytest.fixture
+def osc_receiver(default_config):
+    """A UDP socket listening on the OSC client port, to receive IMPSY's OSC output."""
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", default_config["osc"]["client_port"]))
+    receiver.settimeout(1.0)
+    yield receiver
+    receiver.close()
+
+
+def test_osc_output_message(default_config, sparse_callback, dense_callback, output_values, osc_receiver):
+    """Outputs are sent as /impsy messages with one float per value."""
+    sender = impsio.OSCServer(default_config, sparse_callback, dense_callback)
+    sender.send(output_values)
+    message = OscMessage(osc_receiver.recv(1024))
+    assert message.address == "/impsy"
+    assert message.params == pytest.approx(list(output_values), abs=1e-6)
+    # the prepared buffer is reused, so a second send has the new values.
+    sender.send(1 - output_values)
+    message = OscMessage(osc_receiver.recv(1024))
+    assert message.params == pytest.approx(list(1 - output_values), abs=1e-6)
+
+
+def test_osc_output_socket_closed(default_config, sparse_callback, dense_callback, output_values, osc_receiver):
+    """Disconnecting closes the output socket and connecting again reopens it."""
+    sender = impsio.OSCServer(default_config, sparse_callback, dense_callback)
+    sender.connect()
+    output_socket = sender.output_socket
+    sender.disconnect()
+    assert sender.output_socket is None
+    assert output_socket.fileno() == -1
+    sender.connect()
+    sender.send(output_values)
+    message = OscMessage(osc_receiver.recv(1024))
+    assert message.params == pytest.approx(list(output_values), abs=1e-6)
+    sender.disconnect()
+
+
+def test_osc_output_bundle(default_config, sparse_callback, dense_callback, output_values, osc_receiver):
+    """With bundle_latency set, outputs are time tagged with the time they should sound plus the latency."""
+    config = {**default_config, "osc": {**default_config["osc"], "bundle_latency": 0.05}}
+    sender = impsio.OSCServer(config, sparse_callback, dense_callback)
+    play_time = clock.now_ns() + 250_000_000
+    sender.send(output_values, timestamp=play_time)
+    bundle = OscBundle(osc_receiver.recv(1024))
+    assert bundle.timestamp == pytest.approx(clock.wall_time(play_time) + 0.05, abs=1e-3)
+    message = bundle.content(0)
+    assert message.address == "/impsy"
+    assert message.params == pytest.approx(list(output_values), abs=1e-6)
+
+
+def test_osc_server_blocking(default_config, sparse_callback):
+    """With threading off, OSC messages are handled in one thread in the order they are sent."""
+    received = []
+    config = {**default_config, "osc": {**default_config["osc"], "threading": False}}
+    sender = impsio.OSCServer(config, sparse_callback, lambda values, timestamp=None: received.append(values))
+    sender.connect()
+    client = udp_client.SimpleUDPClient("127.0.0.1", config["osc"]["server_port"])
+    for i in range(20):
+        client.send_message("/interface", [i / 20, 0.5])
+    time.sleep(0.1)
+    sender.disconnect()
+    assert [values[0] for values in received] == pytest.approx([i / 20 for i in range(20)])
+
+
+def test_osc_metrics_query(default_config, sparse_callback, dense_callback):
+    """Query timing metrics from an OSCServer and get a JSON reply."""
+    m = metrics.Metrics()
+    m.histogram("generate").record(2_000_000)
+    sender = impsio.OSCServer(
+        default_config, sparse_callback, dense_callback, metrics=m
+    )
+    sender.connect()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(1.0)
+        sock.sendto(OscMessageBuilder(address="/metrics").build().dgram, ("127.0.0.1", default_config["osc"]["server_port"]))
+        reply = OscMessage(sock.recv(65536))
+    sender.disconnect()
+    snapshot = json.loads(reply.params[0])
+    assert snapshot["histograms"]["generate"]["count"] == 1
+
+
+def test_osc_model_message(default_config, sparse_callback, dense_callback):
+    """A /model message is passed on to the control callback."""
+    commands = []
+    sender = impsio.OSCServer(
+        default_config, sparse_callback, dense_callback, control_callback=lambda c, a: commands.append((c, a))
+    )
+    sender.connect()
+    client = udp_client.SimpleUDPClient("127.0.0.1", default_config["osc"]["server_port"])
+    client.send_message("/model", ["models/test.tflite", 1])
+    time.sleep(0.1)
+    sender.disconnect()
+    assert commands == [("model", ["models/test.tflite", 1])]
+
+
+def test_osc_temperature_and_timescale_messages(default_config, sparse_callback, dense_callback):
+    """/temperature and /timescale messages are passed on to the control callback."""
+    commands = []
+    sender = impsio.OSCServer(
+        default_config, sparse_callback, dense_callback, control_callback=lambda c, a: commands.append((c, a))
+    )
+    sender.connect()
+    client = udp_client.SimpleUDPClient("127.0.0.1", default_config["osc"]["server_port"])
+    client.send_message("/temperature", [0.5, 2.0])
+    time.sleep(0.05)
+    client.send_message("/timescale", [2.0])
+    time.sleep(0.1)
+    sender.disconnect()
+    assert commands == [("temperature", [0.5, 2.0]), ("timescale", [2.0])]
+
+
+def test_osc_server_asyncio(default_config, sparse_callback):
+    """OSC messages are received on an asyncio event loop in the order they are sent."""
+    received = []
+    sender = impsio.OSCServer(default_config, sparse_callback, lambda values, timestamp=None: received.append(values))
+
+    async def run():
+        await sender.connect_async(asyncio.get_running_loop())
+        client = udp_client.SimpleUDPClient("127.0.0.1", default_config["osc"]["server_port"])
+        for i in range(20):
+            client.send_message("/interface", [i / 20, 0.5])
+        await asyncio.sleep(0.1)
+        await sender.disconnect_async()
+
+    asyncio.run(run())
+    assert [values[0] for values in received] == pytest.approx([i / 20 for i in range(20)])
+
+
+def test_websocket_server_asyncio(default_config, dense_callback):
+    """Websocket input and output work with the server on an asyncio event loop."""
+    received = []
+    sender = impsio.WebSocketServer(default_config, lambda index, value, timestamp=None: received.append((index, value)), dense_callback)
+    cc_input = default_config["midi"]["input"][0] # ["control_change", channel, control]
+
+    def client_session():
+        with websocket_connect(f"ws://127.0.0.1:{default_config['websocket']['server_port']}") as ws:
+            ws.send(f"/channel/{cc_input[1]}/cc/{cc_input[2]}/64")
+            time.sleep(0.1)
+            sender.send(np.zeros(default_config["model"]["dimension"] - 1))  # from another thread, like the playback loop.
+            replies = [ws.recv(timeout=1.0)]
+            try:
+                while True:
+                    replies.append(ws.recv(timeout=0.1))  # read everything so the client can close cleanly.
+            except TimeoutError:
+                pass
+            return replies
+
+    async def run():
+        await sender.connect_async(asyncio.get_running_loop())
+        replies = await asyncio.to_thread(client_session)
+        await sender.disconnect_async()
+        return replies
+
+    replies = asyncio.run(run())
+    assert received == [(0, 64 / 127.0)]
+    assert len(replies) == len(default_config["websocket"]["output"])
+    assert all(reply.startswith("/channel/") for reply in replies)
+
+
+def test_serial_servers_asyncio(default_config, sparse_callback, dense_callback):
+    """Serial servers connect and disconnect on an event loop, even when the port can't be opened."""
+    async def run():
+        for server_class in [impsio.SerialServer, impsio.SerialMIDIServer]:
+            sender = server_class(default_config, sparse_callback, dense_callback)
+            await sender.connect_async(asyncio.get_running_loop())
+            await sender.disconnect_async()
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def serial_pty(default_config):
+    """A pseudo-terminal standing in for a serial device. Yields (config with its port, device side file descriptor)."""
+    pytest.importorskip("termios", reason="pseudo-terminals aren't available on Windows.")
+    import pty
+    import tty
+
+    device_fd, port_fd = pty.openpty()
+    tty.setraw(device_fd)
+    tty.setraw(port_fd)
+    port_name = os.ttyname(port_fd)
+    config = {
+        **default_config,
+        "serial": {**default_config["serial"], "port": port_name},
+        "serialmidi": {**default_config["serialmidi"], "port": port_name},
+    }
+    yield config, device_fd
+    os.close(device_fd)
+    os.close(port_fd)
+
+
+def read_pty(device_fd, timeout: float = 1.0) -> bytes:
+    """Reads whatever a serial server has written to a pty."""
+    data = b""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        readable, _, _ = select.select([device_fd], [], [], 0.05)
+        if readable:
+            data += os.read(device_fd, 4096)
+        elif data:
+            break
+    return data
+
+
+def test_serial_server_csv_burst(serial_pty, sparse_callback):
+    """A burst of CSV lines is parsed in bulk, with a partial line kept for later."""
+    config, device_fd = serial_pty
+    size = config["model"]["dimension"] - 1
+    received = []
+    sender = impsio.SerialServer(config, sparse_callback, lambda values, timestamp=None: received.append(values))
+    sender.connect()
+    lines = [",".join(f"{(i + j) % 10 / 10:.1f}" for j in range(size)) for i in range(200)]
+    os.write(device_fd, ("\n".join(lines) + "\n0.5,0.").encode())
+    deadline = time.time() + 1.0
+    while len(received) < 200 and time.time() < deadline:
+        time.sleep(0.05)  # the pty can pass a burst on in a few chunks.
+        sender.handle()
+    assert len(received) == 200
+    assert list(received[7]) == pytest.approx([(7 + j) % 10 / 10 for j in range(size)])
+    os.write(device_fd, ("5" + ",0.5" * (size - 2) + "\nnot,a,number\n").encode())
+    time.sleep(0.1)
+    sender.handle()
+    assert len(received) == 201
+    assert list(received[-1]) == pytest.approx([0.5] * size)
+    # lines with too many and too few values are dropped, not re-split into frames.
+    os.write(device_fd, ((",0.1" * (size + 1))[1:] + "\n" + (",0.2" * (size - 1))[1:] + "\n").encode())
+    time.sleep(0.1)
+    sender.handle()
+    assert len(received) == 201
+    sender.disconnect()
+
+
+def test_serial_server_binary(serial_pty, sparse_callback, output_values):
+    """Binary frames are found after noise, and outputs are sent as binary frames."""
+    config, device_fd = serial_pty
+    config["serial"]["binary"] = True
+    received = []
+    sender = impsio.SerialServer(config, sparse_callback, lambda values, timestamp=None: received.append(values))
+    sender.connect()
+    frames = [impsio.SERIAL_FRAME_HEADER + np.full(len(output_values), i / 10, dtype="<f4").tobytes() for i in range(10)]
+    data = b"\x00\x01" + b"".join(frames)
+    os.write(device_fd, data[:-5])
+    time.sleep(0.1)
+    sender.handle()
+    assert len(received) == 9
+    os.write(device_fd, data[-5:])
+    time.sleep(0.1)
+    sender.handle()
+    assert len(received) == 10
+    assert list(received[9]) == pytest.approx([0.9] * len(output_values))
+    sender.send(output_values)
+    sent = read_pty(device_fd)
+    assert sent[:2] == impsio.SERIAL_FRAME_HEADER
+    assert np.frombuffer(sent[2:], dtype="<f4") == pytest.approx(output_values, abs=1e-6)
+    sender.disconnect()
+
+
+def test_serial_midi_server_burst(serial_pty, dense_callback, output_values):
+    """A burst of MIDI using running status and 2-byte messages is all handled in one handle() call."""
+    config, device_fd = serial_pty
+    received = []
+    sender = impsio.SerialMIDIServer(config, lambda index, value, timestamp=None: received.append((index, value)), dense_callback)
+    sender.connect()
+    cc_input = config["serialmidi"]["input"][1]  # ["control_change", channel, control]
+    burst = bytearray([0xB0 + cc_input[1] - 1])
+    for i in range(1000):
+        burst += bytes([cc_input[2], i % 128])  # running status: no status byte after the first message.
+    burst += bytes([0xC0, 5])  # a 2-byte program change, which isn't mapped to an input.
+    burst += mido.Message("control_change", channel=cc_input[1] - 1, control=cc_input[2], value=64).bin()
+    os.write(device_fd, bytes(burst))
+    time.sleep(0.2)
+    start = time.perf_counter()
+    sender.handle()
+    duration = time.perf_counter() - start
+    assert len(received) == 1001
+    assert received[-1] == (1, 64 / 127.0)
+    assert duration < 1.0
+    # outputs are written all at once.
+    sender.send(output_values)
+    sent = mido.parse_all(read_pty(device_fd))
+    assert len(sent) == len(config["serialmidi"]["output"])
+    sender.disconnect()
+
+
 def test_serial_server(default_config, sparse_callback, dense_callback, output_values):
     sender = impsio.SerialServer(
         default_config, sparse_callback, dense_callback
@@ -146,3 +535,19 @@ def test_midi_server(default_config, sparse_callback, dense_callback, output_val
     sender.handle()
     sender.send(output_values)
     sender.disconnect()
+
+
+def test_midi_input_timestamps(default_config, dense_callback):
+    """MIDI input is timestamped when the port callback receives it."""
+    received = []
+    sender = impsio.MIDIServer(
+        default_config, lambda index, value, timestamp=None: received.append((index, value, timestamp)), dense_callback
+    )
+    cc_input = default_config["midi"]["input"][0]  # ["control_change", channel, control]
+    before = clock.now_ns()
+    sender.receive_midi_message(mido.Message("control_change", channel=cc_input[1] - 1, control=cc_input[2], value=64))
+    sender.receive_midi_message(mido.Message("pitchwheel", pitch=0))  # not mapped, ignored.
+    assert len(received) == 1
+    index, value, timestamp = received[0]
+    assert (index, value) == (0, 64 / 127.0)
+    assert before <= timestamp <= clock.now_ns()
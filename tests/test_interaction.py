@@ -41,6 +41,18 @@ def test_logging(logger, dimension):
     interaction.close_log(logger)
 
 
+def test_session_logging(default_dimension, log_location):
+    """Named sessions log to their own files."""
+    loggers = [interaction.setup_logging(default_dimension, location=log_location, delay_file_open=False, name=name) for name in ["a", "b"]]
+    for (logger, _), value in zip(loggers, [0.25, 0.75]):
+        interaction.log_interaction("interface", [value] * (default_dimension - 1), logger)
+    for (logger, log_name), value in zip(loggers, [0.25, 0.75]):
+        interaction.close_log(logger)
+        lines = (Path(log_location) / log_name).read_text().splitlines()
+        assert len(lines) == 1
+        assert lines[0].endswith(f"interface,{','.join([str(value)] * (default_dimension - 1))}")
+
+
 @pytest.fixture(scope="session")
 def default_neural_network(default_config):
     net = interaction.build_network(default_config)
@@ -51,6 +63,36 @@ def test_build_network(default_neural_network):
     pass
 
 
+def test_build_network_latency_budget(default_config, dimension, keras_file, tflite_file):
+    """Selects between the trained test models with a latency budget."""
+    config = {**default_config, "model": {**default_config["model"]}}
+    config["model"]["dimension"] = dimension
+    config["model"]["file"] = str(keras_file)
+    config["model"]["candidates"] = [str(keras_file), str(tflite_file)]
+    config["model"]["latency_budget_ms"] = 1000
+    net = interaction.build_network(config)
+    assert net.model_file in [keras_file, tflite_file]
+    assert config["model"]["file"] == str(net.model_file)
+
+
+def test_find_candidate_models(default_config, tmp_path):
+    """Without a candidates list, only conversions of the configured model are candidates, not other models next to it."""
+    name = "20240601-12_00_00-musicMDRNN-dim9-layers2-units64-mixtures5-scale10"
+    model_file = tmp_path / f"{name}.keras"
+    variants = [model_file, tmp_path / f"{name}.tflite", tmp_path / f"{name}-builtins-dynamic.tflite"]
+    others = [
+        tmp_path / "20240702-12_00_00-musicMDRNN-dim9-layers1-units32-mixtures5-scale10.tflite",
+        tmp_path / f"{name}-ckpt.keras",
+    ]
+    for f in variants + others:
+        f.write_bytes(b"a model")
+    config = {**default_config, "model": {**default_config["model"], "dimension": 9}}
+    candidates = interaction.find_candidate_models(config, model_file, {})
+    assert sorted(f for f, _ in candidates) == sorted(variants)
+    config["model"]["candidates"] = [str(f) for f in others[:1]]
+    assert [f for f, _ in interaction.find_candidate_models(config, model_file, {})] == others[:1]
+
+
 @pytest.fixture(scope="session")
 def interaction_server(default_config, log_location):
     interaction_server = interaction.InteractionServer(default_config, log_location=log_location)
@@ -83,6 +125,83 @@ def test_dense_callback(interaction_server, default_dimension):
     interaction_server.dense_callback(values)
 
 
+def test_input_timestamps(interaction_server, default_dimension):
+    """Input dt values come from arrival timestamps when the IO provides them."""
+    arrival = interaction_server.last_user_interaction_time + 1_000_000_000
+    interaction_server.construct_input_list(0, 0.5, timestamp=arrival)
+    interaction_server.dense_callback(np.random.rand(default_dimension - 1), timestamp=arrival + 250_000_000)
+    assert interaction_server.last_user_interaction_data[0] == 0.25
+    assert interaction_server.last_user_interaction_time == arrival + 250_000_000
+    # an input from another IO thread arriving out of order doesn't move the last interaction time back.
+    interaction_server.construct_input_list(0, 0.5, timestamp=arrival + 100_000_000)
+    assert interaction_server.last_user_interaction_data[0] == 0.0
+    assert interaction_server.last_user_interaction_time == arrival + 250_000_000
+    interaction_server.construct_input_list(0, 0.5, timestamp=arrival + 500_000_000)
+    assert interaction_server.last_user_interaction_data[0] == 0.25
+
+
+def test_queued_inputs(interaction_server, default_dimension):
+    """Each queued input is a copy of the interaction data, later inputs don't change it."""
+    interaction_server.clear_event_queue(interaction_server.interface_input_queue)
+    available = interaction_server.events.available()
+    interaction_server.construct_input_list(0, 0.25)
+    interaction_server.construct_input_list(0, 0.75)
+    first, second = [interaction_server.interface_input_queue.get_nowait() for _ in range(2)]
+    assert interaction_server.events.values[first][1] == 0.25
+    assert interaction_server.events.values[second][1] == 0.75
+    assert interaction_server.events.sources[first] == interaction.SOURCE_INTERFACE
+    for index in [first, second]:
+        interaction_server.events.release(index)
+    assert interaction_server.events.available() == available
+
+
+@pytest.mark.parametrize("dense_input_thru", [True, False])
+def test_dense_input_thru(interaction_server, default_dimension, monkeypatch, dense_input_thru):
+    """Dense inputs (e.g., from OSC) are only sent straight to the outputs with dense_input_thru, input_thru is for sparse inputs."""
+    sent = []
+    monkeypatch.setattr(interaction_server, "send_back_values", lambda values: sent.append(np.array(values)))
+    monkeypatch.setitem(interaction_server.config["interaction"], "input_thru", True)
+    monkeypatch.setitem(interaction_server.config["interaction"], "dense_input_thru", dense_input_thru)
+    values = np.random.rand(default_dimension - 1)
+    interaction_server.dense_callback(values)
+    interaction_server.construct_input_list(0, 0.5)
+    if dense_input_thru:
+        assert len(sent) == 2
+        assert sent[0] == pytest.approx(values)
+    else:
+        assert len(sent) == 1
+    interaction_server.clear_event_queue(interaction_server.interface_input_queue)
+
+
 def test_send_values(interaction_server, default_dimension):
     values = np.random.rand(default_dimension - 1)
     interaction_server.send_back_values(values)
+
+
+def test_runtime_parameters(interaction_server):
+    """Temperature and timescale changes reach the running model and playback loop."""
+    interaction_server.net = interaction.build_network(interaction_server.config)
+    params = interaction_server.params
+    original = (params.sigma_temp, params.pi_temp, params.timescale)
+    interaction_server.control_callback("temperature", [0.2, 3.0])
+    interaction_server.control_callback("timescale", [0.5])
+    assert interaction_server.net.sigma_temp == 0.2
+    assert interaction_server.net.pi_temp == 3.0
+    assert interaction_server.params.timescale == 0.5
+    # out of range values are ignored.
+    assert not interaction_server.set_temperature(0, 1.0)
+    assert not interaction_server.set_timescale(-1)
+    assert interaction_server.params.sigma_temp == 0.2
+    assert interaction_server.params.timescale == 0.5
+    interaction_server.set_temperature(*original[:2])
+    interaction_server.set_timescale(original[2])
+
+
+def test_swap_model(interaction_server, default_dimension):
+    """Swap a (dummy) model in the background and check it replaces the running one."""
+    assert interaction_server.swap_model(Path("models/no-model-here"), keep_state=True)
+    interaction_server.model_swap_thread.join(timeout=10)
+    assert interaction_server.net is not None
+    assert interaction_server.net.dimension == default_dimension
+    # models of a different dimension can't be swapped in.
+    assert not interaction_server.swap_model(Path(f"models/musicMDRNN-dim{default_dimension + 1}-layers2-units64-mixtures5-scale10.tflite"))
@@ -0,0 +1,33 @@
+from impsy import metrics
+import random
+
+
+def test_bucket_bounds():
+    """Every value falls in a bucket whose lower bound is within the histogram's precision."""
+    for value in list(range(1000)) + [random.randrange(2**40) for _ in range(1000)]:
+        index = metrics.bucket_index(value)
+        lower = metrics.bucket_lower_bound(index)
+        assert lower <= value
+        assert value - lower <= max(1, value / metrics.SUB_BUCKETS)
+
+
+def test_latency_histogram():
+    histogram = metrics.LatencyHistogram()
+    for ms in range(1, 101):
+        histogram.record(ms * 1_000_000)
+    summary = histogram.summary()
+    assert summary["count"] == 100
+    assert summary["max_ms"] == 100
+    assert 45 < summary["p50_ms"] <= 50
+    assert 93 < summary["p99_ms"] <= 99
+    histogram.reset()
+    assert histogram.summary()["count"] == 0
+
+
+def test_metrics_snapshot():
+    m = metrics.Metrics()
+    m.histogram("generate").record(1000)
+    m.increment("switch_to_call")
+    snapshot = m.snapshot()
+    assert snapshot["histograms"]["generate"]["count"] == 1
+    assert snapshot["counters"]["switch_to_call"] == 1
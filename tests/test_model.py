@@ -1,6 +1,7 @@
 from impsy import mdrnn
 from impsy import train
 from impsy import utils
+from impsy import registry
 import tensorflow as tf
 import pytest
 from pathlib import Path
@@ -44,6 +45,13 @@ def test_model_config():
     assert conf["units"] == utils.SIZE_TO_PARAMETERS['s']['units']
 
 
+def test_model_file_parameters():
+    """Tests reading model parameters from a model file name."""
+    params = utils.model_file_parameters("models/musicMDRNN-dim9-layers2-units64-mixtures5-scale10.tflite")
+    assert params == {"dimension": 9, "units": 64, "mixes": 5, "layers": 2}
+    assert utils.model_file_parameters("models/my-model.tflite") is None
+
+
 ### inference model tests.
 
 
@@ -103,3 +111,29 @@ def test_dummy_model():
     value = mdrnn.random_sample(out_dim=dimension)
     value = model.generate(value)
     assert len(value) == dimension
+
+
+def test_model_cache(keras_file, tflite_file, dimension, units, mixtures, layers):
+    """Models made from the same file with a cache share weights but keep their own LSTM states."""
+    cache = mdrnn.ModelCache()
+    first = mdrnn.KerasMDRNN(keras_file, dimension, units, mixtures, layers, cache)
+    second = mdrnn.KerasMDRNN(keras_file, dimension, units, mixtures, layers, cache)
+    assert first.model is second.model
+    first.generate(mdrnn.random_sample(out_dim=dimension))
+    assert first.lstm_states is not second.lstm_states
+    first_tflite = mdrnn.TfliteMDRNN(tflite_file, dimension, units, mixtures, layers, cache)
+    second_tflite = mdrnn.TfliteMDRNN(tflite_file, dimension, units, mixtures, layers, cache)
+    assert first_tflite.interpreter is not second_tflite.interpreter
+
+
+def test_registry_weights(keras_file, dimension, units, mixtures, layers, tmp_path):
+    """Keras weights are cached by content hash, so later loads don't need to parse the model file."""
+    model_registry = registry.ModelRegistry(tmp_path)
+    first = mdrnn.KerasMDRNN(keras_file, dimension, units, mixtures, layers, mdrnn.ModelCache(model_registry))
+    content_hash = model_registry.fingerprint(keras_file)
+    assert (tmp_path / f"{content_hash}-weights.npz").exists()
+    second = mdrnn.KerasMDRNN(keras_file, dimension, units, mixtures, layers, mdrnn.ModelCache(registry.ModelRegistry(tmp_path)))
+    assert first.model is not second.model
+    for a, b in zip(first.model.get_weights(), second.model.get_weights()):
+        assert (a == b).all()
+    second.generate(mdrnn.random_sample(out_dim=dimension))
@@ -0,0 +1,49 @@
+from impsy import registry
+import numpy as np
+import os
+
+
+def test_model_fingerprints(tmp_path):
+    """Model files are identified by content, and hashes are remembered until the file changes."""
+    model_file = tmp_path / "musicMDRNN-dim9-layers2-units64-mixtures5-scale10.tflite"
+    model_file.write_bytes(b"model" * 100)
+    (tmp_path / "copy.tflite").write_bytes(b"model" * 100)
+    (tmp_path / "notes.txt").write_text("not a model")
+    model_registry = registry.ModelRegistry(tmp_path / ".cache")
+    record = model_registry.describe(model_file)
+    assert record["parameters"] == {"dimension": 9, "units": 64, "mixes": 5, "layers": 2}
+    assert [r["name"] for r in model_registry.list_models(tmp_path)] == ["copy.tflite", model_file.name]
+    assert model_registry.fingerprint(tmp_path / "copy.tflite") == record["hash"]
+    # the index is saved, so another registry doesn't need to read the file.
+    assert registry.ModelRegistry(tmp_path / ".cache").index[str(model_file.resolve())]["hash"] == record["hash"]
+    model_file.write_bytes(b"changed")
+    os.utime(model_file, ns=(0, 0))
+    assert model_registry.fingerprint(model_file) != record["hash"]
+
+
+def test_artefacts(tmp_path):
+    model_file = tmp_path / "model.keras"
+    model_file.write_bytes(b"model")
+    model_registry = registry.ModelRegistry(tmp_path / ".cache")
+    made = []
+
+    def create(source, destination):
+        made.append(source)
+        destination.write_text("converted")
+
+    path = model_registry.artefact(model_file, ".tflite", create)
+    assert model_registry.artefact(model_file, ".tflite", create) == path
+    assert path.read_text() == "converted"
+    assert made == [model_file]
+
+
+def test_cached_weights(tmp_path):
+    """Weights are cached on disk, so another registry (e.g., in another process) can load them."""
+    weights = [np.random.rand(4, 8).astype(np.float32), np.arange(3), np.zeros(0)]
+    first = registry.ModelRegistry(tmp_path)
+    assert first.load_weights("abc123") is None
+    first.save_weights("abc123", weights)
+    cached = registry.ModelRegistry(tmp_path).load_weights("abc123")
+    for a, b in zip(weights, cached):
+        assert a.dtype == b.dtype
+        assert (a == b).all()
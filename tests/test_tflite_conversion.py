@@ -1,5 +1,8 @@
 from impsy import tflite_converter
+import json
+import numpy as np
 import os
+import pytest
 
 
 ### tflite conversion tests
@@ -22,4 +25,59 @@ def test_weights_to_model_file(trained_model, dimension, mdrnn_size):
 def test_model_file_to_tflite(trained_model):
     model_filename = trained_model["keras_file"]
     tflite_file = tflite_converter.model_file_to_tflite(model_filename)
-    assert os.path.exists(tflite_file)
\ No newline at end of file
+    assert os.path.exists(tflite_file)
+
+def test_mdn_negative_log_likelihood():
+    """One standard gaussian gives the textbook value, two identical mixture components give the same."""
+    one = tflite_converter.mdn_negative_log_likelihood(np.array([0.0, 1.0, 0.0]), np.array([0.0]), 1, 1)
+    assert one == pytest.approx(0.5 * np.log(2 * np.pi))
+    two = tflite_converter.mdn_negative_log_likelihood(np.array([0.0, 0.0, 1.0, 1.0, 3.0, 3.0]), np.array([0.0]), 1, 2)
+    assert two == pytest.approx(one)
+
+
+@pytest.mark.parametrize("quantisation", tflite_converter.QUANTISATION_MODES)
+def test_quantise_model(trained_model, dataset_file, models_location, quantisation):
+    """Float and quantised models are both saved, and compared on held-out data."""
+    tflite_file = tflite_converter.model_file_to_tflite(
+        trained_model["keras_file"], save_path=models_location, quantisation=quantisation, dataset=dataset_file
+    )
+    assert tflite_file.name.endswith(f"-{quantisation}.tflite")
+    report = json.loads(tflite_file.with_suffix(".json").read_text())
+    assert os.path.exists(report["float"]["file"])
+    assert np.isfinite(report["quantised"]["nll"])
+
+
+def test_builtins_model(trained_model, models_location):
+    """The builtins model has no TF (Flex) ops or loops, and is checked against the Keras model when converted."""
+    import tensorflow as tf
+
+    tflite_file = tflite_converter.model_file_to_tflite(trained_model["keras_file"], save_path=models_location, builtins=True)
+    assert tflite_file.name.endswith("-builtins.tflite")
+    ops = {op["op_name"] for op in tf.lite.Interpreter(model_path=str(tflite_file))._get_ops_details()}
+    assert not any(op.startswith("Flex") for op in ops)
+    assert "WHILE" not in ops
+
+
+def test_builtins_model_optimised(trained_model, tmp_path):
+    """Optimised builtins models are saved without the strict check against the Keras model."""
+    tflite_file = tflite_converter.model_file_to_tflite(
+        trained_model["keras_file"], save_path=tmp_path, optimise=True, builtins=True, analyse=False
+    )
+    assert tflite_file.name.endswith("-builtins.tflite")
+    assert os.path.exists(tflite_file)
+
+
+def test_convert_directory_skips_converted(tmp_path):
+    """Models already converted (by content) aren't converted again, missing outputs are restored from the cache.
+    Training checkpoints are left out."""
+    from impsy.registry import ModelRegistry
+
+    model_file = tmp_path / "musicMDRNN-dim2-layers1-units8-mixtures2-scale10.keras"
+    model_file.write_bytes(b"a model")
+    (tmp_path / "musicMDRNN-dim2-layers1-units8-mixtures2-scale10-ckpt.keras").write_bytes(b"a checkpoint")
+    registry = ModelRegistry(tmp_path / ".cache")
+    registry.artefact(model_file, tflite_converter.conversion_suffix(), lambda m, p: p.write_bytes(b"a tflite model"))
+    results = tflite_converter.convert_directory(tmp_path, analyse=False)
+    assert results["skipped"] == [model_file]
+    assert results["converted"] == results["failed"] == []
+    assert model_file.with_suffix(".tflite").read_bytes() == b"a tflite model"